@@ -0,0 +1,113 @@
+"""Token verification with cached claims and user profiles.
+
+``authenticate`` is the only auth path: a token's verified claims are kept in a
+bounded cache for a few minutes (never past ``exp``), so repeat requests skip
+``jwt.decode``. The caller's role and email come from a per-worker profile
+cache rather than from the token, and every token carries the user's
+``token_version``; bumping it (``revoke``) invalidates all tokens issued
+before. On a cache hit neither check costs a database round trip.
+
+Changes made by this worker take effect immediately; other workers see a
+demotion, revocation or deletion once their cached profile expires
+(``AUTH_PROFILE_TTL_SECONDS``).
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import jwt
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+
+TOKEN_DAYS = 30
+# The fields auth and the name lookups read; hashes and profile images never enter the cache
+PROFILE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1, "token_version": 1,
+                      "is_verified": 1, "is_blocked": 1}
+
+_MISSING = object()
+
+
+class AuthError(Exception):
+    pass
+
+
+class Authenticator:
+    def __init__(self, users, secret: str, algorithm: str = 'HS256', claims_size: int = 10_000,
+                 claims_ttl: float = 300, profile_size: int = 10_000, profile_ttl: float = 60):
+        self.users = users
+        self.secret = secret
+        self.algorithm = algorithm
+        self._claims = TTLCache(maxsize=claims_size, ttl=claims_ttl)
+        # user id -> profile document, or None for deleted users
+        self._profiles = TTLCache(maxsize=profile_size, ttl=profile_ttl)
+        self.counters = {"claims_hits": 0, "claims_misses": 0, "profile_hits": 0, "profile_misses": 0,
+                         "rejected": 0, "revoked": 0}
+
+    def create_token(self, user_id: str, email: str, role: str, version: int = 0) -> str:
+        payload = {'user_id': user_id, 'email': email, 'role': role, 'ver': version,
+                   'exp': datetime.utcnow() + timedelta(days=TOKEN_DAYS)}
+        return jwt.encode(payload, self.secret, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        """Verified claims of a token; raises AuthError"""
+        claims = self._claims.get(token)
+        if claims is not None and claims.get('exp', 0) > time.time():
+            self.counters["claims_hits"] += 1
+            return claims
+        self.counters["claims_misses"] += 1
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.PyJWTError:
+            self.counters["rejected"] += 1
+            raise AuthError("invalid token")
+        self._claims[token] = claims
+        return claims
+
+    async def profile(self, user_id: str) -> Optional[dict]:
+        """The user's ``PROFILE_PROJECTION`` fields (cached); None if the user does not exist"""
+        profile = self._profiles.get(user_id, _MISSING)
+        if profile is not _MISSING:
+            self.counters["profile_hits"] += 1
+            return profile
+        self.counters["profile_misses"] += 1
+        profile = await self.users.find_one({"id": user_id}, PROFILE_PROJECTION)
+        self._profiles[user_id] = profile
+        return profile
+
+    def invalidate(self, user_id: str):
+        """Call after changing a user's document"""
+        self._profiles.pop(user_id, None)
+
+    async def authenticate(self, token: str) -> dict:
+        """``{"user_id", "email", "role", ...}`` for a valid, unrevoked token of an existing user"""
+        claims = self.decode(token)
+        profile = await self.profile(claims.get('user_id'))
+        if profile is None or claims.get('ver', 0) != profile.get('token_version', 0):
+            self.counters["rejected"] += 1
+            raise AuthError("token revoked")
+        # Role and email as they are now, not as they were when the token was issued
+        return {**claims, "email": profile['email'], "role": profile['role']}
+
+    async def revoke(self, user_id: str) -> Optional[int]:
+        """Invalidate every token issued to the user so far; returns the new token version"""
+        user = await self.users.find_one_and_update(
+            {"id": user_id}, {"$inc": {"token_version": 1}},
+            projection={"token_version": 1}, return_document=ReturnDocument.AFTER
+        )
+        self.invalidate(user_id)
+        self.counters["revoked"] += 1
+        return user['token_version'] if user else None
+
+    def stats(self) -> dict:
+        return {**self.counters, "cached_claims": len(self._claims), "cached_profiles": len(self._profiles)}
+
+
+def authenticator_from_env(db) -> Authenticator:
+    return Authenticator(
+        db.users,
+        os.getenv('JWT_SECRET', 'your-secret-key-change-in-production'),
+        claims_size=int(os.getenv('AUTH_CLAIMS_CACHE_SIZE', '10000')),
+        profile_size=int(os.getenv('AUTH_PROFILE_CACHE_SIZE', '10000')),
+        profile_ttl=float(os.getenv('AUTH_PROFILE_TTL_SECONDS', '60')),
+    )
@@ -0,0 +1,489 @@
+"""In-process load test of the API against a local MongoDB.
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/load.py --users 2000 --listings 20000 --duration 60
+    python benchmarks/load.py --users 10000 --mix inbox=1 --concurrency 200   # 10k users polling their inbox
+    python benchmarks/load.py --preset listings-100k --save-baseline feed-100k.json
+    python benchmarks/load.py --save-baseline benchmarks/load_baseline.json
+    python benchmarks/load.py --baseline benchmarks/load_baseline.json --threshold 0.25
+
+The app runs in this process behind httpx.ASGITransport (no sockets, no
+uvicorn), so the figures are the cost of the application and its database
+round trips. The database named by --db is dropped, seeded with users,
+listings with media, conversations, offers and reviews, and dropped again at
+the end unless --keep. Virtual clients run weighted scenarios (feed browsing,
+inbox polling, login bursts, search) for --duration seconds after a warm-up.
+Per route it reports throughput, p50/p95/p99 latency, response bytes as
+transferred (after Content-Encoding) and MongoDB commands per request, counted
+by a pymongo CommandListener. --preset picks the settings of a named
+measurement (see PRESETS); options given explicitly still override it.
+
+With --baseline the run fails (exit 1) if a route's p95 latency, response
+bytes or commands per request grew, or the total throughput dropped, by more
+than --threshold.
+Latency baselines are only comparable on the same machine; BCRYPT_ROUNDS and
+the other server settings are read from the environment as usual.
+"""
+import argparse
+import asyncio
+import base64
+import contextvars
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+from pymongo import monitoring  # noqa: E402
+
+PASSWORD = "Passwort123"
+CITIES = ["Berlin", "Hamburg", "München", "Köln", "Frankfurt am Main", "Stuttgart", "Düsseldorf", "Leipzig",
+          "Dresden", "Hannover"]
+TITLES = {
+    "cars": ["gepflegt", "scheckheftgepflegt", "TÜV neu", "unfallfrei", "Garagenwagen"],
+    "electronics": ["wie neu", "mit Rechnung", "OVP", "kaum benutzt", "Displayschaden"],
+    "real_estate": ["ruhige Lage", "mit Balkon", "frisch renoviert", "provisionsfrei", "Altbau"],
+}
+WORDS = ["Angebot", "Top Zustand", "Abholung", "Versand möglich", "Schnäppchen", "Rarität", "Privatverkauf"]
+NUMBERS = {"year": (1995, 2024), "mileage": (0, 300_000), "power": (60, 450), "seats": (2, 7), "area": (20, 300),
+           "plot_area": (100, 2000), "bedrooms": (1, 6), "bathrooms": (1, 3), "rooms": (1, 8)}
+SEARCH_TERMS = ["golf", "iphone", "sofa", "wohnung", "fahrrad", "laptop", "bmw", "tisch", "kamera", "garten"]
+DEFAULT_MIX = "feed=50,inbox=30,search=15,login=5"
+PRESETS = {
+    # Payload size and tail latency of the listing feed over a large catalogue
+    "listings-100k": {"users": 10_000, "listings": 100_000, "mix": "feed=1", "concurrency": 64},
+    # Feed p99 alone and with a quarter of the clients logging in (bcrypt on the pool); compare GET /listings
+    "feed": {"mix": "feed=1", "concurrency": 64},
+    "feed-logins": {"mix": "feed=3,login=1", "concurrency": 64},
+    # Every user's client polling the unread badge at once
+    "unread-pollers": {"users": 10_000, "conversations": 20_000, "mix": "inbox=1", "concurrency": 10_000},
+}
+
+# Route of the request being served; background tasks keep the default
+ROUTE = contextvars.ContextVar("route", default="(background)")
+
+
+class CommandCounter(monitoring.CommandListener):
+    """MongoDB commands started per route (Motor runs them on threads with the caller's context)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.by_route: Dict[str, Counter] = defaultdict(Counter)
+
+    def started(self, event):
+        with self.lock:
+            self.by_route[ROUTE.get()][event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# ----- seeding -----
+
+def category_fields(category: str, fields: dict, rng: random.Random) -> dict:
+    values = {}
+    for name, field in fields.items():
+        options = field.get('options')
+        if field['type'] == 'select':
+            values[name] = rng.choice(options)
+        elif field['type'] == 'select_dynamic':
+            choices = next((options[v] for v in values.values() if isinstance(v, str) and v in options), None)
+            if choices:
+                values[name] = rng.choice(choices)
+        elif field['type'] == 'number':
+            values[name] = rng.randint(*NUMBERS.get(name, (1, 100)))
+    return values
+
+
+def jpeg(rng: random.Random) -> str:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 800), tuple(rng.randrange(256) for _ in range(3))).save(buffer, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+async def insert_chunked(collection, docs: List[dict], size: int = 1000):
+    for start in range(0, len(docs), size):
+        await collection.insert_many(docs[start:start + size], ordered=False)
+
+
+async def seed(server, args, rng: random.Random) -> dict:
+    import geo
+    import search
+    from categories import registry
+    from conversations import rebuild_conversations
+    from ratings import rebuild_ratings
+    from unread import reconcile
+
+    db = server.db
+    now = datetime.utcnow()
+    password_hash = await server.credential_service.hash(PASSWORD)
+    users = [{
+        "id": f"U{i:09d}", "name": f"Nutzer {i}", "email": f"user{i}@bench.example", "password": password_hash,
+        "role": "user", "rating": 0.0, "review_count": 0, "profile_image": None, "phone_enabled": False,
+        "is_verified": rng.random() < 0.05, "created_at": now - timedelta(days=rng.randrange(700)),
+    } for i in range(args.users)]
+    await insert_chunked(db.users, users)
+
+    # A few real renditions shared by all listings, as the media store would return them
+    media = [await server.media_store.store_images([jpeg(rng) for _ in range(3)]) for _ in range(4)]
+    categories = list(registry.fields)
+    listings = []
+    for i in range(args.listings):
+        category = rng.choice(categories)
+        fields = category_fields(category, registry.fields[category], rng)
+        title = " ".join(filter(None, [str(fields.get('brand') or fields.get('type') or category.title()),
+                                       str(fields.get('model') or ""), rng.choice(TITLES.get(category, WORDS))]))
+        description = " ".join(rng.choices(WORDS + SEARCH_TERMS, k=30))
+        location = rng.choice(CITIES)
+        seller = rng.choice(users)
+        pictures = rng.choice(media)
+        listings.append({
+            "id": f"L{i:09d}", "seller_id": seller['id'], "seller_name": seller['name'], "title": title,
+            "description": description, "price": round(rng.lognormvariate(6, 1.5), 2), "category": category,
+            "images": pictures['images'], "thumbnails": pictures['thumbnails'],
+            "medium_images": pictures['medium_images'], "videos": [], "category_fields": fields,
+            "negotiable": rng.random() < 0.4, "location": location, **geo.geo_fields(location),
+            "views": int(rng.paretovariate(1.2) * 10), "is_pinned": rng.random() < 0.01,
+            "created_at": now - timedelta(minutes=rng.randrange(60 * 24 * 365)),
+            **search.search_fields(title, description, fields),
+        })
+    await insert_chunked(db.listings, listings)
+
+    conversations, messages, offers = [], [], []
+    for c in range(args.conversations):
+        listing = rng.choice(listings)
+        buyer = rng.choice(users)
+        if buyer['id'] == listing['seller_id']:
+            continue
+        conversations.append((listing['id'], buyer['id'], listing['seller_id']))
+        started = now - timedelta(minutes=rng.randrange(60 * 24 * 60))
+        count = rng.randint(1, args.messages_per_conversation * 2 - 1)
+        for m in range(count):
+            sender, recipient = (buyer['id'], listing['seller_id']) if m % 2 == 0 else (listing['seller_id'], buyer['id'])
+            messages.append({
+                "id": f"M{c:08d}{m:04d}", "from_user_id": sender, "to_user_id": recipient, "listing_id": listing['id'],
+                "content": " ".join(rng.choices(WORDS, k=rng.randint(3, 12))), "message_type": "text", "images": [],
+                "audio": None, "read": m < count - 2, "created_at": started + timedelta(minutes=m * 7),
+            })
+        if rng.random() < 0.3:
+            offers.append({
+                "id": f"O{c:09d}", "listing_id": listing['id'], "buyer_id": buyer['id'],
+                "seller_id": listing['seller_id'], "offered_price": round(listing['price'] * 0.8, 2),
+                "message": None, "status": rng.choice(["pending", "accepted", "rejected"]), "created_at": started,
+            })
+    await insert_chunked(db.messages, messages)
+    await insert_chunked(db.offers, offers)
+
+    reviews, reviewed = [], set()
+    for r in range(args.reviews):
+        reviewer, target = rng.choice(users), rng.choice(users)
+        if reviewer is target or (reviewer['id'], target['id']) in reviewed:
+            continue
+        reviewed.add((reviewer['id'], target['id']))
+        reviews.append({
+            "id": f"R{r:09d}", "reviewer_id": reviewer['id'], "reviewer_name": reviewer['name'],
+            "reviewed_user_id": target['id'], "rating": rng.choice([5, 5, 5, 4, 4, 3, 2, 1]),
+            "comment": rng.choice([None, "Alles bestens", "Gerne wieder", "Schneller Versand"]),
+            "created_at": now - timedelta(days=rng.randrange(365)),
+        })
+    await insert_chunked(db.reviews, reviews)
+
+    # Derived data exactly as the maintenance commands build it
+    await rebuild_conversations(db)
+    await reconcile(db)
+    await rebuild_ratings(db)
+    return {
+        "users": [(user['id'], user['email']) for user in users],
+        "listings": [(listing['id'], listing['category']) for listing in listings],
+        "conversations": conversations,
+        "tokens": {},
+        "counts": {"users": len(users), "listings": len(listings), "messages": len(messages),
+                   "conversations": len(conversations), "offers": len(offers), "reviews": len(reviews)},
+    }
+
+
+# ----- workload -----
+
+class Recorder:
+    def __init__(self):
+        self.recording = False
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.bytes: Dict[str, int] = Counter()
+        self.errors: Counter = Counter()
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs) -> httpx.Response:
+        token = ROUTE.set(route)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            ROUTE.reset(token)
+        if self.recording:
+            self.latencies[route].append((time.perf_counter() - started) * 1000)
+            self.bytes[route] += response.num_bytes_downloaded
+            if response.status_code >= 400:
+                self.errors[route] += 1
+        return response
+
+
+class Session:
+    """One virtual client: a random user, sometimes logged out"""
+
+    def __init__(self, server, client: httpx.AsyncClient, recorder: Recorder, data: dict, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.data = data
+        self.rng = rng
+        self.user_id, self.email = rng.choice(data['users'])
+        tokens = data['tokens']
+        if self.user_id not in tokens:
+            tokens[self.user_id] = server.create_token(self.user_id, self.email, "user")
+        self.headers = {"Authorization": "Bearer " + tokens[self.user_id]}
+
+    async def get(self, route: str, url: str, auth: bool = True, **kwargs) -> httpx.Response:
+        return await self.recorder.request(self.client, route, "GET", url, headers=self.headers if auth else None, **kwargs)
+
+
+async def feed(session: Session):
+    rng = session.rng
+    guest = rng.random() < 0.5
+    params = {"limit": 20}
+    if rng.random() < 0.5:
+        params["category"] = rng.choice(session.data['listings'])[1]
+    if rng.random() < 0.2:
+        params["sort"] = "popular"
+    page = await session.get("GET /listings", "/listings", auth=not guest, params=params)
+    cursor = page.headers.get("X-Next-Cursor")
+    if cursor and rng.random() < 0.5:
+        page = await session.get("GET /listings", "/listings", auth=not guest, params={**params, "cursor": cursor})
+    rows = page.json() if page.status_code == 200 else []
+    if rows:
+        listing_id = rng.choice(rows)['id']
+        await session.get("GET /listings/{listing_id}", f"/listings/{listing_id}", auth=not guest)
+        await session.get("GET /recommendations/similar/{listing_id}", f"/recommendations/similar/{listing_id}")
+    if "category" in params and rng.random() < 0.3:
+        await session.get("GET /listings/facets", "/listings/facets", params={"category": params["category"]})
+    await session.get("GET /recommendations/for-you", "/recommendations/for-you", auth=not guest)
+
+
+async def inbox(session: Session):
+    # Clients poll the badge far more often than they open the inbox
+    for _ in range(3):
+        await session.get("GET /messages/unread-count", "/messages/unread-count")
+    if session.rng.random() < 0.3:
+        response = await session.get("GET /messages/conversations", "/messages/conversations")
+        rows = response.json() if response.status_code == 200 else []
+        if rows:
+            row = session.rng.choice(rows)
+            await session.get("GET /messages/{listing_id}/{other_user_id}",
+                              f"/messages/{row['listing_id']}/{row['other_user_id']}")
+
+
+async def search(session: Session):
+    rng = session.rng
+    term = rng.choice(SEARCH_TERMS)
+    await session.get("GET /listings/autocomplete", "/listings/autocomplete", auth=False, params={"q": term[:3]})
+    params = {"search": term, "limit": 20}
+    if rng.random() < 0.3:
+        params.update(near=rng.choice(CITIES), radius_km=50)
+    await session.get("GET /listings?search", "/listings", auth=False, params=params)
+
+
+async def login(session: Session):
+    await session.recorder.request(session.client, "POST /auth/login", "POST", "/auth/login",
+                                   json={"email": session.email, "password": PASSWORD})
+
+
+SCENARIOS = {"feed": feed, "inbox": inbox, "search": search, "login": login}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def virtual_client(server, client, recorder: Recorder, data: dict, mix: Dict[str, float], deadline: float, seed: int):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        session = Session(server, client, recorder, data, rng)
+        await SCENARIOS[rng.choices(names, weights)[0]](session)
+
+
+# ----- report -----
+
+def percentile(samples, p):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def summarize(recorder: Recorder, commands: CommandCounter, seconds: float, config: dict) -> dict:
+    routes = {}
+    for route, samples in sorted(recorder.latencies.items()):
+        n = len(samples)
+        by_name = commands.by_route.get(route, Counter())
+        routes[route] = {
+            "requests": n,
+            "errors": recorder.errors[route],
+            "rps": round(n / seconds, 1),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+            "mean_ms": round(statistics.mean(samples), 2),
+            "bytes": round(recorder.bytes[route] / n),
+            "mongo_commands": round(sum(by_name.values()) / n, 2),
+            "commands": {name: round(count / n, 2) for name, count in by_name.most_common()},
+        }
+    total = sum(route['requests'] for route in routes.values())
+    background = commands.by_route.get("(background)", Counter())
+    return {
+        "config": config,
+        "total": {"requests": total, "errors": sum(recorder.errors.values()), "rps": round(total / seconds, 1),
+                  "background_commands": sum(background.values())},
+        "routes": routes,
+    }
+
+
+def regressions(result: dict, baseline: dict, threshold: float) -> List[str]:
+    problems = []
+    for route, base in baseline['routes'].items():
+        now = result['routes'].get(route)
+        if now is None:
+            continue
+        if now['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            problems.append(f"{route}: p95 {base['p95_ms']} -> {now['p95_ms']} ms")
+        if now.get('bytes', 0) > base.get('bytes', now.get('bytes', 0)) * (1 + threshold):
+            problems.append(f"{route}: {base['bytes']} -> {now['bytes']} response bytes")
+        if now['mongo_commands'] > base['mongo_commands'] * (1 + threshold):
+            problems.append(f"{route}: {base['mongo_commands']} -> {now['mongo_commands']} MongoDB commands per request")
+    if result['total']['rps'] < baseline['total']['rps'] * (1 - threshold):
+        problems.append(f"throughput {baseline['total']['rps']} -> {result['total']['rps']} requests/s")
+    return problems
+
+
+# ----- main -----
+
+async def run(args, commands: CommandCounter) -> dict:
+    import server
+
+    rng = random.Random(args.seed)
+    try:
+        await server.client.admin.command("ping")
+    except Exception as e:
+        raise SystemExit(f"No MongoDB at {args.mongo_url}: {e}")
+    await server.client.drop_database(args.db)
+    app_started = False
+    try:
+        started = time.perf_counter()
+        data = await seed(server, args, rng)
+        print(f"seeded {data['counts']} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        await server.app.router.startup()
+        app_started = True
+        recorder = Recorder()
+        # Server errors count as failed requests instead of ending the run
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench/api", timeout=60) as client:
+            deadline = time.monotonic() + args.warmup + args.duration
+            clients = [asyncio.create_task(virtual_client(server, client, recorder, data, args.mix, deadline, args.seed + i))
+                       for i in range(args.concurrency)]
+            await asyncio.sleep(args.warmup)
+            commands.reset()
+            recorder.recording = True
+            measured_from = time.monotonic()
+            await asyncio.gather(*clients)
+            seconds = time.monotonic() - measured_from
+        config = {key: getattr(args, key) for key in ("users", "listings", "conversations", "reviews", "concurrency", "seed")}
+        config["mix"] = args.mix
+        config["preset"] = args.preset
+        return summarize(recorder, commands, seconds, config)
+    finally:
+        if not args.keep:
+            await server.client.drop_database(args.db)
+        if app_started:
+            await server.app.router.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default=os.getenv('MONGO_URL', 'mongodb://localhost:27017'))
+    parser.add_argument("--db", default="chancenmarket_load", help="Database to seed; dropped before and after the run")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--messages-per-conversation", type=int, default=6, help="Average")
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32, help="Virtual clients")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Scenario weights, default {DEFAULT_MIX}")
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, help="Fail on regressions against this result file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--save-baseline", type=Path, help="Write the result here")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="Settings of a named measurement")
+    preset = parser.parse_known_args()[0].preset
+    if preset:
+        settings = dict(PRESETS[preset])
+        settings["mix"] = parse_mix(settings["mix"])
+        parser.set_defaults(**settings)
+    args = parser.parse_args()
+
+    # The server reads its settings at import; the listener must exist before the client does
+    media_root = None
+    if 'MEDIA_ROOT' not in os.environ:
+        media_root = os.environ['MEDIA_ROOT'] = tempfile.mkdtemp(prefix="load-media-")
+    os.environ['MONGO_URL'] = args.mongo_url
+    os.environ['DB_NAME'] = args.db
+    os.environ.setdefault('STATS_SNAPSHOTS', '0')
+    # One INFO line per request would cost more than some routes
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    commands = CommandCounter()
+    monitoring.register(commands)
+    try:
+        result = asyncio.run(run(args, commands))
+    finally:
+        if media_root:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get('config') != result['config']:
+            print("warning: baseline was recorded with a different configuration", file=sys.stderr)
+        problems = regressions(result, baseline, args.threshold)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
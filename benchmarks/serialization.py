@@ -0,0 +1,108 @@
+"""Benchmark response serialization of database documents.
+
+    python benchmarks/serialization.py --rows 20 100 1000
+
+Compares, per response size and model, the old path (``Model(**doc)``, then
+FastAPI's ``response_model`` validation and ``JSONResponse``) with
+``from_docs`` + ``respond`` from serialization.py, and with unvalidated
+``model_construct`` + ``respond`` for reference. All must produce the same
+JSON. No database is needed; the documents are synthetic.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bson import ObjectId  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from models import ListingSummary, Message, Review  # noqa: E402
+from serialization import from_docs, respond  # noqa: E402
+
+
+def synthetic(model, n: int, seed: int = 1) -> List[dict]:
+    rng = random.Random(seed)
+    now = datetime(2024, 6, 1)
+    docs = []
+    for i in range(n):
+        created_at = now - timedelta(minutes=rng.randrange(500_000))
+        if model is ListingSummary:
+            doc = {"id": f"l{i}", "seller_id": f"u{rng.randrange(1000)}", "seller_name": "Max Mustermann",
+                   "title": f"VW Golf {rng.randint(1, 8)} TDI gepflegt", "price": round(rng.uniform(500, 40000), 2),
+                   "category": "cars", "images": [f"/api/media/{i:064x}"], "videos": [], "views": rng.randrange(5000),
+                   "negotiable": rng.random() < 0.5, "location": "Berlin", "is_pinned": False, "created_at": created_at}
+        elif model is Message:
+            doc = {"id": f"m{i}", "from_user_id": "u1", "to_user_id": "u2", "listing_id": "l1",
+                   "content": "Ist der Artikel noch verfügbar? " * rng.randint(1, 4), "message_type": "text",
+                   "images": [], "audio": None, "read": rng.random() < 0.7, "created_at": created_at}
+        else:
+            doc = {"id": f"r{i}", "reviewer_id": f"u{i}", "reviewer_name": "Erika", "reviewed_user_id": "u1",
+                   "rating": rng.randint(1, 5), "comment": "Alles bestens, gerne wieder.", "created_at": created_at}
+        docs.append({"_id": ObjectId(), **doc})
+    return docs
+
+
+async def validating(model, field, docs: List[dict]) -> bytes:
+    content = [model(**{k: v for k, v in doc.items() if k != '_id'}) for doc in docs]
+    return JSONResponse(await serialize_response(field=field, response_content=content, is_coroutine=True)).body
+
+
+async def fast(model, field, docs: List[dict]) -> bytes:
+    return respond(from_docs(model, docs)).body
+
+
+async def constructing(model, field, docs: List[dict]) -> bytes:
+    return respond([model.model_construct(**doc) for doc in docs]).body
+
+
+PATHS = {"validating": validating, "from_docs": fast, "model_construct": constructing}
+
+
+async def measure(fn, model, field, docs, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn(model, field, docs)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def run(args):
+    results = {}
+    for model in (ListingSummary, Message, Review):
+        field = create_response_field(name="response", type_=List[model])
+        for rows in args.rows:
+            docs = synthetic(model, rows)
+            bodies = {name: await fn(model, field, docs) for name, fn in PATHS.items()}
+            if len({json.dumps(json.loads(body), sort_keys=True) for body in bodies.values()}) != 1:
+                raise SystemExit(f"{model.__name__}: outputs differ")
+            repeat = max(5, args.repeat // rows)
+            medians = {name: statistics.median(await measure(fn, model, field, docs, repeat)) for name, fn in PATHS.items()}
+            results[f"{model.__name__}x{rows}"] = {
+                **{f"{name}_ms": round(ms, 3) for name, ms in medians.items()},
+                "speedup": round(medians["validating"] / medians["from_docs"], 1),
+                "bytes": len(bodies["from_docs"]),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20_000, help="Rows serialized per measurement series")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
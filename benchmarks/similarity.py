@@ -0,0 +1,105 @@
+"""Benchmark the similar-listings index on synthetic car listings.
+
+    python benchmarks/similarity.py --listings 1000000 --queries 1000
+
+Reports build throughput, memory of the category matrix and query latency
+percentiles. No database is needed; rows go straight into the index.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+from categories import registry  # noqa: E402
+from similarity import CategoryIndex, CategorySchema  # noqa: E402
+
+
+def synthetic_cars(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    fields = registry.fields['cars']
+    brands = [b for b in fields['brand']['options'] if b != "Andere"]
+    models = fields['model']['options']
+    for i in range(n):
+        brand = rng.choice(brands)
+        year = rng.randint(1995, 2024)
+        yield {
+            "id": f"l{i}",
+            "seller_id": f"s{rng.randrange(n // 5 + 1)}",
+            "category": "cars",
+            "price": round(rng.lognormvariate(9.5, 0.8), 2),
+            "category_fields": {
+                "brand": brand,
+                "model": rng.choice(models.get(brand) or [""]),
+                "year": year,
+                "mileage": max(0, int(rng.gauss((2025 - year) * 14000, 20000))),
+                "power": rng.randint(60, 450),
+                "seats": rng.choice([2, 4, 5, 7]),
+                "fuel_type": rng.choice(fields['fuel_type']['options']),
+                "transmission": rng.choice(fields['transmission']['options']),
+                "color": rng.choice(fields['color']['options']),
+                "condition": rng.choice(fields['condition']['options']),
+            },
+        }
+
+
+def percentile(samples, p):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=6)
+    args = parser.parse_args()
+
+    listings = list(synthetic_cars(args.listings))
+    schema = CategorySchema("cars")
+
+    started = time.perf_counter()
+    raw = np.stack([schema.raw_numeric(listing) for listing in listings])
+    schema.fit(raw)
+    index = CategoryIndex(schema, capacity=len(listings))
+    for listing, raw_row in zip(listings, raw):
+        index.put(listing['id'], listing['seller_id'], schema.encode(listing, raw_row))
+    build_seconds = time.perf_counter() - started
+
+    rng = random.Random(2)
+    latencies = []
+    for _ in range(args.queries):
+        listing_id = f"l{rng.randrange(args.listings)}"
+        t = time.perf_counter()
+        index.nearest(listing_id, args.k)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    started = time.perf_counter()
+    for listing in listings[:10_000]:
+        index.put(listing['id'], listing['seller_id'], schema.encode(listing))
+    update_ms = (time.perf_counter() - started) / min(10_000, len(listings)) * 1000
+
+    print(json.dumps({
+        "listings": args.listings,
+        "numeric_fields": len(schema.numeric),
+        "select_fields": len(schema.selects),
+        "index_mb": round((index.vectors.nbytes + index.codes.nbytes) / 2**20, 1),
+        "build_seconds": round(build_seconds, 2),
+        "build_per_second": round(args.listings / build_seconds),
+        "update_ms": round(update_ms, 4),
+        "query_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(statistics.mean(latencies), 2),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Response cache for hot read endpoints with tag-based invalidation.
+
+Entries are keyed by route name plus the query parameters that shape the
+response, expire after a per-route TTL and carry tags (``listings``,
+``listing:<id>``, ``category:<id>``, ``user:<id>``) that write paths
+invalidate. Concurrent misses on one key share a single load; if the
+request running it is cancelled, a waiting request takes the load over.
+
+``MemoryBackend`` is per worker: other workers only see an invalidation once
+their TTL runs out. ``MongoBackend`` shares entries and invalidations between
+workers at the cost of one indexed read per hit.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Union
+from urllib.parse import urlencode
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds an entry of each route stays valid; views and new listings may lag this long
+ROUTE_TTLS = {
+    "recommendations:guest": 60,
+    "listings:featured-videos": 60,
+    "listings:facets": 120,
+    "recommendations:similar": 300,
+    "users:profile": 300,
+}
+
+_MISSING = object()
+
+
+def cache_key(route: str, params: Optional[dict] = None) -> str:
+    query = urlencode(sorted((k, str(v)) for k, v in (params or {}).items() if v is not None))
+    if len(query) > 200:
+        query = hashlib.sha256(query.encode()).hexdigest()
+    return f"{route}?{query}" if query else route
+
+
+class _LRU(LRUCache):
+    def __init__(self, maxsize: int, on_evict: Callable[[str, tuple], None]):
+        super().__init__(maxsize=maxsize)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        key, entry = super().popitem()
+        self._on_evict(key, entry)
+        return key, entry
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int = 10_000):
+        self._entries = _LRU(maxsize, self._forget)
+        self._tags: Dict[str, Set[str]] = defaultdict(set)
+
+    def _forget(self, key: str, entry: tuple):
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] < time.monotonic():
+            self._forget(key, self._entries.pop(key))
+            return _MISSING
+        return entry[1]
+
+    async def set(self, key: str, value, ttl: float, tags: Iterable[str]):
+        tags = tuple(tags)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._forget(key, previous)
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags[tag].add(key)
+
+    async def invalidate(self, tags: Iterable[str]) -> int:
+        removed = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._forget(key, entry)
+                    removed += 1
+        return removed
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class MongoBackend:
+    """Entries shared by all workers; expired ones are removed by the TTL index in indexes.py"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, key: str):
+        entry = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, {"value": 1})
+        return _MISSING if entry is None else entry['value']
+
+    async def set(self, key: str, value, ttl: float, tags: Iterable[str]):
+        await self.collection.replace_one(
+            {"_id": key},
+            {"value": value, "tags": list(tags), "expires_at": datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True
+        )
+
+    async def invalidate(self, tags: Iterable[str]) -> int:
+        result = await self.collection.delete_many({"tags": {"$in": list(tags)}})
+        return result.deleted_count
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class ResponseCache:
+    def __init__(self, backend, ttls: Optional[Dict[str, float]] = None):
+        self.backend = backend
+        self.ttls = {**ROUTE_TTLS, **(ttls or {})}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "coalesced": 0})
+        self.invalidations = 0
+        self.errors = 0
+        # Bumped by every invalidation; a load that overlapped one is returned but not stored
+        self._generation = 0
+
+    async def get_or_load(self, route: str, params: Optional[dict], load: Callable[[], Awaitable],
+                          tags: Union[Iterable[str], Callable[[], Iterable[str]]] = ()):
+        """Return the cached value for ``route`` + ``params`` or call ``load`` once.
+        ``load`` must return JSON-compatible data; exceptions are not cached.
+        ``tags`` may be a callable evaluated after ``load`` when they depend on what it read."""
+        key = cache_key(route, params)
+        stats = self._stats[route]
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            # A broken shared cache must not take the endpoint down
+            self.errors += 1
+            logger.warning(f"Response cache read failed: {e}")
+            value = _MISSING
+        if value is not _MISSING:
+            stats["hits"] += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # asyncio.wait does not propagate the load's cancellation, only this request's own
+            await asyncio.wait([inflight])
+            if inflight.cancelled():
+                # The loading request was cancelled (e.g. its client went away): start over, one waiter loads
+                return await self.get_or_load(route, params, load, tags)
+            stats["coalesced"] += 1
+            return inflight.result()
+
+        stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await load()
+            if generation == self._generation:
+                try:
+                    await self.backend.set(key, value, self.ttls.get(route, 60), tags() if callable(tags) else tags)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"Response cache write failed: {e}")
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Waiters see the cancelled future and retry the load themselves
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged by asyncio
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def invalidate(self, *tags: str):
+        self.invalidations += 1
+        self._generation += 1
+        try:
+            await self.backend.invalidate(tags)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache invalidation failed: {e}")
+
+    def stats(self) -> dict:
+        routes = {}
+        for route, counts in self._stats.items():
+            lookups = counts["hits"] + counts["misses"] + counts["coalesced"]
+            routes[route] = {**counts, "hit_rate": round((counts["hits"] + counts["coalesced"]) / lookups, 4) if lookups else 0.0}
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "routes": routes,
+        }
+
+
+def _ttl_variable(route: str) -> str:
+    # "recommendations:similar" -> CACHE_TTL_RECOMMENDATIONS_SIMILAR
+    return "CACHE_TTL_" + route.replace(':', '_').replace('-', '_').upper()
+
+
+def response_cache_from_env(db) -> ResponseCache:
+    ttls = {route: float(os.environ[_ttl_variable(route)]) for route in ROUTE_TTLS if _ttl_variable(route) in os.environ}
+    if os.getenv('RESPONSE_CACHE_BACKEND', 'memory').lower() == 'mongo':
+        return ResponseCache(MongoBackend(db.response_cache), ttls)
+    return ResponseCache(MemoryBackend(int(os.getenv('RESPONSE_CACHE_SIZE', '10000'))), ttls)
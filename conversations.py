@@ -0,0 +1,168 @@
+"""Materialized inbox: one document per (pair of users, listing).
+
+Each document keeps the last message preview, per-participant unread counts
+and denormalized names/listing info so the inbox is a single indexed query.
+"""
+import logging
+from datetime import datetime
+from typing import Iterable, List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 50
+
+
+def conversation_id(user_a: str, user_b: str, listing_id: str) -> str:
+    first, second = sorted((user_a, user_b))
+    return f"{listing_id}:{first}:{second}"
+
+
+async def _load_details(db, user_ids: Iterable[str], listing_ids: Iterable[str]):
+    users = await db.users.find(
+        {"id": {"$in": list(set(user_ids))}}, {"_id": 0, "id": 1, "name": 1, "profile_image": 1}
+    ).to_list(None)
+    listings = await db.listings.find(
+        {"id": {"$in": list(set(listing_ids))}},
+        {"_id": 0, "id": 1, "title": 1, "images": {"$slice": 1}, "thumbnails": {"$slice": 1}}
+    ).to_list(None)
+    profiles = {u['id']: {"name": u.get('name'), "image": u.get('profile_image')} for u in users}
+    return profiles, {listing['id']: listing for listing in listings}
+
+
+def messages_query(user_a: str, user_b: str, listing_id: str) -> dict:
+    """The messages of one conversation, in either direction"""
+    return {"listing_id": listing_id, "$or": [
+        {"from_user_id": user_a, "to_user_id": user_b},
+        {"from_user_id": user_b, "to_user_id": user_a},
+    ]}
+
+
+def _listing_fields(listing) -> dict:
+    if not listing:
+        return {"listing_title": None, "listing_image": None}
+    images = listing.get('thumbnails') or listing.get('images') or []
+    return {"listing_title": listing.get('title'), "listing_image": images[0] if images else None}
+
+
+async def record_message(db, message: dict):
+    """Update (or create) the conversation a freshly inserted message belongs to"""
+    sender, recipient, listing_id = message['from_user_id'], message['to_user_id'], message['listing_id']
+    conv_id = conversation_id(sender, recipient, listing_id)
+    update = {
+        "$set": {
+            "last_message": (message.get('content') or '')[:PREVIEW_LENGTH],
+            "last_message_time": message['created_at'],
+            "last_sender_id": sender,
+        },
+        "$setOnInsert": {
+            "id": conv_id,
+            "listing_id": listing_id,
+            "participants": sorted({sender, recipient}),
+            "created_at": message['created_at'],
+        },
+    }
+    if recipient != sender:
+        update["$inc"] = {f"unread.{recipient}": 1}
+        update["$setOnInsert"][f"unread.{sender}"] = 0
+    result = await db.conversations.update_one({"id": conv_id}, update, upsert=True)
+    if result.upserted_id is not None:
+        # First message of this conversation: denormalize names and listing info once
+        profiles, listings = await _load_details(db, [sender, recipient], [listing_id])
+        await db.conversations.update_one({"id": conv_id}, {"$set": {
+            "profiles": profiles, **_listing_fields(listings.get(listing_id))
+        }})
+
+
+async def mark_read(db, user_id: str, other_user_id: str, listing_id: str, n: int):
+    """Subtract the ``n`` messages actually marked read; a message arriving meanwhile stays counted"""
+    field = f"unread.{user_id}"
+    await db.conversations.update_one(
+        {"id": conversation_id(user_id, other_user_id, listing_id)},
+        # Pipeline update, clamped at zero like unread.decrement
+        [{"$set": {field: {"$max": [0, {"$subtract": [{"$ifNull": [f"${field}", 0]}, n]}]}}}]
+    )
+
+
+async def list_conversations(db, user_id: str, skip: int = 0, limit: int = 50) -> List[dict]:
+    cursor = db.conversations.find({"participants": user_id}, {"_id": 0})
+    return await cursor.sort("last_message_time", -1).skip(skip).limit(limit).to_list(limit)
+
+
+async def update_profile(db, user: dict):
+    """Propagate a changed name/profile image into the user's conversations"""
+    await db.conversations.update_many(
+        {"participants": user['id']},
+        {"$set": {f"profiles.{user['id']}": {"name": user.get('name'), "image": user.get('profile_image')}}}
+    )
+
+
+async def update_listing(db, listing: dict):
+    await db.conversations.update_many({"listing_id": listing['id']}, {"$set": _listing_fields(listing)})
+
+
+async def rebuild_conversations(db, batch_size: int = 500) -> dict:
+    """Recompute every conversation document from the messages collection"""
+    started_at = datetime.utcnow()
+    lower_id = {"$cond": [{"$lt": ["$from_user_id", "$to_user_id"]}, "$from_user_id", "$to_user_id"]}
+    upper_id = {"$cond": [{"$lt": ["$from_user_id", "$to_user_id"]}, "$to_user_id", "$from_user_id"]}
+
+    def unread_for(comparison):
+        return {"$sum": {"$cond": [
+            {"$and": [{"$eq": ["$read", False]}, {comparison: ["$to_user_id", "$from_user_id"]}]}, 1, 0
+        ]}}
+
+    pipeline = [
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"listing_id": "$listing_id", "a": lower_id, "b": upper_id},
+            "last_message": {"$last": "$content"},
+            "last_message_time": {"$last": "$created_at"},
+            "last_sender_id": {"$last": "$from_user_id"},
+            "created_at": {"$first": "$created_at"},
+            "unread_a": unread_for("$lt"),
+            "unread_b": unread_for("$gt"),
+        }},
+    ]
+    stats = {"conversations": 0, "removed": 0}
+    batch = []
+
+    async def flush():
+        profiles, listings = await _load_details(
+            db,
+            [uid for row in batch for uid in (row['_id']['a'], row['_id']['b'])],
+            [row['_id']['listing_id'] for row in batch],
+        )
+        ops = []
+        for row in batch:
+            a, b, listing_id = row['_id']['a'], row['_id']['b'], row['_id']['listing_id']
+            conv_id = conversation_id(a, b, listing_id)
+            ops.append(UpdateOne({"id": conv_id}, {"$set": {
+                "id": conv_id,
+                "listing_id": listing_id,
+                "participants": sorted({a, b}),
+                "last_message": (row['last_message'] or '')[:PREVIEW_LENGTH],
+                "last_message_time": row['last_message_time'],
+                "last_sender_id": row['last_sender_id'],
+                "created_at": row['created_at'],
+                "unread": {a: row['unread_a'], b: row['unread_b']},
+                "profiles": {uid: profiles[uid] for uid in (a, b) if uid in profiles},
+                "rebuilt_at": started_at,
+                **_listing_fields(listings.get(listing_id)),
+            }}, upsert=True))
+        await db.conversations.bulk_write(ops, ordered=False)
+        stats["conversations"] += len(ops)
+        batch.clear()
+
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    # Conversations whose messages are all gone; ones created during the rebuild have no rebuilt_at
+    result = await db.conversations.delete_many({"rebuilt_at": {"$lt": started_at}})
+    stats["removed"] = result.deleted_count
+    logger.info(f"Rebuilt {stats['conversations']} conversations")
+    return stats
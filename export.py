@@ -0,0 +1,126 @@
+"""Streaming NDJSON/CSV exports of the admin collections.
+
+Rows are read with a projected cursor in ``created_at, id`` order and written
+batch by batch, so an export of millions of messages holds one batch in
+memory, not the collection. The order is ascending: rows created during an
+export are appended at the end, and an interrupted download resumes with
+``after=<id of the last row received>``.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from pagination import keyset_filter, keyset_sort
+
+EXPORT_BATCH_SIZE = 1000
+SORT_FIELD = "created_at"
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _bool(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(value)
+
+
+class Export(NamedTuple):
+    collection: str
+    # Columns in output order; media (base64 or URLs) and secrets stay out
+    fields: List[str]
+    # Query parameter -> (document field, parser)
+    filters: Dict[str, Tuple[str, Callable[[str], object]]]
+
+
+EXPORTS = {
+    "users": Export("users", ["id", "short_id", "name", "email", "role", "is_verified", "rating", "review_count",
+                              "phone_enabled", "created_at"],
+                    {"role": ("role", str), "is_verified": ("is_verified", _bool)}),
+    "listings": Export("listings", ["id", "seller_id", "seller_name", "title", "price", "category", "location",
+                                    "views", "negotiable", "is_pinned", "created_at"],
+                       {"category": ("category", str), "seller_id": ("seller_id", str), "is_pinned": ("is_pinned", _bool)}),
+    "messages": Export("messages", ["id", "from_user_id", "to_user_id", "listing_id", "content", "message_type",
+                                    "read", "created_at"],
+                       {"from_user_id": ("from_user_id", str), "to_user_id": ("to_user_id", str),
+                        "listing_id": ("listing_id", str)}),
+    "support": Export("support_tickets", ["id", "user_id", "user_name", "user_email", "subject", "message", "status",
+                                          "replies", "created_at"],
+                      {"status": ("status", str), "user_id": ("user_id", str)}),
+}
+
+
+def build_query(export: Export, params: Mapping[str, str], since: Optional[datetime] = None,
+                until: Optional[datetime] = None) -> dict:
+    """Equality filters from the export's whitelisted parameters plus a created_at range; raises ValueError"""
+    query = {}
+    for name, (field, parse) in export.filters.items():
+        if params.get(name) not in (None, ""):
+            query[field] = parse(params[name])
+    if since or until:
+        query[SORT_FIELD] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    return query
+
+
+async def resume_filter(collection, after: str) -> dict:
+    """Keyset filter for the rows following the row with id ``after`` (looked up by the
+    collection's unique ``id`` index); raises ValueError if it is gone"""
+    last = await collection.find_one({"id": after}, {"_id": 0, "id": 1, SORT_FIELD: 1})
+    if last is None:
+        raise ValueError("unknown row")
+    return keyset_filter(SORT_FIELD, 1, last.get(SORT_FIELD), last['id'])
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default, ensure_ascii=False)
+    if isinstance(value, Enum):
+        return str(value.value)
+    return str(value)
+
+
+async def _batches(cursor, size: int) -> AsyncIterator[List[dict]]:
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_rows(collection, export: Export, query: dict, fmt: str, limit: Optional[int] = None,
+                      batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[str]:
+    """Yield the export as text chunks of one batch each"""
+    projection = {"_id": 0, **{name: 1 for name in export.fields}}
+    cursor = collection.find(query, projection).sort(keyset_sort(SORT_FIELD, 1)).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(export.fields)
+        async for batch in _batches(cursor, batch_size):
+            writer.writerows([_cell(doc.get(name)) for name in export.fields] for doc in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        async for batch in _batches(cursor, batch_size):
+            yield "".join(json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n" for doc in batch)
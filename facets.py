@@ -0,0 +1,71 @@
+"""Facet counts for the listing browser in a single ``$facet`` aggregation.
+
+The facets of a category are its ``select`` fields from the category registry
+(``get_categories``) plus a price histogram; without a category the facet is
+the category itself. Counts are disjunctive: each facet applies every active
+filter except its own, so selecting "BMW" still shows how many Audis match the
+other filters.
+"""
+from typing import Dict, List, Optional
+
+from categories import registry as category_registry
+
+# Histogram boundaries in EUR; prices above the last one land in the "more" bucket
+PRICE_BUCKETS = [0, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000]
+MAX_VALUES = 50
+
+
+def facet_fields(category: Optional[str]) -> List[str]:
+    if not category:
+        return ["category"]
+    fields = category_registry.fields.get(category, {})
+    return [name for name, field in fields.items() if field['type'] in ('select', 'select_dynamic')]
+
+
+def _path(name: str) -> str:
+    return name if name == "category" else f"category_fields.{name}"
+
+
+def facet_pipeline(base: dict, filters: Dict[str, dict], fields: List[str]) -> List[dict]:
+    """``base`` is matched first (it may hold ``$text``, which must lead the pipeline);
+    ``filters`` maps field paths to conditions that facets on that path ignore."""
+    def match(excluding: Optional[str] = None) -> List[dict]:
+        query = {path: condition for path, condition in filters.items() if path != excluding}
+        return [{"$match": query}] if query else []
+
+    facets = {"total": match() + [{"$count": "count"}]}
+    for name in fields:
+        path = _path(name)
+        facets[name] = match(path) + [
+            {"$match": {path: {"$nin": [None, ""]}}},
+            {"$group": {"_id": f"${path}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": MAX_VALUES},
+        ]
+    facets["price"] = match("price") + [
+        # Missing, negative or non-numeric prices belong in no bucket, least of all "more"
+        {"$match": {"price": {"$type": "number", "$gte": 0}}},
+        {"$bucket": {"groupBy": "$price", "boundaries": PRICE_BUCKETS, "default": "more", "output": {"count": {"$sum": 1}}}},
+    ]
+    return [{"$match": base}, {"$facet": facets}]
+
+
+def _price_buckets(rows: List[dict]) -> List[dict]:
+    counts = {row['_id']: row['count'] for row in rows}
+    buckets = [{"min": low, "max": high, "count": counts[low]}
+               for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:]) if counts.get(low)]
+    if counts.get("more"):
+        buckets.append({"min": PRICE_BUCKETS[-1], "max": None, "count": counts["more"]})
+    return buckets
+
+
+async def facet_counts(collection, base: dict, filters: Dict[str, dict], category: Optional[str]) -> dict:
+    fields = facet_fields(category)
+    result = await collection.aggregate(facet_pipeline(base, filters, fields)).to_list(1)
+    facets = result[0] if result else {}
+    total = facets.get("total") or [{"count": 0}]
+    return {
+        "total": total[0]['count'],
+        "facets": {name: [{"value": row['_id'], "count": row['count']} for row in facets.get(name, [])] for name in fields},
+        "price": _price_buckets(facets.get("price", [])),
+    }
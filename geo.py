@@ -0,0 +1,202 @@
+"""Offline geocoding of listing locations and geospatial listing filters.
+
+``location`` stays free text; on every write it is resolved against a bundled
+gazetteer (``data/de_gazetteer.csv``: city centres, the ~12k GeoNames places
+with 500+ inhabitants and 2-digit postcode zones) and stored as
+``latitude``/``longitude`` plus a GeoJSON ``geo`` point backed by ``2dsphere``
+indexes. A place name anywhere in the text wins, e.g. "Wohnung in
+Köln-Ehrenfeld"; of several places with that name the one nearest the text's
+postcode zone is taken ("49586 Neuenkirchen").
+
+Accuracy: a place resolves to its centre. A postcode without a known place
+resolves only to the centre of its 2-digit zone, which can be up to
+``POSTCODE_ZONE_ERROR_KM`` from the real place, so such listings may fall on
+the wrong side of a small radius. Unresolvable locations get ``geo: null``;
+radius searches still return them (without a distance) unless the caller
+excludes them, map searches cannot place them.
+
+The gazetteer is loaded once per process into name -> rows dicts over float32
+coordinate arrays (~12k rows, a few hundred KB).
+"""
+import csv
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+from search import normalize
+
+GAZETTEER_PATH = Path(__file__).parent / 'data' / 'de_gazetteer.csv'
+EARTH_RADIUS_KM = 6378.1
+MAX_RADIUS_KM = 500
+# Longest city name in tokens ("bad homburg vor der hoehe")
+MAX_NAME_TOKENS = 5
+# Bound on how far a bare postcode resolves from the real place (checked on edge places in tests/test_geo.py)
+POSTCODE_ZONE_ERROR_KM = 150
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_POSTCODE_RE = re.compile(r'(?<!\d)(\d{5})(?!\d)')
+# "Frankfurt am Main" / "Halle (Saale)" / "Weiden in der Oberpfalz" are also found as "Frankfurt" / "Halle" / "Weiden"
+_QUALIFIER_RE = re.compile(r'\s*(\(.*\)|/.*|\s(am|an der|im|in der|vor der|auf)\s.*)$', re.IGNORECASE)
+
+Point = Tuple[float, float]  # (lat, lon)
+
+# Listings whose location could not be resolved
+UNLOCATED = {"geo": None}
+
+
+def name_key(text: str) -> str:
+    return ' '.join(_TOKEN_RE.findall(normalize(text)))
+
+
+class Gazetteer:
+    def __init__(self, rows: List[Tuple[str, str, float, float]]):
+        self.coords = np.array([(lat, lon) for _, _, lat, lon in rows], dtype=np.float32).reshape(-1, 2)
+        # name -> rows of the places called so, larger (listed first) first
+        self.names: Dict[str, List[int]] = {}
+        self.postcodes: Dict[str, int] = {}
+        aliases = []
+        for i, (kind, name, _, _) in enumerate(rows):
+            if kind == "postcode":
+                self.postcodes[name] = i
+                continue
+            self.names.setdefault(name_key(name), []).append(i)
+            base = _QUALIFIER_RE.sub('', name)
+            if base != name:
+                aliases.append((name_key(base), i))
+        # Aliases rank by their city's place in the list, so "Halle" is Halle (Saale)
+        for key, i in aliases:
+            rows = self.names.setdefault(key, [])
+            if i not in rows:
+                rows.append(i)
+                rows.sort()
+
+    @classmethod
+    def load(cls, path: Path = GAZETTEER_PATH) -> "Gazetteer":
+        with open(path, encoding='utf-8') as f:
+            reader = csv.DictReader(line for line in f if not line.startswith('#'))
+            return cls([(row['kind'], row['name'], float(row['lat']), float(row['lon'])) for row in reader])
+
+    def _point(self, i: int) -> Point:
+        lat, lon = self.coords[i]
+        return round(float(lat), 4), round(float(lon), 4)
+
+    def _zone(self, location: str) -> Optional[int]:
+        for postcode in _POSTCODE_RE.findall(location):
+            i = self.postcodes.get(postcode[:2])
+            if i is not None:
+                return i
+        return None
+
+    def geocode(self, location: str) -> Optional[Point]:
+        tokens = _TOKEN_RE.findall(normalize(location))
+        zone = self._zone(location)
+        # Longest name first so "Frankfurt (Oder)" beats "Frankfurt"; among equally long
+        # ones the larger city (listed first) so "Hof" in "Haus mit Hof, Berlin" does not win
+        for size in range(min(len(tokens), MAX_NAME_TOKENS), 0, -1):
+            found = [self.names.get(' '.join(tokens[start:start + size])) for start in range(len(tokens) - size + 1)]
+            found = [rows for rows in found if rows]
+            if not found:
+                continue
+            rows = min(found)
+            if zone is None or len(rows) == 1:
+                return self._point(rows[0])
+            # Several places of that name: the one in (or nearest to) the postcode's zone
+            distances = np.square(self.coords[rows] - self.coords[zone]).sum(axis=1)
+            return self._point(rows[int(distances.argmin())])
+        if zone is not None:
+            return self._point(zone)
+        return None
+
+
+@lru_cache(maxsize=1)
+def gazetteer() -> Gazetteer:
+    return Gazetteer.load()
+
+
+@lru_cache(maxsize=4096)
+def geocode(location: Optional[str]) -> Optional[Point]:
+    """``(lat, lon)`` for a free-text location or postcode, or None"""
+    if not location or not location.strip():
+        return None
+    return gazetteer().geocode(location)
+
+
+def point(lat: float, lon: float) -> dict:
+    # GeoJSON order is longitude first
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def geo_fields(location: Optional[str]) -> dict:
+    """Coordinates to $set on a listing whenever its location changes"""
+    found = geocode(location)
+    if found is None:
+        return {"latitude": None, "longitude": None, "geo": None}
+    lat, lon = found
+    return {"latitude": lat, "longitude": lon, "geo": point(lat, lon)}
+
+
+def valid_point(lat: float, lon: float) -> bool:
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def haversine_km(a: Point, b: Point) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def distance_km(listing: dict, center: Point) -> Optional[float]:
+    if listing.get('latitude') is None or listing.get('longitude') is None:
+        return None
+    return round(haversine_km(center, (listing['latitude'], listing['longitude'])), 1)
+
+
+def radius_filter(center: Point, radius_km: float, include_unlocated: bool = False) -> dict:
+    """Listings within the circle, and with ``include_unlocated`` those without coordinates"""
+    # $geoWithin needs no sort of its own, so results keep the keyset order
+    lat, lon = center
+    within = {"geo": {"$geoWithin": {"$centerSphere": [[lon, lat], radius_km / EARTH_RADIUS_KM]}}}
+    return {"$or": [within, UNLOCATED]} if include_unlocated else within
+
+
+def near_filter(center: Point, radius_km: Optional[float] = None) -> dict:
+    """Nearest first; cannot be combined with $text or keyset cursors"""
+    near = {"$geometry": point(*center)}
+    if radius_km:
+        near["$maxDistance"] = radius_km * 1000
+    return {"geo": {"$nearSphere": near}}
+
+
+def bbox_filter(bbox: str) -> dict:
+    """``minLon,minLat,maxLon,maxLat`` (the map viewport); raises ValueError"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(','))
+    except (TypeError, ValueError):
+        raise ValueError("invalid bbox")
+    if not (valid_point(min_lat, min_lon) and valid_point(max_lat, max_lon)) or min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError("invalid bbox")
+    ring = [[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]]
+    return {"geo": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+
+
+async def geocode_listings(db, batch_size: int = 500, all_listings: bool = False) -> dict:
+    """Backfill coordinates of listings that were never geocoded (or of all of them,
+    e.g. after the gazetteer was extended)"""
+    stats = {"geocoded": 0, "unresolved": 0}
+    query = {} if all_listings else {"geo": {"$exists": False}}
+    ops = []
+    async for listing in db.listings.find(query, {"_id": 0, "id": 1, "location": 1}).batch_size(batch_size):
+        fields = geo_fields(listing.get('location'))
+        stats["geocoded" if fields['geo'] else "unresolved"] += 1
+        ops.append(UpdateOne({"id": listing['id']}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            await db.listings.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.listings.bulk_write(ops, ordered=False)
+    return stats
@@ -0,0 +1,117 @@
+"""Pillow-based image processing: EXIF stripping and WebP renditions.
+
+Decoding and encoding run in a process pool so uploads never block the event loop.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+# Longest edge in pixels for each derived rendition
+RENDITIONS = {"thumb": 320, "medium": 960}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 90
+
+_pool: Optional[ProcessPoolExecutor] = None
+_heif_registered: Optional[bool] = None
+
+
+def process_image(data: bytes) -> Dict[str, Tuple[bytes, str]]:
+    """Return the sanitized original plus WebP renditions as ``{name: (bytes, content_type)}``"""
+    from PIL import Image, ImageOps
+
+    _register_openers()
+    result = {}
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source_format = source.format
+            # Apply the EXIF orientation before the metadata is dropped
+            image = ImageOps.exif_transpose(source)
+            if getattr(source, 'is_animated', False):
+                result["original"] = (_reencode_animation(source), f"image/{source_format.lower()}")
+    except Exception as e:
+        raise ValueError(f"unreadable image: {e}")
+
+    if "original" not in result:
+        # Re-encoding without passing exif= drops EXIF/GPS metadata
+        buffer = io.BytesIO()
+        if source_format == 'PNG':
+            image.save(buffer, format='PNG', optimize=True)
+            result["original"] = (buffer.getvalue(), 'image/png')
+        else:
+            _flatten(image).save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+            result["original"] = (buffer.getvalue(), 'image/jpeg')
+
+    for name, size in RENDITIONS.items():
+        rendition = image.copy()
+        rendition.thumbnail((size, size), Image.LANCZOS)
+        if rendition.mode not in ('RGB', 'RGBA'):
+            rendition = rendition.convert('RGBA' if 'A' in rendition.getbands() else 'RGB')
+        buffer = io.BytesIO()
+        rendition.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+        result[name] = (buffer.getvalue(), 'image/webp')
+    return result
+
+
+def _reencode_animation(source) -> bytes:
+    """Re-encode every frame of an animated GIF/WebP. No exif=/xmp= is passed, so EXIF/XMP
+    (GPS) chunks of animated WebP are dropped; GIF comment blocks are cleared."""
+    buffer = io.BytesIO()
+    if source.format == 'GIF':
+        source.save(buffer, format='GIF', save_all=True, comment=b'')
+    else:
+        source.save(buffer, format='WEBP', save_all=True, quality=WEBP_QUALITY, method=4,
+                    loop=source.info.get('loop', 0))
+    return buffer.getvalue()
+
+
+def _register_openers():
+    """HEIC/HEIF (iPhone photos) decode through the optional pillow-heif plugin.
+    Without it they fail to open and MediaStore keeps them as uploaded."""
+    global _heif_registered
+    if _heif_registered is None:
+        try:
+            from pillow_heif import register_heif_opener
+        except ImportError:
+            _heif_registered = False
+        else:
+            register_heif_opener()
+            _heif_registered = True
+    return _heif_registered
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: composite onto white"""
+    from PIL import Image
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that holds Motor's threads and sockets
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv('IMAGE_WORKERS', '2')),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _pool
+
+
+async def render_image(data: bytes) -> Dict[str, Tuple[bytes, str]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), process_image, data)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
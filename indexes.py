@@ -0,0 +1,347 @@
+"""Declarative MongoDB index specs, kept next to the query shapes they serve.
+
+``ensure_indexes`` applies every spec idempotently at startup, ``index_report``
+lists indexes that are not declared here or never used (``$indexStats``), and
+``check_query_plans`` explains every declared query and flags collection scans,
+in-memory sorts and index scans that read every document to filter it
+(``python manage.py check-indexes``, tests/test_query_plans.py). Queries are
+built with the endpoints' own functions and sorts (``search.build_query``,
+``pagination.after_row``, geo filters) so a changed query is checked as it is
+sent; a query may ``allow`` a problem that no index can avoid, with the reason
+next to it.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ASCENDING as ASC, DESCENDING as DESC, IndexModel
+from pymongo.errors import OperationFailure
+from starlette.datastructures import QueryParams
+
+import geo
+import search as listing_search
+from conversations import messages_query
+from pagination import SORTS, after_row, keyset_sort
+from realtime import EVENT_TTL_SECONDS
+from unread import unread_query
+from jobs import DONE_TTL_SECONDS as JOB_DONE_TTL_SECONDS
+from stats import SNAPSHOT_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+USER_VIEWS_TTL_SECONDS = 90 * 24 * 3600
+
+
+# Plan problems check_query_plans reports
+COLLSCAN, SORT, UNBOUNDED = "COLLSCAN", "SORT", "IXSCAN (unbounded)"
+
+
+class Query(NamedTuple):
+    """A representative query; built with the endpoint's own query functions where it has them"""
+    route: str
+    filter: dict
+    sort: Optional[list] = None
+    allow: Tuple[str, ...] = ()
+
+
+class Index(NamedTuple):
+    collection: str
+    model: IndexModel
+    queries: List[Query]
+
+
+def _index(collection: str, keys: list, queries: List[Query] = (), **options) -> Index:
+    return Index(collection, IndexModel(keys, **options), list(queries))
+
+
+def _keyset(field: str, direction: int = DESC) -> list:
+    return [(field, direction), ("id", direction)]
+
+
+# Sort values of the last row of a page, for the "next page" shapes
+_LAST_ROW = {"created_at": datetime(2024, 1, 1), "views": 10}
+
+
+def _pages(route: str, query: dict, sort: str = "recent", allow: Tuple[str, ...] = ()) -> List[Query]:
+    """The first and a following page of a keyset-paginated route, as pagination.paginate queries them"""
+    field, direction = SORTS[sort]
+    return [
+        Query(route, query, keyset_sort(field, direction), allow),
+        Query(f"{route} (next page)", after_row(query, field, direction, _LAST_ROW[field], "l"),
+              keyset_sort(field, direction), allow),
+    ]
+
+
+_BERLIN = (52.52, 13.405)
+
+
+INDEXES: List[Index] = [
+    # ----- users -----
+    _index("users", [("id", ASC)], [Query("GET /users/{id}", {"id": "u"})], unique=True),
+    _index("users", [("email", ASC)], [Query("POST /auth/login", {"email": "a@b.de"})], unique=True),
+    _index("users", _keyset("created_at"), [Query("GET /admin/users", {}, _keyset("created_at"))]),
+
+    # ----- listings -----
+    _index("listings", [("id", ASC)], [Query("GET /listings/{id}", {"id": "l"})], unique=True),
+    _index("listings", _keyset("created_at"), [
+        *_pages("GET /listings", listing_search.build_query(QueryParams())),
+        # The feed order has to come from created_at; a price bound rarely excludes most listings
+        *_pages("GET /listings?min_price=", listing_search.build_query(QueryParams(), min_price=100), allow=(UNBOUNDED,)),
+    ]),
+    # Only listings with videos, in feed order (a second index on the same keys needs MongoDB 5.0+)
+    _index("listings", _keyset("created_at"), [
+        *_pages("GET /listings/all-videos", listing_search.HAS_VIDEOS),
+        Query("GET /listings/featured-videos", listing_search.HAS_VIDEOS, [("created_at", DESC)]),
+    ], name="videos_created_at", partialFilterExpression=listing_search.HAS_VIDEOS),
+    _index("listings", _keyset("views"), [
+        *_pages("GET /listings?sort=popular", listing_search.build_query(QueryParams()), "popular"),
+        Query("GET /recommendations/for-you (guest)", {}, [("views", DESC)]),
+    ]),
+    # (category, created_at) with the keyset tiebreaker
+    _index("listings", [("category", ASC)] + _keyset("created_at"), [
+        *_pages("GET /listings?category=", listing_search.build_query(QueryParams(), "cars")),
+        *_pages("GET /listings?category=&cf.", listing_search.build_query(
+            QueryParams("cf.brand=VW&cf.year.min=2010"), "cars", max_price=20000)),
+        Query("GET /recommendations/similar/{id}", {"category": "c", "price": {"$gte": 1, "$lte": 2}, "id": {"$ne": "l"}},
+              [("created_at", DESC)]),
+    ]),
+    _index("listings", [("category", ASC)] + _keyset("views"), [
+        *_pages("GET /listings?category=&sort=popular", listing_search.build_query(QueryParams(), "cars"), "popular"),
+    ]),
+    # (seller_id, created_at) with the keyset tiebreaker
+    _index("listings", [("seller_id", ASC)] + _keyset("created_at"), [
+        *_pages("GET /listings/my", {"seller_id": "u"}),
+    ]),
+    _index("listings", [("search_prefixes", ASC), ("views", DESC)], [
+        Query("GET /listings/autocomplete", listing_search.autocomplete_query("vw gol"), [("views", DESC)]),
+    ]),
+    # Only one text index per collection is allowed. Relevance is computed per match, so
+    # the matches are always sorted in memory; the text index bounds them to the hits
+    _index("listings", [("search_title", "text"), ("search_body", "text")], [
+        Query("GET /listings?search=", listing_search.build_query(QueryParams(), search="VW Golf Kombi"),
+              listing_search.TEXT_SORT, (SORT,)),
+        Query("GET /listings?search=&category=", listing_search.build_query(QueryParams(), "cars", "Golf"),
+              listing_search.TEXT_SORT, (SORT,)),
+    ], name=listing_search.TEXT_INDEX_NAME, weights=listing_search.TEXT_INDEX_WEIGHTS, default_language="none"),
+    # Listings without a resolvable location (geo: null) are in neither geo index
+    _index("listings", [("geo", "2dsphere")], [
+        Query("GET /listings?near=&sort=distance", geo.near_filter(_BERLIN, 25)),
+    ]),
+    # Radius and map pages in feed order: the keys are walked in keyset order and the
+    # location is checked on the index key, so no listing outside the area is fetched
+    _index("listings", _keyset("created_at") + [("geo", "2dsphere")], [
+        *_pages("GET /listings?near=&radius_km=", geo.radius_filter(_BERLIN, 25, include_unlocated=True)),
+        *_pages("GET /listings?near=&radius_km=&located_only=true", geo.radius_filter(_BERLIN, 25)),
+        *_pages("GET /listings?bbox=", geo.bbox_filter("13.0,52.0,14.0,53.0")),
+    ]),
+    # The listings without coordinates a radius search adds, in feed order
+    _index("listings", [("geo", ASC)] + _keyset("created_at"), [
+        *_pages("radius search (unlocated branch)", geo.UNLOCATED),
+    ]),
+
+    # ----- messages -----
+    _index("messages", [("id", ASC)], [Query("GET /admin/export/messages?after=", {"id": "m"})], unique=True),
+    # One conversation's messages; equality on the first three keys keeps created_at ordered
+    _index("messages", [("listing_id", ASC), ("from_user_id", ASC), ("to_user_id", ASC), ("created_at", ASC)], [
+        Query("GET /messages/{listing_id}/{other_user_id}", messages_query("a", "b", "l"), [("created_at", ASC)]),
+        Query("POST /messages/mark-read", {"listing_id": "l", "from_user_id": "b", "to_user_id": "a", "read": False}),
+    ]),
+    _index("messages", [("to_user_id", ASC), ("read", ASC)], [
+        Query("unread counter seed", unread_query("u")),
+    ]),
+    _index("messages", [("from_user_id", ASC)], [Query("DELETE /admin/users/{id}", {"from_user_id": "u"})]),
+    _index("messages", _keyset("created_at"), [Query("GET /admin/messages", {}, _keyset("created_at"))]),
+
+    # ----- conversations -----
+    _index("conversations", [("id", ASC)], [Query("conversation upsert", {"id": "l:a:b"})], unique=True),
+    _index("conversations", [("participants", ASC), ("last_message_time", DESC)], [
+        Query("GET /messages/conversations", {"participants": "u"}, [("last_message_time", DESC)]),
+    ]),
+    _index("conversations", [("listing_id", ASC)], [Query("DELETE /listings/{id}", {"listing_id": "l"})]),
+
+    # ----- offers -----
+    _index("offers", [("id", ASC)], [Query("POST /offers/action", {"id": "o"})], unique=True),
+    _index("offers", [("seller_id", ASC), ("created_at", DESC)], [
+        Query("GET /offers/received", {"seller_id": "u"}, [("created_at", DESC)]),
+    ]),
+    _index("offers", [("buyer_id", ASC), ("created_at", DESC)], [
+        Query("GET /offers/sent", {"buyer_id": "u"}, [("created_at", DESC)]),
+    ]),
+    _index("offers", [("listing_id", ASC)], [Query("DELETE /admin/listings/{id}", {"listing_id": "l"})]),
+
+    # ----- reviews -----
+    _index("reviews", [("reviewed_user_id", ASC)] + _keyset("created_at"), [
+        Query("GET /reviews/user/{id}", {"reviewed_user_id": "u"}, _keyset("created_at")),
+    ]),
+    _index("reviews", [("reviewer_id", ASC), ("reviewed_user_id", ASC)], [
+        Query("POST /reviews (duplicate check)", {"reviewer_id": "a", "reviewed_user_id": "b"}),
+    ]),
+
+    # ----- favorites -----
+    _index("favorites", [("user_id", ASC), ("listing_id", ASC)], [
+        Query("GET /favorites/check/{id}", {"user_id": "u", "listing_id": "l"}),
+    ], unique=True),
+    _index("favorites", [("user_id", ASC), ("created_at", DESC)], [
+        Query("GET /favorites", {"user_id": "u"}, [("created_at", DESC)]),
+    ]),
+    _index("favorites", [("listing_id", ASC)], [Query("DELETE /admin/listings/{id}", {"listing_id": "l"})]),
+
+    # ----- password resets -----
+    _index("password_resets", [("email", ASC)], [
+        Query("POST /auth/reset-password", {"email": "a@b.de", "reset_code": "123456"}),
+    ]),
+    # Expired reset codes are removed by MongoDB itself
+    _index("password_resets", [("expires_at", ASC)], expireAfterSeconds=0),
+
+    # ----- support -----
+    _index("support_tickets", [("id", ASC)], [Query("POST /admin/support/{id}/reply", {"id": "t"})], unique=True),
+    _index("support_tickets", [("user_id", ASC), ("created_at", DESC)], [
+        Query("GET /support/my", {"user_id": "u"}, [("created_at", DESC)]),
+    ]),
+    _index("support_tickets", _keyset("created_at"), [Query("GET /admin/support", {}, _keyset("created_at"))]),
+
+    # ----- media -----
+    _index("media", [("id", ASC)], [Query("GET /media/{id}", {"id": "sha256"})], unique=True),
+    _index("media", [("rendition_of", ASC)], [Query("media_gc mark", {"rendition_of": {"$exists": True}})], sparse=True),
+
+    # ----- recommendations -----
+    _index("recommendations", [("user_id", ASC)], [Query("GET /recommendations/for-you", {"user_id": "u"})], unique=True),
+    _index("recommendations", [("computed_at", ASC)], [Query("stale recommendations", {"computed_at": {"$lt": "x"}})]),
+    _index("user_views", [("user_id", ASC), ("listing_id", ASC)], [
+        Query("view counter flush", {"user_id": "u", "listing_id": "l"}),
+    ], unique=True),
+    # Old views stop influencing recommendations
+    _index("user_views", [("last_viewed_at", ASC)], expireAfterSeconds=USER_VIEWS_TTL_SECONDS),
+
+    # ----- response cache (only written with RESPONSE_CACHE_BACKEND=mongo) -----
+    _index("response_cache", [("tags", ASC)], [Query("cache invalidation", {"tags": {"$in": ["listings"]}})]),
+    _index("response_cache", [("expires_at", ASC)], expireAfterSeconds=0),
+
+    # ----- background jobs -----
+    _index("jobs", [("id", ASC)], [Query("GET /admin/jobs/{id}", {"id": "j"})], unique=True),
+    # Claiming: the two branches of the claim $or are planned separately
+    _index("jobs", [("status", ASC), ("run_at", ASC)], [
+        Query("job claim (due)", {"status": "queued", "run_at": {"$lte": "now"}}, [("run_at", ASC)]),
+    ]),
+    _index("jobs", [("status", ASC), ("locked_until", ASC)], [
+        Query("job claim (expired lease)", {"status": "running", "locked_until": {"$lt": "now"}}),
+    ]),
+    # At most one queued job per type and params among those enqueued with unique=True
+    _index("jobs", [("type", ASC), ("params", ASC)], [
+        Query("unique enqueue", {"type": "media_gc", "params": {}, "status": "queued", "unique": True}),
+    ], unique=True, partialFilterExpression={"status": "queued", "unique": True}),
+    _index("jobs", _keyset("created_at"), [Query("GET /admin/jobs", {}, _keyset("created_at"))]),
+    # Finished jobs stay visible for a week; failed ones have no finished_at and are kept
+    _index("jobs", [("finished_at", ASC)], expireAfterSeconds=JOB_DONE_TTL_SECONDS),
+
+    # ----- admin stats (counters and history are read by _id) -----
+    _index("stats_snapshots", [("taken_at", ASC)], expireAfterSeconds=SNAPSHOT_TTL_SECONDS),
+
+    # ----- realtime (only written with REALTIME_BACKEND=mongo) -----
+    _index("realtime_events", [("created_at", ASC)], expireAfterSeconds=EVENT_TTL_SECONDS),
+]
+
+
+def declared() -> Dict[str, List[Index]]:
+    by_collection: Dict[str, List[Index]] = {}
+    for index in INDEXES:
+        by_collection.setdefault(index.collection, []).append(index)
+    return by_collection
+
+
+async def ensure_indexes(db) -> dict:
+    """Create every declared index; existing identical indexes are a no-op.
+    A conflicting or unbuildable index (e.g. duplicates under a new unique key) is
+    logged and skipped so the service still starts."""
+    stats = {"ensured": 0, "failed": []}
+    for index in INDEXES:
+        try:
+            await db[index.collection].create_indexes([index.model])
+            stats["ensured"] += 1
+        except OperationFailure as e:
+            name = index.model.document['name']
+            stats["failed"].append({"collection": index.collection, "index": name, "error": str(e)})
+            logger.warning(f"Could not create index {index.collection}.{name}: {e}")
+    return stats
+
+
+async def index_report(db) -> dict:
+    """Indexes present in the database but not declared here, and declared ones with no recorded use.
+    ``$indexStats`` counters reset when mongod restarts, so judge "unused" over a long uptime."""
+    wanted = {name: {index.model.document['name'] for index in specs} for name, specs in declared().items()}
+    undeclared, unused = [], []
+    for name in await db.list_collection_names():
+        if name.startswith("system."):
+            continue
+        async for stats in db[name].aggregate([{"$indexStats": {}}]):
+            if stats['name'] == "_id_":
+                continue
+            entry = {"collection": name, "index": stats['name'], "ops": stats['accesses']['ops'],
+                     "since": stats['accesses']['since']}
+            if stats['name'] not in wanted.get(name, ()):
+                undeclared.append(entry)
+            elif stats['accesses']['ops'] == 0:
+                unused.append(entry)
+    return {"undeclared": undeclared, "unused": unused}
+
+
+async def drop_undeclared(db, report: dict) -> List[str]:
+    dropped = []
+    for entry in report["undeclared"]:
+        await db[entry['collection']].drop_index(entry['index'])
+        dropped.append(f"{entry['collection']}.{entry['index']}")
+    return dropped
+
+
+def _stages(plan: dict):
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get('inputStages', ()):
+        yield from _stages(child)
+
+
+def declared_queries() -> List[tuple]:
+    """``(collection, query)`` for every declared query"""
+    return [(index.collection, query) for index in INDEXES for query in index.queries]
+
+
+_FULL_RANGE = {"[MinKey, MaxKey]", "[MaxKey, MinKey]"}
+
+
+def _unbounded_fetches(plan: dict):
+    """FETCH stages that filter every document of an index scan without bounds"""
+    child = plan.get('inputStage', {})
+    if (plan.get('stage') == "FETCH" and plan.get('filter') and child.get('stage') == "IXSCAN"
+            and not child.get('isPartial') and not child.get('isSparse')
+            and all(set(bounds) <= _FULL_RANGE for bounds in child.get('indexBounds', {}).values())):
+        yield child.get('indexName')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _unbounded_fetches(plan[key])
+    for child in plan.get('inputStages', ()):
+        yield from _unbounded_fetches(child)
+
+
+async def plan_problems(db, collection: str, query: Query) -> List[str]:
+    """COLLSCAN, in-memory SORT and unbounded filtered index scans in the query's winning
+    plan, apart from those the query allows"""
+    cursor = db[collection].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    plan = (await cursor.limit(20).explain())['queryPlanner']['winningPlan']
+    problems = set(_stages(plan)) & {COLLSCAN, SORT}
+    if any(True for _ in _unbounded_fetches(plan)):
+        problems.add(UNBOUNDED)
+    return sorted(problems - set(query.allow))
+
+
+async def check_query_plans(db) -> List[dict]:
+    """Explain every declared query; returns the ones that scan more than they return or sort in memory"""
+    problems = []
+    for collection, query in declared_queries():
+        bad = await plan_problems(db, collection, query)
+        if bad:
+            problems.append({"route": query.route, "collection": collection, "stages": bad})
+    return problems
@@ -0,0 +1,326 @@
+"""Durable background jobs stored in MongoDB.
+
+A job is a document in ``jobs``; any worker of any process claims it with one
+``find_one_and_update`` and holds a lease (``locked_until``) that a heartbeat
+renews while the handler runs, however long a step takes. A job whose worker
+died is picked up again once its lease ran out, a failed one is retried with exponential backoff until
+``max_attempts``. Handlers must therefore be safe to re-run: the cascades
+delete in bounded batches and record finished steps in ``progress``, so a
+retry resumes after the last completed step.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bson.errors import InvalidDocument
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+# Finished jobs are kept this long for the admin status endpoints (TTL index in indexes.py)
+DONE_TTL_SECONDS = 7 * 24 * 3600
+# A result BSON cannot store is kept as its repr, cut to this length
+RESULT_REPR_LENGTH = 1000
+
+
+class JobContext:
+    """Handed to a handler: its job document plus progress and batching helpers"""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job = job
+        self.params = job.get('params') or {}
+        self.progress_doc = job.get('progress') or {"steps_done": [], "deleted": {}}
+
+    def step_done(self, step: str) -> bool:
+        return step in self.progress_doc["steps_done"]
+
+    async def finish_step(self, step: str):
+        self.progress_doc["steps_done"].append(step)
+        await self.save()
+
+    async def save(self):
+        """Persist progress and renew the lease; raises if another worker took the job over"""
+        result = await self.queue.collection.update_one(
+            {"id": self.job['id'], "worker": self.queue.worker_id},
+            {"$set": {"progress": self.progress_doc, "locked_until": self.queue.lease_deadline(),
+                      "updated_at": datetime.utcnow()}}
+        )
+        if result.matched_count == 0:
+            raise RuntimeError("job lease lost")
+
+    async def delete_batched(self, collection, query: dict,
+                             before: Optional[Callable[[dict], Awaitable]] = None) -> int:
+        """Delete everything matching ``query`` in batches of ``batch_size``.
+        ``before`` is called with each batch's ``{"_id": {"$in": ...}}`` filter first,
+        e.g. to reverse counters that depend on the documents."""
+        deleted = 0
+        while True:
+            ids = [doc['_id'] async for doc in collection.find(query, {"_id": 1}).limit(self.queue.batch_size)]
+            if not ids:
+                break
+            batch = {"_id": {"$in": ids}}
+            if before is not None:
+                await before(batch)
+            result = await collection.delete_many(batch)
+            deleted += result.deleted_count
+            counts = self.progress_doc["deleted"]
+            counts[collection.name] = counts.get(collection.name, 0) + result.deleted_count
+            await self.save()
+            if len(ids) < self.queue.batch_size:
+                break
+            # Leave the primary room for request traffic between batches
+            await asyncio.sleep(self.queue.batch_pause)
+        return deleted
+
+
+Handler = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+
+class JobQueue:
+    def __init__(self, db, workers: int = 1, poll_interval: float = 5.0, lease_seconds: float = 300,
+                 max_attempts: int = 5, retry_delay: float = 10.0, batch_size: int = 500, batch_pause: float = 0.05):
+        self.collection = db.jobs
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # Renewed three times per lease, so one missed heartbeat does not lose it
+        self.heartbeat_seconds = lease_seconds / 3
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, Handler] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def handler(self, job_type: str):
+        def register(fn: Handler) -> Handler:
+            self.handlers[job_type] = fn
+            return fn
+        return register
+
+    def _notify(self):
+        # Wake an idle worker of this process instead of waiting for the next poll
+        if self._wake is not None:
+            self._wake.set()
+
+    def lease_deadline(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    async def enqueue(self, job_type: str, params: Optional[dict] = None, unique: bool = False, delay: float = 0) -> dict:
+        """Queue a job; with ``unique`` an already queued job of the same type and params is returned instead
+        (a partial unique index in indexes.py settles concurrent enqueues).
+        ``delay`` postpones the first run, e.g. to let one garbage collection cover many deletes."""
+        if job_type not in self.handlers:
+            raise ValueError(f"unknown job type {job_type}")
+        now = datetime.utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "params": params or {},
+            "status": QUEUED,
+            "attempts": 0,
+            "run_at": now + timedelta(seconds=delay),
+            "progress": {"steps_done": [], "deleted": {}},
+            "error": None,
+            "unique": unique,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if unique:
+            query = {"type": job_type, "params": job["params"], "status": QUEUED, "unique": True}
+            try:
+                existing = await self.collection.find_one_and_update(
+                    query, {"$setOnInsert": job}, upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # A concurrent enqueue inserted it first
+                existing = await self.collection.find_one(query)
+            self._notify()
+            return {k: v for k, v in existing.items() if k != '_id'}
+        await self.collection.insert_one(job)
+        self._notify()
+        return {k: v for k, v in job.items() if k != '_id'}
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_at": {"$lte": now}},
+                # The worker holding it died or hung
+                {"status": RUNNING, "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": RUNNING, "worker": self.worker_id, "locked_until": self.lease_deadline(),
+                      "started_at": now, "updated_at": now}, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)], return_document=ReturnDocument.AFTER
+        )
+        return {k: v for k, v in job.items() if k != '_id'} if job else None
+
+    async def run_job(self, job: dict):
+        context = JobContext(self, job)
+        started = time.monotonic()
+        self.running += 1
+        try:
+            handler = self.handlers.get(job['type'])
+            if handler is None:
+                raise ValueError(f"unknown job type {job['type']}")
+            heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job))
+            try:
+                result = await handler(context)
+            finally:
+                heartbeat.cancel()
+        except asyncio.CancelledError:
+            # Shutdown: hand the job back right away instead of waiting for the lease
+            await self._requeue({"id": job['id'], "worker": self.worker_id},
+                                {"$set": {"status": QUEUED, "locked_until": None}, "$inc": {"attempts": -1}})
+            raise
+        except Exception as e:
+            await self._fail(job, context, e)
+        else:
+            self.completed += 1
+            now = datetime.utcnow()
+            done = {"status": DONE, "result": result, "progress": context.progress_doc, "error": None,
+                    "finished_at": now, "updated_at": now, "seconds": round(time.monotonic() - started, 2)}
+            try:
+                await self.collection.update_one({"id": job['id'], "worker": self.worker_id}, {"$set": done})
+            except InvalidDocument:
+                # The work is done; a result that cannot be encoded (or is too large) must not re-run it
+                done["result"] = repr(result)[:RESULT_REPR_LENGTH]
+                await self.collection.update_one({"id": job['id'], "worker": self.worker_id}, {"$set": done})
+        finally:
+            self.running -= 1
+
+    async def _requeue(self, query: dict, update: dict):
+        try:
+            return await self.collection.update_one(query, update)
+        except DuplicateKeyError:
+            # A unique job of the same type and params was queued meanwhile; run both
+            update["$set"]["unique"] = False
+            return await self.collection.update_one(query, update)
+
+    async def _heartbeat(self, job: dict):
+        """Renew the lease until cancelled; stops once another worker holds the job"""
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                result = await self.collection.update_one(
+                    {"id": job['id'], "worker": self.worker_id, "status": RUNNING},
+                    {"$set": {"locked_until": self.lease_deadline()}}
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Renewing the lease of job {job['type']} {job['id']} failed: {e}")
+                continue
+            if result.matched_count == 0:
+                # The handler's next save() raises "job lease lost"
+                logger.warning(f"Job {job['type']} {job['id']} lost its lease")
+                return
+
+    async def _fail(self, job: dict, context: JobContext, error: Exception):
+        now = datetime.utcnow()
+        update = {"progress": context.progress_doc, "error": f"{type(error).__name__}: {error}", "updated_at": now}
+        if job['attempts'] < self.max_attempts:
+            self.retried += 1
+            update.update(status=QUEUED, run_at=now + timedelta(seconds=self.retry_delay * 2 ** (job['attempts'] - 1)))
+            logger.warning(f"Job {job['type']} {job['id']} failed (attempt {job['attempts']}), retrying: {error}")
+        else:
+            self.failed += 1
+            update.update(status=FAILED, failed_at=now)
+            logger.error(f"Job {job['type']} {job['id']} failed permanently: {error}")
+        await self._requeue({"id": job['id'], "worker": self.worker_id}, {"$set": update})
+
+    async def run_pending(self, limit: Optional[int] = None) -> int:
+        """Run due jobs until none is left (or ``limit`` ran); for manage.py and tests"""
+        ran = 0
+        while limit is None or ran < limit:
+            job = await self.claim()
+            if job is None:
+                break
+            await self.run_job(job)
+            ran += 1
+        return ran
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Claiming a job failed: {e}")
+                job = None
+            if job is not None:
+                try:
+                    await self.run_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # E.g. the status write failed; the lease runs out and the job is claimed again
+                    logger.exception(f"Job {job['type']} {job['id']} could not be completed")
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def retry(self, job_id: str) -> bool:
+        """Queue a permanently failed job again, keeping its progress"""
+        result = await self._requeue(
+            {"id": job_id, "status": FAILED},
+            {"$set": {"status": QUEUED, "attempts": 0, "run_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            self._notify()
+        return bool(result.modified_count)
+
+    async def counts(self) -> dict:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        async for row in self.collection.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+            counts[row['_id']] = row['n']
+        return counts
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+def job_queue_from_env(db) -> JobQueue:
+    return JobQueue(
+        db,
+        workers=int(os.getenv('JOB_WORKERS', '1')),
+        poll_interval=float(os.getenv('JOB_POLL_SECONDS', '5')),
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '5')),
+        batch_size=int(os.getenv('JOB_BATCH_SIZE', '500')),
+        batch_pause=float(os.getenv('JOB_BATCH_PAUSE_SECONDS', '0.05')),
+    )
@@ -0,0 +1,57 @@
+"""Request-scoped batch loading of documents by id (DataLoader style).
+
+Ids requested during one request are deduplicated and resolved with a single
+``$in`` query per collection instead of one ``find_one`` per row.
+"""
+import asyncio
+from typing import Dict, Iterable, Optional
+
+from models import LISTING_SUMMARY_PROJECTION
+
+
+class BatchLoader:
+    def __init__(self, collection, projection: dict, key: str = "id"):
+        self.collection = collection
+        self.key = key
+        self.projection = {**projection, "_id": 0, key: 1}
+        self.queries = 0
+        # id -> future resolving to the {id: document} map of the batch that fetched it
+        self._batches: Dict[str, asyncio.Future] = {}
+
+    async def load_many(self, ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        missing = [i for i in ids if i not in self._batches]
+        if missing:
+            batch = asyncio.get_running_loop().create_future()
+            for i in missing:
+                self._batches[i] = batch
+            self.queries += 1
+            try:
+                docs = await self.collection.find({self.key: {"$in": missing}}, self.projection).to_list(None)
+            except Exception as e:
+                for i in missing:
+                    del self._batches[i]
+                batch.set_exception(e)
+                # Mark retrieved so concurrent waiters don't log "exception never retrieved"
+                batch.exception()
+                raise
+            batch.set_result({doc[self.key]: doc for doc in docs})
+        result = {}
+        for i in ids:
+            result[i] = (await self._batches[i]).get(i)
+        return result
+
+    async def load(self, id: str) -> Optional[dict]:
+        return (await self.load_many([id]))[id]
+
+
+class Loaders:
+    """Loaders for one request; create a fresh instance per request"""
+
+    def __init__(self, db):
+        self.users = BatchLoader(db.users, {"name": 1, "profile_image": 1})
+        self.listings = BatchLoader(db.listings, LISTING_SUMMARY_PROJECTION)
+
+    @property
+    def queries(self) -> int:
+        return self.users.queries + self.listings.queries
@@ -0,0 +1,147 @@
+"""Maintenance commands, e.g. ``python manage.py migrate-media``"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import db, client, media_store, job_queue
+from media import collect_garbage, migrate_inline_media
+from conversations import rebuild_conversations
+from search import reindex_listings
+from ratings import check_ratings, rebuild_ratings
+from unread import reconcile as reconcile_unread
+import indexes
+from recommendations import compute_recommendations
+from geo import geocode_listings
+from stats import recount as recount_stats
+
+
+async def migrate_media(args):
+    return await migrate_inline_media(db, media_store, batch_size=args.batch_size)
+
+
+async def rebuild_conversations_command(args):
+    return await rebuild_conversations(db, batch_size=args.batch_size)
+
+
+async def reindex_search(args):
+    return await reindex_listings(db, batch_size=args.batch_size)
+
+
+async def rebuild_ratings_command(args):
+    return await rebuild_ratings(db, batch_size=args.batch_size)
+
+
+async def check_ratings_command(args):
+    mismatches = await check_ratings(db)
+    if mismatches:
+        args.exit_code = 1
+    return {"mismatches": len(mismatches), "users": mismatches[:100]}
+
+
+async def reconcile_unread_command(args):
+    return await reconcile_unread(db, batch_size=args.batch_size)
+
+
+async def check_indexes_command(args):
+    result = {"ensure": await indexes.ensure_indexes(db)}
+    report = await indexes.index_report(db)
+    if args.drop_undeclared:
+        report["dropped"] = await indexes.drop_undeclared(db, report)
+    result["report"] = report
+    result["plans"] = await indexes.check_query_plans(db)
+    if result["plans"] or result["ensure"]["failed"]:
+        args.exit_code = 1
+    return result
+
+
+async def compute_recommendations_command(args):
+    return await compute_recommendations(db, top_n=args.top_n, pool_size=args.pool_size, batch_size=args.batch_size)
+
+
+async def geocode_listings_command(args):
+    return await geocode_listings(db, batch_size=args.batch_size, all_listings=args.all)
+
+
+async def run_jobs_command(args):
+    return {"ran": await job_queue.run_pending(limit=args.limit)}
+
+
+async def recount_stats_command(args):
+    return await recount_stats(db)
+
+
+async def gc_media_command(args):
+    return await collect_garbage(db, media_store, grace_seconds=args.grace_seconds, batch_size=args.batch_size)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ChancenMarket maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("migrate-media", help="Move inline base64 listing media into the media store and backfill renditions")
+    cmd.add_argument("--batch-size", type=int, default=100)
+    cmd.set_defaults(handler=migrate_media)
+
+    cmd = commands.add_parser("rebuild-conversations", help="Backfill the conversations collection from messages")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=rebuild_conversations_command)
+
+    cmd = commands.add_parser("reindex-search", help="Recompute analyzed search fields for all listings and store number category fields as numbers")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=reindex_search)
+
+    cmd = commands.add_parser("rebuild-ratings", help="Recompute seller rating aggregates from reviews")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=rebuild_ratings_command)
+
+    cmd = commands.add_parser("check-ratings", help="Report users whose rating aggregates disagree with reviews")
+    cmd.set_defaults(handler=check_ratings_command)
+
+    cmd = commands.add_parser("reconcile-unread", help="Repair per-user and per-conversation unread message counters")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=reconcile_unread_command)
+
+    cmd = commands.add_parser("check-indexes", help="Apply declared indexes, report unused ones and fail on COLLSCAN or in-memory SORT plans")
+    cmd.add_argument("--drop-undeclared", action="store_true", help="Drop indexes that are not declared in indexes.py")
+    cmd.set_defaults(handler=check_indexes_command)
+
+    cmd = commands.add_parser("compute-recommendations", help="Precompute personalized recommendations (run periodically, e.g. hourly from cron)")
+    cmd.add_argument("--top-n", type=int, default=50)
+    cmd.add_argument("--pool-size", type=int, default=2000, help="Most viewed listings considered as candidates")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=compute_recommendations_command)
+
+    cmd = commands.add_parser("geocode-listings", help="Backfill listing coordinates from the bundled gazetteer")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.add_argument("--all", action="store_true", help="Re-geocode every listing, not only those never geocoded")
+    cmd.set_defaults(handler=geocode_listings_command)
+
+    cmd = commands.add_parser("run-jobs", help="Run due background jobs in this process (for JOB_WORKERS=0 deployments)")
+    cmd.add_argument("--limit", type=int, default=None)
+    cmd.set_defaults(handler=run_jobs_command)
+
+    cmd = commands.add_parser("gc-media", help="Delete media blobs no listing, user or message references any more")
+    cmd.add_argument("--grace-seconds", type=float, default=3600, help="Keep blobs stored more recently than this")
+    cmd.add_argument("--batch-size", type=int, default=500)
+    cmd.set_defaults(handler=gc_media_command)
+
+    cmd = commands.add_parser("recount-stats", help="Backfill missing verified/pinned flags and recount the admin dashboard counters exactly")
+    cmd.set_defaults(handler=recount_stats_command)
+
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    try:
+        result = asyncio.run(args.handler(args))
+    finally:
+        client.close()
+    if result is not None:
+        print(json.dumps(result, indent=2, default=str))
+    sys.exit(getattr(args, "exit_code", 0))
+
+
+if __name__ == "__main__":
+    main()
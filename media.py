@@ -0,0 +1,367 @@
+"""Content-addressed media storage for listing images and videos.
+
+Blobs are stored once under the SHA-256 of their bytes; listing documents only
+keep short references of the form ``/api/media/<sha256>``.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from image_pipeline import render_image
+
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = "/api/media/"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Accepted image types that only decode with an optional Pillow plugin
+UNRENDERED_TYPES = {"image/heic"}
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+_DATA_URI_RE = re.compile(r'^data:(?P<type>[\w.+-]+/[\w.+-]+)?(?:;[^,;]+)*;base64,', re.IGNORECASE)
+
+
+def is_valid_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value or ''))
+
+
+def media_ref(digest: str) -> str:
+    return f"{MEDIA_URL_PREFIX}{digest}"
+
+
+def is_media_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(MEDIA_URL_PREFIX) and is_valid_digest(value[len(MEDIA_URL_PREFIX):])
+
+
+def digest_from_ref(ref: str) -> Optional[str]:
+    return ref[len(MEDIA_URL_PREFIX):] if is_media_ref(ref) else None
+
+
+def is_external_url(value) -> bool:
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+
+def sniff_content_type(data: bytes) -> str:
+    """Guess the MIME type from the first bytes of a blob"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        brand = data[8:12]
+        if brand in (b'heic', b'heix', b'mif1'):
+            return 'image/heic'
+        if brand == b'qt  ':
+            return 'video/quicktime'
+        return 'video/mp4'
+    if data.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    return 'application/octet-stream'
+
+
+def decode_data_uri(value: str) -> Tuple[bytes, Optional[str]]:
+    """Decode a base64 payload (with or without ``data:`` prefix). Raises ValueError."""
+    content_type = None
+    match = _DATA_URI_RE.match(value)
+    if match:
+        content_type = match.group('type')
+        value = value[match.end():]
+    try:
+        data = base64.b64decode(''.join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid base64 payload")
+    if not data:
+        raise ValueError("empty payload")
+    return data, content_type
+
+
+class LocalMediaBackend:
+    """Stores blobs on local disk, sharded by the first bytes of the digest"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    async def exists(self, digest: str) -> bool:
+        return await asyncio.to_thread(self.local_path(digest).exists)
+
+    async def put(self, digest: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, self.local_path(digest), data)
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        path = self.local_path(digest)
+        try:
+            return await asyncio.to_thread(path.read_bytes)
+        except FileNotFoundError:
+            return None
+
+    async def delete(self, digest: str):
+        try:
+            await asyncio.to_thread(self.local_path(digest).unlink)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+class S3MediaBackend:
+    """Stores blobs in any S3-compatible bucket (AWS, MinIO, R2, ...)"""
+
+    def __init__(self, bucket: str, prefix: str = "media/", **client_kwargs):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', **client_kwargs)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return None
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    async def exists(self, digest: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(digest))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    async def put(self, digest: str, data: bytes, content_type: str):
+        await asyncio.to_thread(
+            self.client.put_object,
+            Bucket=self.bucket, Key=self._key(digest), Body=data,
+            ContentType=content_type, CacheControl=CACHE_CONTROL,
+        )
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        from botocore.exceptions import ClientError
+        try:
+            obj = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=self._key(digest))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return await asyncio.to_thread(obj['Body'].read)
+
+    async def delete(self, digest: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(digest))
+
+
+class MediaStore:
+    """Deduplicating media store; metadata lives in the ``media`` collection"""
+
+    def __init__(self, db, backend):
+        self.collection = db.media
+        self.backend = backend
+
+    async def put(self, data: bytes, content_type: Optional[str] = None) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if not content_type or content_type == 'application/octet-stream':
+            content_type = sniff_content_type(data)
+        if not await self.backend.exists(digest):
+            await self.backend.put(digest, data, content_type)
+        await self.collection.update_one(
+            {"id": digest},
+            {"$setOnInsert": {"id": digest, "content_type": content_type, "size": len(data), "created_at": datetime.utcnow()},
+             # Re-uploads of a deduplicated blob protect it from the garbage collector's grace period
+             "$set": {"last_stored_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return media_ref(digest)
+
+    async def store(self, value: str) -> str:
+        """Turn an incoming base64 payload into a reference; references pass through"""
+        if is_media_ref(value) or is_external_url(value):
+            return value
+        data, content_type = decode_data_uri(value)
+        return await self.put(data, content_type)
+
+    async def store_all(self, values: List[str]) -> List[str]:
+        # Sequential on purpose: keeps at most one decoded blob in memory
+        return [await self.store(value) for value in values or []]
+
+    async def store_image(self, value: str, backfill: bool = False) -> dict:
+        """Store an image and its renditions; returns ``{"original", "thumb", "medium"}`` references"""
+        if is_external_url(value):
+            return {"original": value, "thumb": value, "medium": value}
+        if is_media_ref(value):
+            info = await self.info(digest_from_ref(value)) or {}
+            if info.get('rendition_of'):
+                # A client echoed back a rendition: resolve it to its original
+                value = media_ref(info['rendition_of'])
+                info = await self.info(info['rendition_of']) or {}
+            renditions = info.get('renditions')
+            if renditions:
+                return {"original": value, **renditions}
+            if not backfill:
+                return {"original": value, "thumb": value, "medium": value}
+            data = await self.get(digest_from_ref(value))
+            if data is None:
+                raise ValueError("media blob missing")
+        else:
+            data, _ = decode_data_uri(value)
+        try:
+            rendered = await render_image(data)
+        except ValueError:
+            if sniff_content_type(data) not in UNRENDERED_TYPES:
+                raise
+            # No decoder here (pillow-heif missing): store the upload as is, without renditions
+            original = await self.put(data)
+            return {"original": original, "thumb": original, "medium": original}
+        original = await self.put(*rendered.pop('original'))
+        renditions = {}
+        for name, (blob, content_type) in rendered.items():
+            renditions[name] = await self.put(blob, content_type)
+            await self.collection.update_one(
+                {"id": digest_from_ref(renditions[name])},
+                {"$set": {"rendition_of": digest_from_ref(original), "rendition": name}}
+            )
+        await self.collection.update_one({"id": digest_from_ref(original)}, {"$set": {"renditions": renditions}})
+        return {"original": original, **renditions}
+
+    async def store_images(self, values: List[str], backfill: bool = False) -> dict:
+        """Store a listing's images; returns parallel ``images``/``thumbnails``/``medium_images`` lists"""
+        result = {"images": [], "thumbnails": [], "medium_images": []}
+        for value in values or []:
+            stored = await self.store_image(value, backfill=backfill)
+            result["images"].append(stored["original"])
+            result["thumbnails"].append(stored["thumb"])
+            result["medium_images"].append(stored["medium"])
+        return result
+
+    async def info(self, digest: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": digest}, {"_id": 0})
+
+    async def get(self, digest: str) -> Optional[bytes]:
+        return await self.backend.get(digest)
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        return self.backend.local_path(digest)
+
+
+def media_store_from_env(db, default_root) -> MediaStore:
+    backend_name = os.getenv('MEDIA_BACKEND', 'local').lower()
+    if backend_name == 's3':
+        client_kwargs = {}
+        if os.getenv('MEDIA_S3_ENDPOINT_URL'):
+            client_kwargs['endpoint_url'] = os.getenv('MEDIA_S3_ENDPOINT_URL')
+        if os.getenv('MEDIA_S3_REGION'):
+            client_kwargs['region_name'] = os.getenv('MEDIA_S3_REGION')
+        backend = S3MediaBackend(os.environ['MEDIA_S3_BUCKET'], os.getenv('MEDIA_S3_PREFIX', 'media/'), **client_kwargs)
+    else:
+        backend = LocalMediaBackend(os.getenv('MEDIA_ROOT', str(default_root)))
+    return MediaStore(db, backend)
+
+
+async def migrate_inline_media(db, store: MediaStore, batch_size: int = 100) -> dict:
+    """Move base64 images/videos embedded in listings into the media store
+    and generate renditions for images that do not have them yet"""
+    stats = {"scanned": 0, "migrated": 0, "failed": 0}
+    projection = {"_id": 0, "id": 1, "images": 1, "videos": 1, "thumbnails": 1}
+    cursor = db.listings.find({}, projection).batch_size(batch_size)
+    async for listing in cursor:
+        stats["scanned"] += 1
+        images = listing.get('images') or []
+        videos = listing.get('videos') or []
+        if (all(is_media_ref(v) or is_external_url(v) for v in images + videos)
+                and len(listing.get('thumbnails') or []) == len(images)):
+            continue
+        try:
+            update = await store.store_images(images, backfill=True)
+            update["videos"] = await store.store_all(videos)
+        except ValueError as e:
+            stats["failed"] += 1
+            logger.warning(f"Skipping listing {listing['id']}: {e}")
+            continue
+        await db.listings.update_one({"id": listing['id']}, {"$set": update})
+        stats["migrated"] += 1
+    return stats
+
+
+# Fields that may hold media references, per collection
+MEDIA_FIELDS = {
+    "listings": ("images", "thumbnails", "medium_images", "videos"),
+    "users": ("profile_image",),
+    "messages": ("images", "audio"),
+}
+
+
+async def referenced_media(db, batch_size: int = 1000) -> Set[str]:
+    """Mark phase: digests referenced anywhere, plus the renditions of referenced originals"""
+    marked = set()
+    for collection, fields in MEDIA_FIELDS.items():
+        # Only documents that can contain a reference; inline base64 values are skipped by the filter
+        query = {"$or": [{field: {"$regex": f"^{re.escape(MEDIA_URL_PREFIX)}"}} for field in fields]}
+        async for doc in db[collection].find(query, {"_id": 0, **{field: 1 for field in fields}}).batch_size(batch_size):
+            for field in fields:
+                values = doc.get(field)
+                for value in values if isinstance(values, list) else [values]:
+                    digest = digest_from_ref(value)
+                    if digest:
+                        marked.add(digest)
+    async for info in db.media.find({"rendition_of": {"$exists": True}}, {"_id": 0, "id": 1, "rendition_of": 1}):
+        if info['rendition_of'] in marked:
+            marked.add(info['id'])
+    return marked
+
+
+async def collect_garbage(db, store: MediaStore, grace_seconds: float = 3600, batch_size: int = 500,
+                          progress=None) -> dict:
+    """Delete blobs nothing references any more (mark and sweep).
+    Blobs stored within ``grace_seconds`` are kept: a listing may be about to reference them."""
+    marked = await referenced_media(db)
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    old = {"$or": [{"last_stored_at": {"$lt": cutoff}}, {"last_stored_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]}
+    stats = {"referenced": len(marked), "deleted": 0, "bytes": 0}
+    batch = []
+
+    async def sweep():
+        for info in batch:
+            # Re-check the age so a blob stored again since the scan survives
+            removed = await store.collection.find_one_and_delete({"$and": [{"id": info['id']}, old]})
+            if removed is not None:
+                await store.backend.delete(info['id'])
+                stats["deleted"] += 1
+                stats["bytes"] += info.get('size', 0)
+        batch.clear()
+        if progress is not None:
+            await progress(stats)
+
+    async for info in store.collection.find(old, {"_id": 0, "id": 1, "size": 1}).batch_size(batch_size):
+        if info['id'] not in marked:
+            batch.append(info)
+            if len(batch) >= batch_size:
+                await sweep()
+    if batch:
+        await sweep()
+    return stats
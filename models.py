@@ -47,6 +47,7 @@ class User(BaseModel):
     role: UserRole = UserRole.USER
     rating: float = 0.0
     review_count: int = 0
+    rating_histogram: Dict[str, int] = {}  # "1".."5" -> عدد التقييمات
     profile_image: Optional[str] = None
     phone_enabled: bool = False  # للاتصال الصوتي
     is_verified: bool = False  # بائع موثوق
@@ -74,6 +75,8 @@ class Listing(BaseModel):
     price: float
     category: str
     images: List[str] = []
+    thumbnails: List[str] = []  # WebP 320px, parallel to images
+    medium_images: List[str] = []  # WebP 960px, parallel to images
     videos: List[str] = []  # إضافة دعم الفيديوهات
     category_fields: Dict[str, Any] = {}
     views: int = 0
@@ -84,6 +87,35 @@ class Listing(BaseModel):
     is_pinned: bool = False  # تثبيت في الواجهة
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ListingSummary(BaseModel):
+    """Card view of a listing returned by feed and list endpoints"""
+    id: str
+    seller_id: str
+    seller_name: str
+    title: str
+    price: float
+    category: str
+    images: List[str] = []  # first thumbnail only
+    videos: List[str] = []
+    views: int = 0
+    negotiable: bool = False
+    location: Optional[str] = None
+    is_pinned: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    distance_km: Optional[float] = None  # only set for searches around a place
+
+# Mongo projection for Listing; leaves out analyzed search and geo fields
+LISTING_PROJECTION = {"_id": 0, **{name: 1 for name in Listing.model_fields}}
+
+# Mongo projection for ListingSummary; $slice keeps legacy inline media out of list queries
+LISTING_SUMMARY_PROJECTION = {
+    **{name: 1 for name in ListingSummary.model_fields},
+    "_id": 0,
+    "images": {"$slice": 1},
+    "thumbnails": {"$slice": 1},
+    "videos": {"$slice": 1},
+}
+
 # Message Models
 class MessageCreate(BaseModel):
     to_user_id: str
@@ -0,0 +1,71 @@
+"""Keyset (cursor) pagination with opaque tokens.
+
+A cursor encodes the sort value and ``id`` of the last row of a page; the next
+page continues strictly after it, so deep pages cost the same as the first one
+and concurrent inserts do not shift rows between pages.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Named sort orders accepted by list endpoints
+SORTS = {
+    "recent": ("created_at", -1),
+    "popular": ("views", -1),
+}
+
+
+def encode_cursor(sort_field: str, doc: dict) -> str:
+    value = doc.get(sort_field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    payload = json.dumps({"f": sort_field, "v": value, "id": doc['id']}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str, sort_field: str) -> Tuple[object, str]:
+    """Return ``(sort_value, id)``; raises ValueError for malformed or foreign cursors"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        value, last_id = payload['v'], payload['id']
+        if payload['f'] != sort_field or not isinstance(last_id, str):
+            raise ValueError
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value['$date'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("invalid cursor")
+    return value, last_id
+
+
+def keyset_filter(sort_field: str, direction: int, value, last_id: str) -> dict:
+    op = "$lt" if direction < 0 else "$gt"
+    return {"$or": [{sort_field: {op: value}}, {sort_field: value, "id": {op: last_id}}]}
+
+
+def after_row(query: dict, sort_field: str, direction: int, value, last_id: str) -> dict:
+    """``query`` restricted to the rows following ``(value, last_id)`` in keyset order"""
+    after = keyset_filter(sort_field, direction, value, last_id)
+    return {"$and": [query, after]} if query else after
+
+
+def keyset_sort(sort_field: str, direction: int) -> List[tuple]:
+    return [(sort_field, direction), ("id", direction)]
+
+
+async def paginate(collection, query: dict, projection: dict, sort_field: str, direction: int,
+                   limit: int, cursor: Optional[str] = None, skip: int = 0) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page; ``skip`` is honoured only when no cursor is given (legacy clients).
+    The projection must include ``id`` and the sort field."""
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_field)
+        query = after_row(query, sort_field, direction, value, last_id)
+        skip = 0
+    find = collection.find(query, projection).sort(keyset_sort(sort_field, direction))
+    if skip:
+        find = find.skip(skip)
+    docs = await find.limit(limit).to_list(limit)
+    next_cursor = encode_cursor(sort_field, docs[-1]) if docs and len(docs) == limit else None
+    return docs, next_cursor
@@ -0,0 +1,101 @@
+"""Incrementally maintained seller rating aggregates.
+
+Each user document carries ``rating_sum``, ``review_count``, a per-star
+``rating_histogram`` and the derived ``rating``. Writes apply a delta in a
+single atomic pipeline update instead of reloading every review.
+"""
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+STARS = ("1", "2", "3", "4", "5")
+
+
+def _delta_pipeline(sum_delta: int, count_delta: int, histogram_delta: Dict[str, int]) -> list:
+    stats = {
+        # Users rated before the aggregates existed only have rating/review_count
+        "rating_sum": {"$add": [
+            {"$ifNull": ["$rating_sum", {"$multiply": [{"$ifNull": ["$rating", 0]}, {"$ifNull": ["$review_count", 0]}]}]},
+            sum_delta,
+        ]},
+        "review_count": {"$add": [{"$ifNull": ["$review_count", 0]}, count_delta]},
+    }
+    for star, delta in histogram_delta.items():
+        stats[f"rating_histogram.{star}"] = {"$add": [{"$ifNull": [f"$rating_histogram.{star}", 0]}, delta]}
+    return [
+        {"$set": stats},
+        {"$set": {"rating": {"$cond": [
+            {"$gt": ["$review_count", 0]}, {"$divide": ["$rating_sum", "$review_count"]}, 0.0
+        ]}}},
+    ]
+
+
+async def add_review(db, user_id: str, rating: int):
+    await db.users.update_one({"id": user_id}, _delta_pipeline(rating, 1, {str(rating): 1}))
+
+
+async def remove_reviews(db, reviews: Iterable[dict]):
+    """Reverse the aggregates of reviews that are about to be deleted"""
+    per_user = defaultdict(Counter)
+    for review in reviews:
+        per_user[review['reviewed_user_id']][str(review['rating'])] += 1
+    for user_id, histogram in per_user.items():
+        await db.users.update_one({"id": user_id}, _delta_pipeline(
+            -sum(int(star) * n for star, n in histogram.items()),
+            -sum(histogram.values()),
+            {star: -n for star, n in histogram.items()},
+        ))
+
+
+async def _aggregate(db) -> Dict[str, dict]:
+    pipeline = [{"$group": {"_id": {"user": "$reviewed_user_id", "rating": "$rating"}, "n": {"$sum": 1}}}]
+    result = defaultdict(lambda: {"rating_sum": 0, "review_count": 0, "rating_histogram": {star: 0 for star in STARS}})
+    async for row in db.reviews.aggregate(pipeline, allowDiskUse=True):
+        stats = result[row['_id']['user']]
+        star = str(row['_id']['rating'])
+        stats["rating_sum"] += int(star) * row['n']
+        stats["review_count"] += row['n']
+        stats["rating_histogram"][star] = stats["rating_histogram"].get(star, 0) + row['n']
+    for stats in result.values():
+        stats["rating"] = stats["rating_sum"] / stats["review_count"]
+    return result
+
+
+async def rebuild_ratings(db, batch_size: int = 500) -> dict:
+    """Recompute every user's rating aggregates from the reviews collection"""
+    expected = await _aggregate(db)
+    ops = []
+    reset = {"rating_sum": 0, "review_count": 0, "rating_histogram": {star: 0 for star in STARS}, "rating": 0.0}
+    stats = {"updated": 0}
+    async for user in db.users.find({}, {"_id": 0, "id": 1}).batch_size(batch_size):
+        ops.append(UpdateOne({"id": user['id']}, {"$set": expected.get(user['id'], reset)}))
+        if len(ops) >= batch_size:
+            await db.users.bulk_write(ops, ordered=False)
+            stats["updated"] += len(ops)
+            ops = []
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        stats["updated"] += len(ops)
+    return stats
+
+
+async def check_ratings(db) -> List[dict]:
+    """Users whose stored aggregates disagree with their reviews"""
+    expected = await _aggregate(db)
+    mismatches = []
+    projection = {"_id": 0, "id": 1, "rating_sum": 1, "review_count": 1, "rating_histogram": 1}
+    async for user in db.users.find({}, projection):
+        want = expected.get(user['id'])
+        want_count = want["review_count"] if want else 0
+        want_sum = want["rating_sum"] if want else 0
+        want_histogram = {star: n for star, n in (want["rating_histogram"] if want else {}).items() if n}
+        have_histogram = {star: n for star, n in (user.get('rating_histogram') or {}).items() if n}
+        if (user.get('review_count', 0), user.get('rating_sum', 0), have_histogram) != (want_count, want_sum, want_histogram):
+            mismatches.append({"user_id": user['id'], "stored_count": user.get('review_count', 0), "expected_count": want_count})
+    if mismatches:
+        logger.warning(f"{len(mismatches)} users have inconsistent rating aggregates")
+    return mismatches
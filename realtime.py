@@ -0,0 +1,123 @@
+"""Pub/sub hub pushing chat, offer and unread events to WebSocket clients.
+
+Every worker keeps its own subscriber table. A backend carries published
+events to the workers: ``LocalBackend`` delivers in-process (single worker,
+tests); ``MongoChangeStreamBackend`` inserts into a collection that every
+worker watches with a change stream (requires a replica set).
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[str, dict], Awaitable[None]]
+
+QUEUE_SIZE = 100
+# TTL of realtime_events; the index is declared in indexes.py
+EVENT_TTL_SECONDS = 3600
+
+
+class LocalBackend:
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, user_id: str, event: dict):
+        await self._deliver(user_id, event)
+
+    async def stop(self):
+        pass
+
+
+class MongoChangeStreamBackend:
+    def __init__(self, collection):
+        self.collection = collection
+        self._task = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            try:
+                async with self.collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                    async for change in stream:
+                        doc = change['fullDocument']
+                        await self._deliver(doc['user_id'], doc['event'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Realtime change stream interrupted: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, user_id: str, event: dict):
+        await self.collection.insert_one({"user_id": user_id, "event": event, "created_at": datetime.utcnow()})
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class Hub:
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    async def publish(self, user_id: str, event: dict):
+        """Publish a JSON-compatible event to every connection of ``user_id``"""
+        self.published += 1
+        try:
+            await self.backend.publish(user_id, event)
+        except Exception as e:
+            # Push is best effort; clients still have the REST endpoints
+            logger.warning(f"Failed to publish realtime event: {e}")
+
+    async def _deliver(self, user_id: str, event: dict):
+        for queue in list(self._subscribers.get(user_id, ())):
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than blocking everyone
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+            self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+def hub_from_env(db) -> Hub:
+    if os.getenv('REALTIME_BACKEND', 'local').lower() == 'mongo':
+        return Hub(MongoChangeStreamBackend(db.realtime_events))
+    return Hub(LocalBackend())
@@ -0,0 +1,169 @@
+"""Precomputed personalized recommendations.
+
+``compute_recommendations`` runs periodically (``python manage.py
+compute-recommendations`` from cron) and stores the top ``top_n`` listing ids
+per user in ``recommendations``. Candidates are a pool of the most viewed and
+newest listings; each is scored from the user's favorites, offers and views by
+
+* item-item co-favorite cosine similarity (NumPy, over the pool),
+* category and brand affinity,
+* popularity (log views) as a tie breaker.
+
+The endpoint only hydrates the stored ids and drops listings that are gone or
+belong to the user, so results may lag one run behind new activity.
+"""
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# How strongly each kind of interaction expresses interest
+INTERACTION_WEIGHTS = {"favorite": 3.0, "offer": 4.0, "view": 1.0}
+SCORE_WEIGHTS = {"similar": 1.0, "category": 0.5, "brand": 0.3, "popular": 0.1}
+
+LISTING_FIELDS = {"_id": 0, "id": 1, "seller_id": 1, "category": 1, "category_fields.brand": 1, "views": 1}
+
+
+def brand_key(listing: dict) -> Optional[str]:
+    brand = (listing.get('category_fields') or {}).get('brand')
+    if isinstance(brand, str) and brand.strip():
+        # Brands are free text in some categories and may repeat across them
+        return f"{listing['category']}:{brand.strip().lower()}"
+    return None
+
+
+async def load_interactions(db) -> Tuple[Dict[str, Dict[str, float]], Dict[str, Set[str]]]:
+    """``(user id -> listing id -> interaction weight, user id -> favorited or offered listing ids)``"""
+    weights: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    engaged: Dict[str, Set[str]] = defaultdict(set)
+    async for fav in db.favorites.find({}, {"_id": 0, "user_id": 1, "listing_id": 1}):
+        weights[fav['user_id']][fav['listing_id']] += INTERACTION_WEIGHTS["favorite"]
+        engaged[fav['user_id']].add(fav['listing_id'])
+    async for offer in db.offers.find({}, {"_id": 0, "buyer_id": 1, "listing_id": 1}):
+        weights[offer['buyer_id']][offer['listing_id']] += INTERACTION_WEIGHTS["offer"]
+        engaged[offer['buyer_id']].add(offer['listing_id'])
+    async for view in db.user_views.find({}, {"_id": 0, "user_id": 1, "listing_id": 1, "count": 1}):
+        weights[view['user_id']][view['listing_id']] += INTERACTION_WEIGHTS["view"] * math.log1p(view.get('count', 1))
+    return weights, engaged
+
+
+async def load_pool(db, pool_size: int) -> List[dict]:
+    pool = {}
+    async for listing in db.listings.find({}, LISTING_FIELDS).sort("views", -1).limit(pool_size):
+        pool[listing['id']] = listing
+    async for listing in db.listings.find({}, LISTING_FIELDS).sort("created_at", -1).limit(max(pool_size // 4, 1)):
+        pool.setdefault(listing['id'], listing)
+    return list(pool.values())
+
+
+def co_favorite_similarity(favorites: Dict[str, List[int]], size: int) -> np.ndarray:
+    """Cosine similarity of pool items by the users who favorited both"""
+    co = np.zeros((size, size), dtype=np.float32)
+    for items in favorites.values():
+        if len(items) > 1:
+            idx = np.array(items)
+            co[np.ix_(idx, idx)] += 1
+        elif items:
+            co[items[0], items[0]] += 1
+    norms = np.sqrt(np.diag(co))
+    denominator = np.outer(norms, norms)
+    similarity = np.divide(co, denominator, out=np.zeros_like(co), where=denominator > 0)
+    np.fill_diagonal(similarity, 0)
+    return similarity
+
+
+def _affinity(weights: Dict[str, float], vocabulary: Dict[str, int]) -> np.ndarray:
+    vector = np.zeros(len(vocabulary) + 1, dtype=np.float32)  # last slot: unknown/no brand
+    for key, weight in weights.items():
+        vector[vocabulary.get(key, len(vocabulary))] += weight
+    vector[-1] = 0
+    peak = vector.max()
+    return vector / peak if peak > 0 else vector
+
+
+async def compute_recommendations(db, top_n: int = 50, pool_size: int = 2000, batch_size: int = 500) -> dict:
+    started = time.monotonic()
+    computed_at = datetime.utcnow()
+    interactions, engaged = await load_interactions(db)
+    pool = await load_pool(db, pool_size)
+    index = {listing['id']: i for i, listing in enumerate(pool)}
+
+    # Metadata of everything users interacted with, also outside the pool; deleted listings drop out here
+    meta = {listing['id']: listing for listing in pool}
+    wanted = list({lid for items in interactions.values() for lid in items if lid not in meta})
+    for start in range(0, len(wanted), 5000):
+        async for listing in db.listings.find({"id": {"$in": wanted[start:start + 5000]}}, LISTING_FIELDS):
+            meta[listing['id']] = listing
+
+    categories = {c: i for i, c in enumerate(sorted({listing['category'] for listing in meta.values()}))}
+    brands = {b: i for i, b in enumerate(sorted({b for b in map(brand_key, meta.values()) if b}))}
+    item_category = np.array([categories[listing['category']] for listing in pool], dtype=np.int64)
+    item_brand = np.array([brands.get(brand_key(listing), len(brands)) for listing in pool], dtype=np.int64)
+    views = np.log1p(np.array([listing.get('views', 0) for listing in pool], dtype=np.float32))
+    popularity = views / views.max() if len(pool) and views.max() > 0 else views
+    sellers = np.array([listing['seller_id'] for listing in pool], dtype=object)
+
+    favorites = defaultdict(list)
+    async for fav in db.favorites.find({}, {"_id": 0, "user_id": 1, "listing_id": 1}):
+        if fav['listing_id'] in index:
+            favorites[fav['user_id']].append(index[fav['listing_id']])
+    similarity = co_favorite_similarity({u: sorted(set(items)) for u, items in favorites.items()}, len(pool))
+
+    ops = []
+    stats = {"users": 0, "pool": len(pool)}
+    for user_id, items in interactions.items():
+        known = {lid: w for lid, w in items.items() if lid in meta}
+        if not known or not len(pool):
+            continue
+        category_weights, brand_weights = defaultdict(float), defaultdict(float)
+        for lid, weight in known.items():
+            category_weights[meta[lid]['category']] += weight
+            key = brand_key(meta[lid])
+            if key:
+                brand_weights[key] += weight
+
+        in_pool = [(index[lid], w) for lid, w in known.items() if lid in index]
+        score = (SCORE_WEIGHTS["category"] * _affinity(category_weights, categories)[item_category]
+                 + SCORE_WEIGHTS["brand"] * _affinity(brand_weights, brands)[item_brand]
+                 + SCORE_WEIGHTS["popular"] * popularity)
+        if in_pool:
+            rows = np.array([i for i, _ in in_pool])
+            row_weights = np.array([w for _, w in in_pool], dtype=np.float32)
+            score += SCORE_WEIGHTS["similar"] * (row_weights @ similarity[rows]) / row_weights.sum()
+
+        # Never recommend own listings or ones already favorited / offered on
+        score[sellers == user_id] = -np.inf
+        score[[index[lid] for lid in engaged.get(user_id, ()) if lid in index]] = -np.inf
+
+        n = min(top_n, len(pool))
+        top = np.argpartition(-score, n - 1)[:n]
+        top = top[np.argsort(-score[top])]
+        listing_ids = [pool[i]['id'] for i in top if np.isfinite(score[i])]
+        ops.append(UpdateOne({"user_id": user_id},
+                             {"$set": {"listing_ids": listing_ids, "computed_at": computed_at}}, upsert=True))
+        if len(ops) >= batch_size:
+            await db.recommendations.bulk_write(ops, ordered=False)
+            stats["users"] += len(ops)
+            ops = []
+    if ops:
+        await db.recommendations.bulk_write(ops, ordered=False)
+        stats["users"] += len(ops)
+
+    # Users without interactions any more fall back to popular listings
+    result = await db.recommendations.delete_many({"computed_at": {"$lt": computed_at}})
+    stats["removed"] = result.deleted_count
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    logger.info(f"Recommendations computed: {stats}")
+    return stats
+
+
+async def recommended_ids(db, user_id: str) -> List[str]:
+    doc = await db.recommendations.find_one({"user_id": user_id}, {"_id": 0, "listing_ids": 1})
+    return doc['listing_ids'] if doc else []
@@ -0,0 +1,199 @@
+"""Listing full-text search with German/Arabic-aware normalization.
+
+Listings carry pre-analyzed ``search_title``/``search_body`` fields backed by a
+weighted Mongo text index (language "none": stemming happens here, so German
+and Arabic share one index), plus ``search_prefixes`` edge n-grams for
+autocomplete.
+"""
+import math
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from categories import registry as category_registry
+
+TEXT_INDEX_NAME = "listing_search"
+TEXT_INDEX_WEIGHTS = {"search_title": 5, "search_body": 1}
+# Relevance first; results are paged with skip/limit since the score is no stable key
+TEXT_SORT = [("score", {"$meta": "textScore"}), ("created_at", -1)]
+# Listings with at least one video (the partial index in indexes.py holds exactly these)
+HAS_VIDEOS = {"videos.0": {"$exists": True}}
+MIN_PREFIX = 2
+MAX_PREFIX = 12
+CATEGORY_FIELD_PARAM = "cf."
+RANGE_OPERATORS = {"min": "$gte", "max": "$lte"}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_ARABIC_RE = re.compile(r'[؀-ۿ]')
+_ARABIC_DIACRITICS_RE = re.compile(r'[ً-ْٰـ]')
+_ARABIC_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي'})
+_GERMAN_FOLD = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+STOPWORDS = {
+    # German
+    'der', 'die', 'das', 'den', 'dem', 'des', 'ein', 'eine', 'einen', 'einem', 'einer', 'und', 'oder',
+    'mit', 'ohne', 'fuer', 'von', 'vom', 'zu', 'zum', 'zur', 'im', 'in', 'am', 'an', 'auf', 'aus',
+    'bei', 'ist', 'sind', 'wie', 'sehr', 'nur', 'auch', 'nicht', 'noch',
+    # Arabic
+    'في', 'من', 'الي', 'علي', 'عن', 'مع', 'هذا', 'هذه', 'ذلك', 'التي', 'الذي', 'او', 'و', 'ثم',
+}
+
+_GERMAN_SUFFIXES = ('ern', 'em', 'er', 'en', 'es', 'e', 's', 'n')
+_ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+_ARABIC_SUFFIXES = ('ات', 'ون', 'ين', 'ان', 'ها', 'يه', 'ه')
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = _ARABIC_DIACRITICS_RE.sub('', text)
+    return text.translate(_ARABIC_FOLD).translate(_GERMAN_FOLD)
+
+
+def _stem_german(token: str) -> str:
+    for suffix in _GERMAN_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def _stem_arabic(token: str) -> str:
+    for prefix in _ARABIC_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            token = token[len(prefix):]
+            break
+    for suffix in _ARABIC_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 2:
+            return token[:-len(suffix)]
+    return token
+
+
+def stem(token: str) -> str:
+    if token.isdigit():
+        return token
+    return _stem_arabic(token) if _ARABIC_RE.search(token) else _stem_german(token)
+
+
+def words(text: str) -> List[str]:
+    """Normalized tokens without stopwords, in order"""
+    return [t for t in _TOKEN_RE.findall(normalize(text)) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def analyze(text: str) -> List[str]:
+    return [stem(t) for t in words(text)]
+
+
+def prefixes(text: str) -> List[str]:
+    result = set()
+    for token in words(text):
+        for size in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1):
+            result.add(token[:size])
+    return sorted(result)
+
+
+def search_fields(title: str, description: str, category_fields: Optional[dict] = None) -> dict:
+    """Analyzed fields to $set on a listing whenever its text changes"""
+    field_values = ' '.join(str(v) for v in (category_fields or {}).values() if isinstance(v, (str, int, float)))
+    return {
+        "search_title": ' '.join(analyze(title)),
+        "search_body": ' '.join(analyze(f"{description or ''} {field_values}")),
+        "search_prefixes": prefixes(f"{title or ''} {field_values}"),
+    }
+
+
+def text_query(search: str) -> Optional[dict]:
+    """``$text`` filter for a user query, or None if nothing searchable remains"""
+    terms = list(dict.fromkeys(analyze(search)))
+    if not terms:
+        return None
+    # Terms are \w+ only, so nothing can be read as a phrase or negation
+    return {"$search": ' '.join(terms)}
+
+
+def autocomplete_query(search: str) -> Optional[dict]:
+    terms = [t[:MAX_PREFIX] for t in words(search) if len(t) >= MIN_PREFIX]
+    if not terms:
+        return None
+    return {"search_prefixes": {"$all": list(dict.fromkeys(terms))}}
+
+
+def _number(value: str):
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _coerce(value: str):
+    number = _number(value)
+    return [value] if number is None else [value, number]
+
+
+def category_field_filters(params) -> Dict[str, dict]:
+    """Build filters from ``cf.<field>=<value>`` query parameters (repeat for OR) and
+    ``cf.<field>.min`` / ``cf.<field>.max`` numeric bounds"""
+    filters = {}
+    for key in set(params.keys()):
+        if not key.startswith(CATEGORY_FIELD_PARAM):
+            continue
+        name, _, bound = key[len(CATEGORY_FIELD_PARAM):].partition('.')
+        if not re.fullmatch(r'[A-Za-z0-9_]+', name):
+            continue
+        condition = filters.setdefault(f"category_fields.{name}", {})
+        if not bound:
+            condition["$in"] = [v for raw in params.getlist(key) for v in _coerce(raw)]
+        elif bound in RANGE_OPERATORS:
+            number = _number(params[key])
+            if number is not None:
+                condition[RANGE_OPERATORS[bound]] = number
+        if not condition:
+            del filters[f"category_fields.{name}"]
+    return filters
+
+
+def field_filters(params, min_price: Optional[float] = None, max_price: Optional[float] = None) -> Dict[str, dict]:
+    """``cf.*`` and price filters keyed by field path (facets leave out their own)"""
+    filters = category_field_filters(params)
+    price = {op: value for op, value in (("$gte", min_price), ("$lte", max_price)) if value is not None}
+    if price:
+        filters['price'] = price
+    return filters
+
+
+def build_query(params, category: Optional[str] = None, search: Optional[str] = None,
+                min_price: Optional[float] = None, max_price: Optional[float] = None) -> dict:
+    """The ``GET /listings`` filter apart from the place filters (geo.py)"""
+    query = field_filters(params, min_price, max_price)
+    if category:
+        query['category'] = category
+    text = text_query(search) if search else None
+    if text:
+        query['$text'] = text
+    return query
+
+
+async def reindex_listings(db, batch_size: int = 500) -> dict:
+    """Recompute the analyzed search fields of every listing; number category fields
+    stored as strings before they were normalized are converted on the way"""
+    stats = {"indexed": 0, "normalized": 0}
+    ops = []
+    projection = {"_id": 0, "id": 1, "title": 1, "description": 1, "category": 1, "category_fields": 1}
+    async for listing in db.listings.find({}, projection).batch_size(batch_size):
+        category_fields = category_registry.normalize(listing.get('category'), listing.get('category_fields'))
+        update = search_fields(listing.get('title'), listing.get('description'), category_fields)
+        if category_fields != (listing.get('category_fields') or {}):
+            update["category_fields"] = category_fields
+            stats["normalized"] += 1
+        ops.append(UpdateOne({"id": listing['id']}, {"$set": update}))
+        if len(ops) >= batch_size:
+            await db.listings.bulk_write(ops, ordered=False)
+            stats["indexed"] += len(ops)
+            ops = []
+    if ops:
+        await db.listings.bulk_write(ops, ordered=False)
+        stats["indexed"] += len(ops)
+    return stats
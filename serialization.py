@@ -0,0 +1,57 @@
+"""Response encoding for documents read from our own database.
+
+The old path copied every document without ``_id``, validated it into a
+model, had FastAPI dump and validate it again against ``response_model`` and
+encoded the result with the standard library. Here a document projected to
+the model's fields goes through one validation pass in pydantic-core
+(``from_doc``/``from_docs``; ``_id`` and other unknown keys are ignored, no
+copy) and ``respond`` encodes it with pydantic-core's JSON serializer, which
+bypasses FastAPI's second pass. ``response_model`` stays on the routes for
+the OpenAPI schema.
+
+``model_construct`` is deliberately not used: it skips validation but runs in
+Python and is about twice as slow as the Rust validator (see
+benchmarks/serialization.py).
+"""
+from functools import lru_cache
+from typing import Iterable, List, Optional, Type, TypeVar
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+from pydantic_core import to_json, to_jsonable_python
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def projection(model: Type[BaseModel], *exclude: str, **extra) -> dict:
+    """Mongo projection of exactly the model's fields"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields if name not in exclude}, **extra}
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def from_doc(model: Type[M], doc: dict) -> M:
+    return model.model_validate(doc)
+
+
+def from_docs(model: Type[M], docs: Iterable[dict]) -> List[M]:
+    return _list_adapter(model).validate_python(docs if isinstance(docs, list) else list(docs))
+
+
+def jsonable(value):
+    """JSON-compatible plain data, e.g. for the response cache"""
+    return to_jsonable_python(value)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return to_json(content)
+
+
+def respond(content, response: Optional[Response] = None) -> FastJSONResponse:
+    """Encode ``content`` as is; headers already set on the injected ``response`` (e.g. X-Next-Cursor) are kept"""
+    return FastJSONResponse(content, headers=response.headers if response is not None else None)
@@ -1,18 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Optional
 import uuid
 from datetime import datetime, timedelta
-import bcrypt
-import jwt
 
 from models import *
+from media import CACHE_CONTROL, collect_garbage, is_valid_digest, media_store_from_env
+from image_pipeline import shutdown_pool as shutdown_image_pool
+import conversations
+from loaders import Loaders
+import search as listing_search
+from pagination import NEXT_CURSOR_HEADER, SORTS, paginate
+from credentials import CredentialServiceBusy, credential_service_from_env
+from categories import registry as category_registry
+from realtime import hub_from_env
+import ratings
+import unread
+import indexes
+import recommendations
+import geo
+import facets
+from similarity import similarity_index_from_env
+from cache import response_cache_from_env
+from view_counter import view_counter_from_env
+from jobs import JobContext, job_queue_from_env
+from auth import AuthError, authenticator_from_env
+import stats as admin_stats
+from stats import stats_snapshotter_from_env
+import export
+from serialization import FastJSONResponse, from_doc, from_docs, jsonable, projection, respond
 import random
 import string
 
@@ -28,57 +52,64 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-in-production')
-JWT_ALGORITHM = 'HS256'
-
-app = FastAPI()
+media_store = media_store_from_env(db, ROOT_DIR / 'media')
+credential_service = credential_service_from_env()
+hub = hub_from_env(db)
+view_counter = view_counter_from_env(db)
+response_cache = response_cache_from_env(db)
+similarity_index = similarity_index_from_env()
+authenticator = authenticator_from_env(db)
+stats_snapshotter = stats_snapshotter_from_env(db)
+job_queue = job_queue_from_env(db)
+
+app = FastAPI(default_response_class=FastJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    try:
+        return await credential_service.hash(password)
+    except CredentialServiceBusy:
+        raise HTTPException(status_code=503, detail="Server ausgelastet, bitte später erneut versuchen")
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await credential_service.verify(password, hashed)
+    except CredentialServiceBusy:
+        raise HTTPException(status_code=503, detail="Server ausgelastet, bitte später erneut versuchen")
 
-def create_token(user_id: str, email: str, role: str) -> str:
-    payload = {'user_id': user_id, 'email': email, 'role': role, 'exp': datetime.utcnow() + timedelta(days=30)}
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+def create_token(user_id: str, email: str, role: str, version: int = 0) -> str:
+    return authenticator.create_token(user_id, email, role, version)
 
-def decode_token(token: str) -> dict:
+async def authenticate(token: str) -> dict:
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except:
+        return await authenticator.authenticate(token)
+    except AuthError:
         raise HTTPException(status_code=401, detail="Ungültiges Token")
 
 async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
     if not authorization or not authorization.startswith('Bearer '):
         raise HTTPException(status_code=401, detail="Kein Token bereitgestellt")
     token = authorization.split(' ')[1]
-    return decode_token(token)
+    return await authenticate(token)
 
 async def get_current_user_optional(authorization: Optional[str] = Header(None)) -> Optional[dict]:
     """Optional authentication - returns None if not authenticated"""
     if not authorization or not authorization.startswith('Bearer '):
         return None
     try:
-        token = authorization.split(' ')[1]
-        return decode_token(token)
-    except:
+        return await authenticate(authorization.split(' ')[1])
+    except HTTPException:
         return None
 
-async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))):
-    """Get user if authenticated, otherwise return None"""
-    if not credentials:
-        return None
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except:
-        return None
+async def get_user_profile(user_id: str) -> dict:
+    """Cached id, name, email and role of a user (see auth.PROFILE_PROJECTION)"""
+    profile = await authenticator.profile(user_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+    return profile
 
 async def require_super_admin(current_user: dict = Depends(get_current_user)):
     """Require super admin role"""
@@ -92,6 +123,24 @@ async def require_admin(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin Berechtigung erforderlich")
     return current_user
 
+async def fetch_page(response: Response, collection, query: dict, projection: dict, limit: int,
+                     cursor: Optional[str] = None, skip: int = 0, sort: str = "recent") -> list:
+    """Keyset-paginated find; the cursor for the next page goes into the X-Next-Cursor header"""
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail="Ungültige Sortierung")
+    sort_field, direction = SORTS[sort]
+    try:
+        docs, next_cursor = await paginate(collection, query, projection, sort_field, direction, limit, cursor=cursor, skip=skip)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ungültiger Cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return docs
+
+def get_loaders() -> Loaders:
+    """Per-request batch loaders for users and listings"""
+    return Loaders(db)
+
 # ============= AUTH =============
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
@@ -108,12 +157,13 @@ async def register(user_data: UserCreate):
         "id": user_id,
         "name": user_data.name,
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": await hash_password(user_data.password),
         "role": UserRole.USER,
         "rating": 0.0,
         "review_count": 0,
         "profile_image": None,
         "phone_enabled": False,
+        "is_verified": False,
         "created_at": datetime.utcnow()
     }
     
@@ -123,12 +173,18 @@ async def register(user_data: UserCreate):
     return {"user": user_response, "token": token}
 
 @api_router.post("/auth/login")
-async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user['password']):
+async def login(login_data: UserLogin):
+    user = await db.users.find_one({"email": login_data.email})
+    if not user or not await verify_password(login_data.password, user['password']):
         raise HTTPException(status_code=401, detail="E-Mail oder Passwort ist falsch")
     
-    token = create_token(user['id'], user['email'], user['role'])
+    # Transparently upgrade hashes made with an older cost factor
+    if credential_service.needs_rehash(user['password']):
+        new_hash = await hash_password(login_data.password)
+        await db.users.update_one({"id": user['id'], "password": user['password']}, {"$set": {"password": new_hash}})
+        credential_service.rehashed += 1
+    
+    token = create_token(user['id'], user['email'], user['role'], user.get('token_version', 0))
     user_response = User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
     return {"user": user_response, "token": token}
 
@@ -181,11 +237,16 @@ async def reset_password(reset_data: PasswordReset):
         raise HTTPException(status_code=400, detail="Reset-Code ist abgelaufen")
     
     # تحديث كلمة المرور
-    hashed_password = hash_password(reset_data.new_password)
-    await db.users.update_one(
+    hashed_password = await hash_password(reset_data.new_password)
+    # Sessions started with the old password end here
+    user = await db.users.find_one_and_update(
         {"email": reset_data.email},
-        {"$set": {"password": hashed_password}}
+        {"$set": {"password": hashed_password}, "$inc": {"token_version": 1}},
+        {"_id": 0, "id": 1, "token_version": 1}
     )
+    if user:
+        authenticator.invalidate(user['id'])
+        await revoke_sessions(user['id'], user.get('token_version', 0) + 1)
     
     # حذف reset code المستخدم
     await db.password_resets.delete_one({"_id": reset_record['_id']})
@@ -195,11 +256,10 @@ async def reset_password(reset_data: PasswordReset):
 
 @api_router.get("/auth/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await db.users.find_one({"id": current_user['user_id']}, {"_id": 0, "password": 0})
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
-    user_response = User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
-    return user_response
+    return User(**user)
 
 @api_router.put("/auth/profile")
 async def update_profile(profile_image: Optional[str] = None, phone_enabled: Optional[bool] = None, current_user: dict = Depends(get_current_user)):
@@ -210,9 +270,13 @@ async def update_profile(profile_image: Optional[str] = None, phone_enabled: Opt
         update_data['phone_enabled'] = phone_enabled
     if update_data:
         await db.users.update_one({"id": current_user['user_id']}, {"$set": update_data})
+        authenticator.invalidate(current_user['user_id'])
     user = await db.users.find_one({"id": current_user['user_id']})
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+    if update_data:
+        await conversations.update_profile(db, user)
+        await response_cache.invalidate(f"user:{user['id']}")
     return User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
 
 # Profile management endpoints
@@ -228,153 +292,96 @@ async def update_user_profile(profile_data: dict, current_user: dict = Depends(g
     
     if update_data:
         await db.users.update_one({"id": current_user['user_id']}, {"$set": update_data})
+        authenticator.invalidate(current_user['user_id'])
     
     user = await db.users.find_one({"id": current_user['user_id']})
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+    if update_data:
+        await conversations.update_profile(db, user)
+        await response_cache.invalidate(f"user:{user['id']}")
     return User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'})
 
 # ============= CATEGORIES =============
 @api_router.get("/categories")
-async def get_categories():
-    categories = [
-        {
-            "id": "cars",
-            "name": "Autos",
-            "name_de": "Autos",
-            "icon": "car",
-            "fields": [
-                {"name": "brand", "label": "Marke", "type": "select", "options": ["Audi", "BMW", "Mercedes-Benz", "Volkswagen", "Opel", "Ford", "Toyota", "Honda", "Nissan", "Mazda", "Hyundai", "Kia", "Peugeot", "Renault", "Fiat", "Volvo", "Skoda", "Seat", "Porsche", "Tesla", "Andere"]},
-                {"name": "model", "label": "Modell", "type": "select_dynamic", "options": {
-                    "Audi": ["A1", "A3", "A4", "A5", "A6", "A7", "A8", "Q2", "Q3", "Q5", "Q7", "Q8", "TT", "R8", "e-tron"],
-                    "BMW": ["1er", "2er", "3er", "4er", "5er", "6er", "7er", "8er", "X1", "X2", "X3", "X4", "X5", "X6", "X7", "Z4", "i3", "i4", "iX"],
-                    "Mercedes-Benz": ["A-Klasse", "B-Klasse", "C-Klasse", "E-Klasse", "S-Klasse", "GLA", "GLB", "GLC", "GLE", "GLS", "CLA", "CLS", "AMG GT", "EQC", "EQS"],
-                    "Volkswagen": ["Polo", "Golf", "Passat", "Tiguan", "Touareg", "T-Roc", "T-Cross", "Arteon", "ID.3", "ID.4", "ID.5"],
-                    "Opel": ["Corsa", "Astra", "Insignia", "Mokka", "Crossland", "Grandland"],
-                    "Ford": ["Fiesta", "Focus", "Mondeo", "Kuga", "Puma", "Explorer", "Mustang"],
-                    "Toyota": ["Aygo", "Yaris", "Corolla", "Camry", "RAV4", "Highlander", "C-HR", "Prius"],
-                    "Honda": ["Jazz", "Civic", "Accord", "CR-V", "HR-V"],
-                    "Nissan": ["Micra", "Juke", "Qashqai", "X-Trail", "Leaf"],
-                    "Mazda": ["2", "3", "6", "CX-3", "CX-5", "CX-30", "MX-5"],
-                    "Andere": []
-                }},
-                {"name": "year", "label": "Baujahr", "type": "number"},
-                {"name": "mileage", "label": "Kilometerstand", "type": "number"},
-                {"name": "fuel_type", "label": "Kraftstoffart", "type": "select", "options": ["Benzin", "Diesel", "Elektro", "Hybrid", "Plug-in-Hybrid", "Erdgas (CNG)", "Autogas (LPG)"]},
-                {"name": "transmission", "label": "Getriebe", "type": "select", "options": ["Automatik", "Manuell", "Halbautomatik"]},
-                {"name": "power", "label": "Leistung (PS)", "type": "number"},
-                {"name": "doors", "label": "Türen", "type": "select", "options": ["2/3", "4/5", "6/7"]},
-                {"name": "seats", "label": "Sitze", "type": "number"},
-                {"name": "color", "label": "Farbe", "type": "select", "options": ["Schwarz", "Weiß", "Silber", "Grau", "Blau", "Rot", "Grün", "Gelb", "Braun", "Beige", "Orange", "Andere"]},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Neuwertig", "Gebraucht", "Beschädigt"]}
-            ]
-        },
-        {
-            "id": "electronics",
-            "name": "Elektronik",
-            "name_de": "Elektronik",
-            "icon": "laptop",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Smartphones", "Tablets", "Laptops", "Desktop-PCs", "Monitore", "Drucker", "Kameras", "TV & Audio", "Smart Home", "Zubehör", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "select", "options": ["Apple", "Samsung", "Huawei", "Xiaomi", "Sony", "LG", "Lenovo", "HP", "Dell", "Asus", "Acer", "Microsoft", "Canon", "Nikon", "Bose", "JBL", "Philips", "Andere"]},
-                {"name": "model", "label": "Modell", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Sehr gut", "Gut", "Akzeptabel", "Defekt"]},
-                {"name": "warranty", "label": "Garantie", "type": "select", "options": ["Mit Garantie", "Ohne Garantie"]},
-                {"name": "storage", "label": "Speicher", "type": "text"},
-                {"name": "color", "label": "Farbe", "type": "text"}
-            ]
-        },
-        {
-            "id": "real_estate",
-            "name": "Immobilien",
-            "name_de": "Immobilien",
-            "icon": "home",
-            "fields": [
-                {"name": "property_type", "label": "Immobilientyp", "type": "select", "options": ["Wohnung", "Haus", "Villa", "Grundstück", "Gewerbeimmobilie", "Büro", "Garage/Stellplatz", "Andere"]},
-                {"name": "listing_type", "label": "Angebotstyp", "type": "select", "options": ["Zu verkaufen", "Zu vermieten", "Zwischenmiete"]},
-                {"name": "area", "label": "Wohnfläche (m²)", "type": "number"},
-                {"name": "plot_area", "label": "Grundstücksfläche (m²)", "type": "number"},
-                {"name": "bedrooms", "label": "Schlafzimmer", "type": "number"},
-                {"name": "bathrooms", "label": "Badezimmer", "type": "number"},
-                {"name": "floor", "label": "Etage", "type": "text"},
-                {"name": "year_built", "label": "Baujahr", "type": "number"},
-                {"name": "heating", "label": "Heizung", "type": "select", "options": ["Zentralheizung", "Gasheizung", "Ölheizung", "Fernwärme", "Wärmepumpe", "Elektrisch", "Keine"]},
-                {"name": "parking", "label": "Parkplatz", "type": "select", "options": ["Garage", "Stellplatz", "Tiefgarage", "Keine"]},
-                {"name": "balcony", "label": "Balkon/Terrasse", "type": "select", "options": ["Ja", "Nein"]},
-                {"name": "elevator", "label": "Aufzug", "type": "select", "options": ["Ja", "Nein"]},
-                {"name": "location", "label": "Standort", "type": "text"}
-            ]
-        },
-        {
-            "id": "furniture",
-            "name": "Möbel",
-            "name_de": "Möbel",
-            "icon": "bed",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Wohnzimmer", "Schlafzimmer", "Küche", "Badezimmer", "Büro", "Kinderzimmer", "Garten", "Andere"]},
-                {"name": "type", "label": "Möbeltyp", "type": "select", "options": ["Sofa", "Sessel", "Tisch", "Stuhl", "Bett", "Schrank", "Regal", "Kommode", "Andere"]},
-                {"name": "material", "label": "Material", "type": "select", "options": ["Holz", "Metall", "Kunststoff", "Glas", "Stoff", "Leder", "Andere"]},
-                {"name": "color", "label": "Farbe", "type": "text"},
-                {"name": "dimensions", "label": "Maße (L×B×H in cm)", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "fashion",
-            "name": "Mode",
-            "name_de": "Mode",
-            "icon": "shirt",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Oberbekleidung", "Hosen", "Kleider & Röcke", "Schuhe", "Accessoires", "Taschen", "Uhren", "Schmuck", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "size", "label": "Größe", "type": "select", "options": ["XXS", "XS", "S", "M", "L", "XL", "XXL", "XXXL", "Andere"]},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu mit Etikett", "Neu ohne Etikett", "Wie neu", "Sehr gut", "Gut"]},
-                {"name": "gender", "label": "Geschlecht", "type": "select", "options": ["Herren", "Damen", "Unisex", "Kinder"]},
-                {"name": "color", "label": "Farbe", "type": "text"},
-                {"name": "material", "label": "Material", "type": "text"}
-            ]
-        },
-        {
-            "id": "sports",
-            "name": "Sport & Freizeit",
-            "name_de": "Sport & Freizeit",
-            "icon": "football",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Fitnessgeräte", "Fahrräder", "Camping & Outdoor", "Wintersport", "Wassersport", "Ballsport", "Sportbekleidung", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "type", "label": "Typ", "type": "text"},
-                {"name": "size", "label": "Größe", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "garden",
-            "name": "Garten & Heimwerk",
-            "name_de": "Garten & Heimwerk",
-            "icon": "hammer",
-            "fields": [
-                {"name": "category", "label": "Kategorie", "type": "select", "options": ["Gartengeräte", "Pflanzen", "Gartenmöbel", "Werkzeuge", "Baumaterial", "Andere"]},
-                {"name": "brand", "label": "Marke", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Wie neu", "Gut", "Gebraucht"]}
-            ]
-        },
-        {
-            "id": "other",
-            "name": "Sonstiges",
-            "name_de": "Sonstiges",
-            "icon": "apps",
-            "fields": [
-                {"name": "type", "label": "Typ", "type": "text"},
-                {"name": "condition", "label": "Zustand", "type": "select", "options": ["Neu", "Gebraucht"]}
-            ]
-        }
-    ]
-    return categories
+async def get_categories(if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
+    """Category schema, pre-encoded once; revalidates with If-None-Match"""
+    use_gzip = 'gzip' in (accept_encoding or '')
+    etag = category_registry.etag_gzip if use_gzip else category_registry.etag
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    if if_none_match and (if_none_match.strip() == '*' or etag in if_none_match):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=category_registry.body_gzip, media_type="application/json", headers=headers)
+    return Response(content=category_registry.body, media_type="application/json", headers=headers)
+
+def validate_category_fields(listing_data: ListingCreate) -> dict:
+    """The listing's ``category_fields`` normalized for storage; 400 if invalid"""
+    errors = category_registry.validate(listing_data.category, listing_data.category_fields)
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(errors))
+    return category_registry.normalize(listing_data.category, listing_data.category_fields)
+
+# ============= MEDIA =============
+async def store_listing_media(listing_data: ListingCreate) -> dict:
+    """Move uploaded base64 media into the media store and return the references"""
+    try:
+        media = await media_store.store_images(listing_data.images)
+        media['videos'] = await media_store.store_all(listing_data.videos)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ungültige Mediendatei")
+    return media
+
+def listing_thumbnail(listing: Optional[dict]) -> Optional[str]:
+    if not listing:
+        return None
+    images = listing.get('thumbnails') or listing.get('images')
+    return images[0] if images else None
+
+def as_card(listing: dict) -> dict:
+    """List views show the small rendition instead of the full-size image"""
+    if listing.get('thumbnails'):
+        listing['images'] = listing['thumbnails']
+    return listing
+
+# Exactly the response fields, so documents go into the models without a copy
+USER_PROJECTION = projection(User)
+MESSAGE_PROJECTION = projection(Message)
+REVIEW_PROJECTION = projection(Review)
+TICKET_PROJECTION = projection(SupportTicket)
+
+def to_summary(listing: dict) -> ListingSummary:
+    return from_doc(ListingSummary, as_card(listing))
+
+@api_router.get("/media/{media_id}")
+async def get_media(media_id: str, if_none_match: Optional[str] = Header(None)):
+    if not is_valid_digest(media_id):
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    etag = f'"{media_id}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    # Content-addressed: same id always means same bytes
+    if if_none_match and etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+    info = await media_store.info(media_id)
+    if not info:
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    path = media_store.local_path(media_id)
+    if path is not None:
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+        return FileResponse(path, media_type=info['content_type'], headers=headers)
+    data = await media_store.get(media_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Datei nicht gefunden")
+    return Response(content=data, media_type=info['content_type'], headers=headers)
 
 # ============= LISTINGS =============
 @api_router.post("/listings", response_model=Listing)
 async def create_listing(listing_data: ListingCreate, current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    category_fields = validate_category_fields(listing_data)
+    user = await get_user_profile(current_user['user_id'])
+    media = await store_listing_media(listing_data)
     listing_id = generate_short_id()
     listing_dict = {
         "id": listing_id,
@@ -384,63 +391,154 @@ async def create_listing(listing_data: ListingCreate, current_user: dict = Depen
         "description": listing_data.description,
         "price": listing_data.price,
         "category": listing_data.category,
-        "images": listing_data.images,
-        "videos": listing_data.videos,
-        "category_fields": listing_data.category_fields,
+        "images": media['images'],
+        "thumbnails": media['thumbnails'],
+        "medium_images": media['medium_images'],
+        "videos": media['videos'],
+        "category_fields": category_fields,
         "negotiable": listing_data.negotiable,
         "location": listing_data.location,
-        "latitude": None,
-        "longitude": None,
+        **geo.geo_fields(listing_data.location),
         "views": 0,
-        "created_at": datetime.utcnow()
+        "is_pinned": False,
+        "created_at": datetime.utcnow(),
+        **listing_search.search_fields(listing_data.title, listing_data.description, category_fields)
     }
     await db.listings.insert_one(listing_dict)
+    similarity_index.upsert(listing_dict)
+    await response_cache.invalidate("listings", f"category:{listing_dict['category']}")
     return Listing(**{k: v for k, v in listing_dict.items() if k != '_id'})
 
-@api_router.get("/listings/featured-videos", response_model=List[Listing])
+@api_router.get("/listings/featured-videos", response_model=List[ListingSummary])
 async def get_featured_videos():
     """Get featured video listings (up to 5 most recent with videos)"""
-    cursor = db.listings.find({"videos": {"$exists": True, "$ne": []}}).sort("created_at", -1).limit(5)
-    listings = []
-    async for listing in cursor:
-        listing_data = {k: v for k, v in listing.items() if k != '_id'}
-        listings.append(Listing(**listing_data))
-    return listings
-
-@api_router.get("/listings/all-videos", response_model=List[Listing])
-async def get_all_videos(skip: int = 0, limit: int = 20):
+    async def load():
+        cursor = db.listings.find(listing_search.HAS_VIDEOS, LISTING_SUMMARY_PROJECTION).sort("created_at", -1).limit(5)
+        return [jsonable(to_summary(listing)) async for listing in cursor]
+    return respond(await response_cache.get_or_load("listings:featured-videos", None, load, tags=["listings"]))
+
+@api_router.get("/listings/all-videos", response_model=List[ListingSummary])
+async def get_all_videos(response: Response, skip: int = 0, limit: int = 20, cursor: Optional[str] = None):
     """Get all listings with videos (paginated)"""
-    cursor = db.listings.find({"videos": {"$exists": True, "$ne": []}}).sort("created_at", -1).skip(skip).limit(limit)
-    listings = []
-    async for listing in cursor:
-        listing_data = {k: v for k, v in listing.items() if k != '_id'}
-        listings.append(Listing(**listing_data))
-    return listings
-
-@api_router.get("/listings", response_model=List[Listing])
-async def get_listings(category: Optional[str] = None, search: Optional[str] = None, skip: int = 0, limit: int = 20):
-    query = {}
+    listings = await fetch_page(response, db.listings, listing_search.HAS_VIDEOS, LISTING_SUMMARY_PROJECTION,
+                                min(limit, 100), cursor=cursor, skip=skip)
+    return respond([to_summary(listing) for listing in listings], response)
+
+def place_filter(near: Optional[str], lat: Optional[float], lon: Optional[float], radius_km: Optional[float],
+                 bbox: Optional[str], distance_sort: bool = False, located_only: bool = False) -> tuple:
+    """``(center, filter)`` for a place/coordinates with radius and a map viewport.
+    A radius search also returns listings without coordinates unless ``located_only``;
+    a map viewport or distance sort needs coordinates."""
+    center = None
+    if near:
+        center = geo.geocode(near)
+        if center is None:
+            raise HTTPException(status_code=400, detail="Ort nicht gefunden")
+    elif lat is not None and lon is not None:
+        if not geo.valid_point(lat, lon):
+            raise HTTPException(status_code=400, detail="Ungültige Koordinaten")
+        center = (lat, lon)
+    if (radius_km is not None or distance_sort) and center is None:
+        raise HTTPException(status_code=400, detail="Für die Umkreissuche wird ein Ort benötigt")
+    if radius_km is not None and radius_km <= 0:
+        raise HTTPException(status_code=400, detail="Ungültiger Umkreis")
+    if radius_km is not None:
+        radius_km = min(radius_km, geo.MAX_RADIUS_KM)
+    filters = []
+    if bbox:
+        try:
+            filters.append(geo.bbox_filter(bbox))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Ungültiger Kartenausschnitt")
+    if distance_sort:
+        # $nearSphere returns nearest first and has no keyset, so distance sorting pages with skip
+        filters.append(geo.near_filter(center, radius_km))
+    elif radius_km is not None:
+        filters.append(geo.radius_filter(center, radius_km, include_unlocated=not (located_only or bbox)))
+    if len(filters) > 1:
+        return center, {"$and": filters}
+    return center, filters[0] if filters else {}
+
+@api_router.get("/listings", response_model=List[ListingSummary])
+async def get_listings(request: Request, response: Response, category: Optional[str] = None, search: Optional[str] = None,
+                       skip: int = 0, limit: int = 20, cursor: Optional[str] = None, sort: str = "recent",
+                       near: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+                       radius_km: Optional[float] = None, bbox: Optional[str] = None, located_only: bool = False,
+                       min_price: Optional[float] = None, max_price: Optional[float] = None):
+    """Browse listings; ``cf.<field>=<value>`` query params filter on category_fields,
+    ``cf.<field>.min``/``cf.<field>.max`` on numeric ones.
+    Pass the X-Next-Cursor response header back as ``cursor`` for the next page.
+    ``near`` (city or postcode) or ``lat``/``lon`` with ``radius_km`` limit results to a circle
+    (plus listings with an unknown place, without ``distance_km``, unless ``located_only=true``),
+    ``bbox=minLon,minLat,maxLon,maxLat`` to the map viewport; ``sort=distance`` pages with ``skip``."""
+    query = listing_search.build_query(request.query_params, category, search, min_price, max_price)
+    limit = min(limit, 100)
+    text = query.get('$text')
+    if text and sort == "distance":
+        raise HTTPException(status_code=400, detail="Suchergebnisse können nicht nach Entfernung sortiert werden")
+    center, geo_query = place_filter(near, lat, lon, radius_km, bbox, distance_sort=sort == "distance",
+                                     located_only=located_only)
+    query.update(geo_query)
+    projection = {**LISTING_SUMMARY_PROJECTION, "latitude": 1, "longitude": 1} if center else LISTING_SUMMARY_PROJECTION
+
+    if text:
+        # Relevance-ranked results have no stable key, so search keeps skip/limit paging
+        projection = {**projection, "score": {"$meta": "textScore"}}
+        listings = await db.listings.find(query, projection).sort(listing_search.TEXT_SORT).skip(skip).limit(limit).to_list(limit)
+    elif sort == "distance":
+        listings = await db.listings.find(query, projection).skip(skip).limit(limit).to_list(limit)
+    else:
+        listings = await fetch_page(response, db.listings, query, projection, limit, cursor=cursor, skip=skip, sort=sort)
+    summaries = [to_summary(listing) for listing in listings]
+    if center:
+        for summary, listing in zip(summaries, listings):
+            summary.distance_km = geo.distance_km(listing, center)
+    return respond(summaries, response)
+
+@api_router.get("/listings/facets")
+async def get_listing_facets(request: Request, category: Optional[str] = None, search: Optional[str] = None,
+                             near: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+                             radius_km: Optional[float] = None, bbox: Optional[str] = None, located_only: bool = False,
+                             min_price: Optional[float] = None, max_price: Optional[float] = None):
+    """Counts per value of the category's select fields and a price histogram under the
+    same filters as ``GET /listings``"""
+    filters = listing_search.field_filters(request.query_params, min_price, max_price)
+    _, base = place_filter(near, lat, lon, radius_km, bbox, located_only=located_only)
+    base.update(listing_search.build_query({}, category, search))
+    params = {key: ','.join(sorted(request.query_params.getlist(key))) for key in request.query_params.keys()}
+
+    async def load():
+        return await facets.facet_counts(db.listings, base, filters, category)
+    return await response_cache.get_or_load("listings:facets", params, load,
+                                            tags=[f"category:{category}"] if category else ["listings"])
+
+@api_router.get("/listings/autocomplete")
+async def autocomplete_listings(q: str, category: Optional[str] = None, limit: int = 10):
+    """Title suggestions for a partially typed search"""
+    query = listing_search.autocomplete_query(q)
+    if not query:
+        return []
     if category:
         query['category'] = category
-    if search:
-        query['$or'] = [
-            {'title': {'$regex': search, '$options': 'i'}},
-            {'description': {'$regex': search, '$options': 'i'}}
-        ]
-    listings = await db.listings.find(query).sort('created_at', -1).skip(skip).limit(limit).to_list(limit)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
-
-@api_router.get("/listings/my")
-async def get_my_listings(current_user: dict = Depends(get_current_user)):
-    listings = await db.listings.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+    limit = min(limit, 20)
+    suggestions = await db.listings.find(query, {"_id": 0, "id": 1, "title": 1, "category": 1}).sort("views", -1).limit(limit).to_list(limit)
+    return suggestions
+
+@api_router.get("/listings/my", response_model=List[ListingSummary])
+async def get_my_listings(response: Response, limit: int = 100, cursor: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    listings = await fetch_page(response, db.listings, {"seller_id": current_user['user_id']}, LISTING_SUMMARY_PROJECTION,
+                                min(limit, 100), cursor=cursor)
+    return respond([to_summary(listing) for listing in listings], response)
 
 @api_router.get("/listings/{listing_id}", response_model=Listing)
-async def get_listing(listing_id: str):
-    listing = await db.listings.find_one({"id": listing_id})
+async def get_listing(listing_id: str, request: Request, current_user: Optional[dict] = Depends(get_current_user_optional)):
+    listing = await db.listings.find_one({"id": listing_id}, LISTING_PROJECTION)
     if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
-    await db.listings.update_one({"id": listing_id}, {"$inc": {"views": 1}})
+    viewer = current_user['user_id'] if current_user else (request.client.host if request.client else None)
+    view_counter.record(listing_id, viewer, user_id=current_user['user_id'] if current_user else None)
+    # Include views still buffered in this worker
+    listing['views'] = listing.get('views', 0) + view_counter.pending(listing_id)
     
     # Get seller rating info
     seller = await db.users.find_one({"id": listing['seller_id']})
@@ -448,7 +546,7 @@ async def get_listing(listing_id: str):
         listing['seller_rating'] = seller.get('rating', 0.0)
         listing['seller_review_count'] = seller.get('review_count', 0)
     
-    return Listing(**{k: v for k, v in listing.items() if k != '_id'})
+    return respond(from_doc(Listing, listing))
 
 @api_router.put("/listings/{listing_id}", response_model=Listing)
 async def update_listing(listing_id: str, listing_data: ListingCreate, current_user: dict = Depends(get_current_user)):
@@ -458,37 +556,199 @@ async def update_listing(listing_id: str, listing_data: ListingCreate, current_u
     if listing['seller_id'] != current_user['user_id'] and current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
     
+    category_fields = validate_category_fields(listing_data)
+    media = await store_listing_media(listing_data)
     update_dict = {
         "title": listing_data.title,
         "description": listing_data.description,
         "price": listing_data.price,
         "category": listing_data.category,
-        "images": listing_data.images,
-        "videos": listing_data.videos,
-        "category_fields": listing_data.category_fields,
+        "images": media['images'],
+        "thumbnails": media['thumbnails'],
+        "medium_images": media['medium_images'],
+        "videos": media['videos'],
+        "category_fields": category_fields,
         "negotiable": listing_data.negotiable,
         "location": listing_data.location,
+        **geo.geo_fields(listing_data.location),
+        **listing_search.search_fields(listing_data.title, listing_data.description, category_fields)
     }
     
     await db.listings.update_one({"id": listing_id}, {"$set": update_dict})
     updated_listing = await db.listings.find_one({"id": listing_id})
+    similarity_index.upsert(updated_listing)
+    if update_dict['title'] != listing['title'] or update_dict['thumbnails'][:1] != (listing.get('thumbnails') or [])[:1]:
+        await conversations.update_listing(db, updated_listing)
+    await response_cache.invalidate("listings", f"listing:{listing_id}", f"category:{listing['category']}", f"category:{update_dict['category']}")
     return Listing(**{k: v for k, v in updated_listing.items() if k != '_id'})
 
 @api_router.delete("/listings/{listing_id}")
 async def delete_listing(listing_id: str, current_user: dict = Depends(get_current_user)):
-    listing = await db.listings.find_one({"id": listing_id})
+    listing = await db.listings.find_one({"id": listing_id}, {"_id": 0, "seller_id": 1, "category": 1, "is_pinned": 1})
     if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
     if listing['seller_id'] != current_user['user_id'] and current_user['role'] != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Nicht autorisiert")
     await db.listings.delete_one({"id": listing_id})
-    return {"message": "Anzeige gelöscht"}
+    job = await remove_listing(listing_id, listing)
+    return {"message": "Anzeige gelöscht", "job_id": job['id']}
+
+# ============= CLEANUP JOBS =============
+MEDIA_GC_DELAY_SECONDS = float(os.getenv('MEDIA_GC_DELAY_SECONDS', '600'))
+
+async def remove_listing(listing_id: str, listing: dict) -> dict:
+    """After the listing document is gone: drop it from caches and stats and queue the cleanup of what refers to it"""
+    similarity_index.remove(listing_id)
+    if listing.get('is_pinned'):
+        await admin_stats.increment(db, "pinned_listings", -1)
+    await response_cache.invalidate("listings", f"listing:{listing_id}", f"category:{listing['category']}")
+    return await job_queue.enqueue("delete_listing", {"listing_id": listing_id})
+
+async def delete_listing_children(ctx: JobContext, listing_query: dict):
+    """Messages, conversations, offers and favorites of the listings matching ``listing_query``"""
+    async def discard_unread(batch: dict):
+        await unread.discard_messages(db, batch)
+    await ctx.delete_batched(db.messages, listing_query, before=discard_unread)
+    await ctx.delete_batched(db.conversations, listing_query)
+    await ctx.delete_batched(db.offers, listing_query)
+    await ctx.delete_batched(db.favorites, listing_query)
+
+@job_queue.handler("delete_listing")
+async def delete_listing_job(ctx: JobContext):
+    await delete_listing_children(ctx, {"listing_id": ctx.params['listing_id']})
+    await job_queue.enqueue("media_gc", unique=True, delay=MEDIA_GC_DELAY_SECONDS)
+    return ctx.progress_doc['deleted']
+
+@job_queue.handler("delete_user")
+async def delete_user_job(ctx: JobContext):
+    user_id = ctx.params['user_id']
+    if not ctx.step_done("listings"):
+        while True:
+            listings = await db.listings.find({"seller_id": user_id}, {"_id": 0, "id": 1, "category": 1, "is_pinned": 1}).limit(job_queue.batch_size).to_list(None)
+            if not listings:
+                break
+            ids = [listing['id'] for listing in listings]
+            # Children first: a retry after a crash still finds the listings they belong to
+            await delete_listing_children(ctx, {"listing_id": {"$in": ids}})
+            await ctx.delete_batched(db.listings, {"id": {"$in": ids}})
+            for listing_id in ids:
+                similarity_index.remove(listing_id)
+            await admin_stats.increment(db, "pinned_listings", -sum(1 for listing in listings if listing.get('is_pinned')))
+            await response_cache.invalidate("listings", *{f"category:{listing['category']}" for listing in listings})
+        await ctx.finish_step("listings")
+
+    if not ctx.step_done("messages"):
+        async def discard_unread(batch: dict):
+            # Messages this user sent are still counted as unread by their recipients
+            await unread.discard_messages(db, {"$and": [batch, {"to_user_id": {"$ne": user_id}}]})
+        await ctx.delete_batched(db.messages, {"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}, before=discard_unread)
+        await ctx.finish_step("messages")
+
+    if not ctx.step_done("reviews"):
+        async def reverse_ratings(batch: dict):
+            # Reviews this user wrote about others: take them out of those sellers' ratings
+            written = await db.reviews.find(batch, {"_id": 0, "reviewed_user_id": 1, "rating": 1}).to_list(None)
+            await ratings.remove_reviews(db, written)
+            await response_cache.invalidate(*{f"user:{review['reviewed_user_id']}" for review in written})
+        await ctx.delete_batched(db.reviews, {"reviewer_id": user_id, "reviewed_user_id": {"$ne": user_id}}, before=reverse_ratings)
+        await ctx.delete_batched(db.reviews, {"reviewed_user_id": user_id})
+        await ctx.finish_step("reviews")
+
+    await ctx.delete_batched(db.conversations, {"participants": user_id})
+    await ctx.delete_batched(db.offers, {"$or": [{"buyer_id": user_id}, {"seller_id": user_id}]})
+    await ctx.delete_batched(db.favorites, {"user_id": user_id})
+    await ctx.delete_batched(db.user_views, {"user_id": user_id})
+    await db.recommendations.delete_one({"user_id": user_id})
+    await job_queue.enqueue("media_gc", unique=True, delay=MEDIA_GC_DELAY_SECONDS)
+    return ctx.progress_doc['deleted']
+
+@job_queue.handler("media_gc")
+async def media_gc_job(ctx: JobContext):
+    async def progress(stats: dict):
+        ctx.progress_doc['media'] = dict(stats)
+        await ctx.save()
+    return await collect_garbage(db, media_store, batch_size=job_queue.batch_size, progress=progress)
+
+# ============= REALTIME =============
+def message_event(message: dict) -> dict:
+    # Attachments stay out of the event; clients fetch them with the conversation
+    payload = {k: v for k, v in message.items() if k not in ('_id', 'images', 'audio')}
+    payload['has_attachments'] = bool(message.get('images') or message.get('audio'))
+    return {"type": "message", "message": jsonable_encoder(payload)}
+
+async def publish_message(message: dict):
+    event = message_event(message)
+    await hub.publish(message['to_user_id'], event)
+    if message['from_user_id'] != message['to_user_id']:
+        await hub.publish(message['from_user_id'], event)
+
+async def publish_unread(user_id: str, count: int):
+    await hub.publish(user_id, {"type": "unread", "count": count})
+
+async def revoke_sessions(user_id: str, token_version: Optional[int]):
+    """Close the user's sockets opened with older tokens, on every worker"""
+    if token_version is not None:
+        await hub.publish(user_id, {"type": "revoked", "token_version": token_version})
+
+async def deliver_message(message: dict):
+    """Update the conversation and the recipient's unread counter, then push the message"""
+    await conversations.record_message(db, message)
+    await publish_message(message)
+    if message['from_user_id'] != message['to_user_id']:
+        await publish_unread(message['to_user_id'], await unread.increment(db, message['to_user_id']))
+
+@api_router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None):
+    """Push channel; authenticate with ?token=<JWT> or an Authorization header"""
+    authorization = websocket.headers.get('authorization')
+    if not token and authorization and authorization.startswith('Bearer '):
+        token = authorization.split(' ')[1]
+    try:
+        claims = await authenticate(token or '')
+    except HTTPException:
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+    user_id = claims['user_id']
+    queue = hub.subscribe(user_id)
+
+    closing = []
+
+    async def push():
+        while True:
+            event = await queue.get()
+            if event.get('type') == 'revoked':
+                if claims.get('ver', 0) < event['token_version']:
+                    await websocket.close(code=4401)
+                    return
+                continue
+            await websocket.send_json(event)
+
+    def push_done(task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error(f"WebSocket push to {user_id} failed", exc_info=task.exception())
+        closing.append(asyncio.create_task(websocket.close(code=1011)))
+
+    sender = asyncio.create_task(push())
+    sender.add_done_callback(push_done)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            if text == 'ping':
+                await websocket.send_text('pong')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(user_id, queue)
+        await asyncio.gather(*closing, return_exceptions=True)
 
 # ============= MESSAGES =============
 @api_router.post("/messages/mark-read/{listing_id}/{other_user_id}")
 async def mark_messages_read(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
     """Mark all messages from other_user_id as read"""
-    await db.messages.update_many(
+    result = await db.messages.update_many(
         {
             "listing_id": listing_id,
             "from_user_id": other_user_id,
@@ -497,6 +757,10 @@ async def mark_messages_read(listing_id: str, other_user_id: str, current_user:
         },
         {"$set": {"read": True}}
     )
+    if result.modified_count and other_user_id != current_user['user_id']:
+        await conversations.mark_read(db, current_user['user_id'], other_user_id, listing_id, result.modified_count)
+        count = await unread.decrement(db, current_user['user_id'], result.modified_count)
+        await publish_unread(current_user['user_id'], count)
     return {"message": "Messages marked as read"}
 
 @api_router.post("/messages")
@@ -515,72 +779,43 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
         "created_at": datetime.utcnow()
     }
     await db.messages.insert_one(message_dict)
+    await deliver_message(message_dict)
     return Message(**{k: v for k, v in message_dict.items() if k != '_id'})
 
 @api_router.get("/messages/conversations")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
+async def get_conversations(skip: int = 0, limit: int = 50, current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
-    messages = await db.messages.find({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]}).sort('created_at', -1).to_list(1000)
-    conversations = {}
-    for msg in messages:
-        other_user_id = msg['to_user_id'] if msg['from_user_id'] == user_id else msg['from_user_id']
-        conv_key = f"{other_user_id}_{msg['listing_id']}"
-        if conv_key not in conversations:
-            other_user = await db.users.find_one({"id": other_user_id})
-            listing = await db.listings.find_one({"id": msg['listing_id']})
-            
-            # Count unread messages from this user
-            unread_count = await db.messages.count_documents({
-                "listing_id": msg['listing_id'],
-                "from_user_id": other_user_id,
-                "to_user_id": user_id,
-                "read": False
-            })
-            
-            conversations[conv_key] = {
-                "other_user_id": other_user_id,
-                "other_user_name": other_user['name'] if other_user else "Gelöschter Benutzer",
-                "other_user_image": other_user.get('profile_image') if other_user else None,
-                "listing_id": msg['listing_id'],
-                "listing_title": listing['title'] if listing else "Gelöschte Anzeige",
-                "listing_image": listing['images'][0] if listing and listing.get('images') else None,
-                "last_message": msg['content'][:50],
-                "last_message_time": msg['created_at'],
-                "unread_count": unread_count
-            }
-    return list(conversations.values())
+    rows = await conversations.list_conversations(db, user_id, skip=skip, limit=min(limit, 100))
+    result = []
+    for conv in rows:
+        other_user_id = next((uid for uid in conv['participants'] if uid != user_id), user_id)
+        other_user = conv.get('profiles', {}).get(other_user_id)
+        listing_deleted = conv.get('listing_deleted') or not conv.get('listing_title')
+        result.append({
+            "other_user_id": other_user_id,
+            "other_user_name": other_user['name'] if other_user else "Gelöschter Benutzer",
+            "other_user_image": other_user.get('image') if other_user else None,
+            "listing_id": conv['listing_id'],
+            "listing_title": "Gelöschte Anzeige" if listing_deleted else conv['listing_title'],
+            "listing_image": None if listing_deleted else conv.get('listing_image'),
+            "last_message": conv['last_message'],
+            "last_message_time": conv['last_message_time'],
+            "unread_count": conv.get('unread', {}).get(user_id, 0)
+        })
+    return result
+
 @api_router.get("/messages/unread-count")
 async def get_unread_count(current_user: dict = Depends(get_current_user)):
     """Get count of unread messages"""
-    count = await db.messages.count_documents({
-        "to_user_id": current_user['user_id'],
-        "read": False
-    })
-    return {"count": count}
-
-@api_router.post("/messages/mark-read/{listing_id}/{other_user_id}")
-async def mark_messages_read(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
-    """Mark messages as read when user opens a conversation"""
-    user_id = current_user['user_id']
-    await db.messages.update_many({
-        "listing_id": listing_id,
-        "from_user_id": other_user_id,
-        "to_user_id": user_id,
-        "read": False
-    }, {"$set": {"read": True}})
-    return {"message": "Messages marked as read"}
+    return {"count": await unread.get(db, current_user['user_id'])}
 
 @api_router.get("/messages/{listing_id}/{other_user_id}")
 async def get_conversation_messages(listing_id: str, other_user_id: str, current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
-    messages = await db.messages.find({
-        "listing_id": listing_id,
-        "$or": [
-            {"from_user_id": user_id, "to_user_id": other_user_id},
-            {"from_user_id": other_user_id, "to_user_id": user_id}
-        ]
-    }).sort('created_at', 1).to_list(100)  # Limit to last 100 messages for speed
-    return [Message(**{k: v for k, v in msg.items() if k != '_id'}) for msg in messages]
+    messages = await db.messages.find(
+        conversations.messages_query(user_id, other_user_id, listing_id), MESSAGE_PROJECTION
+    ).sort('created_at', 1).to_list(100)  # Limit to last 100 messages for speed
+    return respond(from_docs(Message, messages))
 
 # ============= OFFERS =============
 @api_router.post("/offers")
@@ -597,7 +832,7 @@ async def create_offer(offer_data: OfferCreate, current_user: dict = Depends(get
         "created_at": datetime.utcnow()
     }
     await db.offers.insert_one(offer_dict)
-    buyer = await db.users.find_one({"id": current_user['user_id']})
+    buyer = await get_user_profile(current_user['user_id'])
     auto_message = f"Neues Angebot von {buyer['name']}: €{offer_data.offered_price} - {offer_data.message or ''}"
     message_id = str(uuid.uuid4())
     message_dict = {
@@ -611,45 +846,41 @@ async def create_offer(offer_data: OfferCreate, current_user: dict = Depends(get
         "created_at": datetime.utcnow()
     }
     await db.messages.insert_one(message_dict)
-    return Offer(**{k: v for k, v in offer_dict.items() if k != '_id'})
+    offer = Offer(**{k: v for k, v in offer_dict.items() if k != '_id'})
+    await hub.publish(offer_data.seller_id, {"type": "offer", "offer": jsonable_encoder(offer)})
+    await deliver_message(message_dict)
+    return offer
+
+async def enrich_offers(offers: List[dict], party: str, loaders: Loaders) -> List[dict]:
+    """Add the other party's name and the listing's title, image and price; two batched queries for any number of offers"""
+    users = await loaders.users.load_many(offer[f'{party}_id'] for offer in offers)
+    listings = await loaders.listings.load_many(offer['listing_id'] for offer in offers)
+    for offer in offers:
+        user = users[offer[f'{party}_id']]
+        listing = listings[offer['listing_id']]
+        offer.update({
+            f"{party}_name": user['name'] if user else "Gelöschter Benutzer",
+            "listing_title": listing['title'] if listing else "Gelöschte Anzeige",
+            "listing_image": listing_thumbnail(listing),
+            "original_price": listing['price'] if listing else 0,
+        })
+    return offers
 
 @api_router.get("/offers/received")
-async def get_received_offers(current_user: dict = Depends(get_current_user)):
-    offers = await db.offers.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    result = []
-    for offer in offers:
-        buyer = await db.users.find_one({"id": offer['buyer_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
-        result.append({**{k: v for k, v in offer.items() if k != '_id'}, "buyer_name": buyer['name'] if buyer else "Gelöschter Benutzer", "listing_title": listing['title'] if listing else "Gelöschte Anzeige"})
-    return result
+async def get_received_offers(current_user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    offers = await db.offers.find({"seller_id": current_user['user_id']}, {"_id": 0}).sort('created_at', -1).to_list(100)
+    return await enrich_offers(offers, 'buyer', loaders)
 
 @api_router.get("/offers/my")
-async def get_my_offers(current_user: dict = Depends(get_current_user)):
+async def get_my_offers(current_user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
     """Get all offers received by the current user (as seller)"""
-    offers = await db.offers.find({"seller_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    result = []
-    for offer in offers:
-        buyer = await db.users.find_one({"id": offer['buyer_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
-        listing_image = listing['images'][0] if listing and listing.get('images') else None
-        result.append({
-            **{k: v for k, v in offer.items() if k != '_id'}, 
-            "buyer_name": buyer['name'] if buyer else "Gelöschter Benutzer", 
-            "listing_title": listing['title'] if listing else "Gelöschte Anzeige",
-            "listing_image": listing_image,
-            "original_price": listing['price'] if listing else 0
-        })
-    return result
+    offers = await db.offers.find({"seller_id": current_user['user_id']}, {"_id": 0}).sort('created_at', -1).to_list(100)
+    return await enrich_offers(offers, 'buyer', loaders)
 
 @api_router.get("/offers/sent")
-async def get_sent_offers(current_user: dict = Depends(get_current_user)):
-    offers = await db.offers.find({"buyer_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    result = []
-    for offer in offers:
-        seller = await db.users.find_one({"id": offer['seller_id']})
-        listing = await db.listings.find_one({"id": offer['listing_id']})
-        result.append({**{k: v for k, v in offer.items() if k != '_id'}, "seller_name": seller['name'] if seller else "Gelöschter Benutzer", "listing_title": listing['title'] if listing else "Gelöschte Anzeige"})
-    return result
+async def get_sent_offers(current_user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    offers = await db.offers.find({"buyer_id": current_user['user_id']}, {"_id": 0}).sort('created_at', -1).to_list(100)
+    return await enrich_offers(offers, 'seller', loaders)
 
 @api_router.post("/offers/action")
 async def handle_offer_action(action_data: OfferAction, current_user: dict = Depends(get_current_user)):
@@ -674,102 +905,111 @@ async def handle_offer_action(action_data: OfferAction, current_user: dict = Dep
         "created_at": datetime.utcnow()
     }
     await db.messages.insert_one(message_dict)
+    await hub.publish(offer['buyer_id'], {"type": "offer_status", "offer_id": offer['id'], "listing_id": offer['listing_id'], "status": new_status.value})
+    await deliver_message(message_dict)
     return {"message": "Angebot aktualisiert", "status": new_status}
 
 # ============= RECOMMENDATIONS =============
-@api_router.get("/recommendations/for-you")
-async def get_recommendations_for_you(current_user: dict = Depends(get_optional_user)):
-    """Get personalized recommendations based on user's views and favorites"""
+@api_router.get("/recommendations/for-you", response_model=List[ListingSummary])
+async def get_recommendations_for_you(current_user: dict = Depends(get_current_user_optional), loaders: Loaders = Depends(get_loaders)):
+    """Personalized listings precomputed from favorites, offers and views; popular listings otherwise"""
+    popular = await popular_listings()
     if not current_user:
-        # For guests, return popular listings
-        listings = await db.listings.find().sort("views", -1).limit(10).to_list(10)
-        return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+        return respond(popular[:10])
     
     user_id = current_user['user_id']
-    
-    # Get user's favorite listings to understand preferences
-    favorites = await db.favorites.find({"user_id": user_id}).to_list(100)
-    favorite_listing_ids = [fav['listing_id'] for fav in favorites]
-    
-    # Get categories from favorites
-    favorite_categories = set()
-    if favorite_listing_ids:
-        favorite_listings = await db.listings.find({"id": {"$in": favorite_listing_ids}}).to_list(100)
-        favorite_categories = {listing['category'] for listing in favorite_listings}
-    
-    # Get recommendations based on favorite categories
-    recommended = []
-    if favorite_categories:
-        recommended = await db.listings.find({
-            "category": {"$in": list(favorite_categories)},
-            "id": {"$nin": favorite_listing_ids},
-            "seller_id": {"$ne": user_id}
-        }).sort("created_at", -1).limit(10).to_list(10)
-    
-    # If not enough recommendations, add popular items
+    ids = await recommendations.recommended_ids(db, user_id)
+    listings = await loaders.listings.load_many(ids)
+    # Listings deleted since the last run drop out here
+    recommended = [jsonable(to_summary(listings[i])) for i in ids if listings[i] and listings[i]['seller_id'] != user_id][:10]
     if len(recommended) < 10:
-        popular = await db.listings.find({
-            "id": {"$nin": [r['id'] for r in recommended] + favorite_listing_ids},
-            "seller_id": {"$ne": user_id}
-        }).sort("views", -1).limit(10 - len(recommended)).to_list(10 - len(recommended))
-        recommended.extend(popular)
-    
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in recommended]
-
-@api_router.get("/recommendations/similar/{listing_id}")
+        included = {listing['id'] for listing in recommended}
+        recommended.extend(
+            listing for listing in popular if listing['id'] not in included and listing['seller_id'] != user_id
+        )
+    return respond(recommended[:10])
+
+async def popular_listings() -> List[dict]:
+    """Most viewed listings, shared by guests and as the fallback for personal recommendations"""
+    async def load():
+        listings = await db.listings.find({}, LISTING_SUMMARY_PROJECTION).sort("views", -1).limit(20).to_list(20)
+        return [jsonable(to_summary(listing)) for listing in listings]
+    return await response_cache.get_or_load("recommendations:guest", None, load, tags=["listings"])
+
+@api_router.get("/recommendations/similar/{listing_id}", response_model=List[ListingSummary])
 async def get_similar_listings(listing_id: str):
-    """Get similar listings based on category and price range"""
-    listing = await db.listings.find_one({"id": listing_id})
-    if not listing:
-        raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
-    
-    # Define price range (±30%)
-    price = listing['price']
-    min_price = price * 0.7
-    max_price = price * 1.3
+    """Nearest listings by category_fields and price; a category/price query until the index is built"""
+    category = None
+
+    async def load():
+        nonlocal category
+        ids = await similarity_index.nearest(listing_id, 6)
+        if ids is not None:
+            category = similarity_index.category(listing_id)
+            found = {doc['id']: doc for doc in await db.listings.find({"id": {"$in": ids}}, LISTING_SUMMARY_PROJECTION).to_list(len(ids))}
+            return [jsonable(to_summary(found[i])) for i in ids if i in found]
+        
+        listing = await db.listings.find_one({"id": listing_id}, {"_id": 0, "price": 1, "category": 1, "seller_id": 1})
+        if not listing:
+            raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
+        category = listing['category']
     
-    # Find similar listings
-    similar = await db.listings.find({
-        "category": listing['category'],
-        "price": {"$gte": min_price, "$lte": max_price},
-        "id": {"$ne": listing_id},
-        "seller_id": {"$ne": listing['seller_id']}
-    }).sort("created_at", -1).limit(6).to_list(6)
+        # Define price range (±30%)
+        price = listing['price']
+        min_price = price * 0.7
+        max_price = price * 1.3
     
-    # If not enough, just get from same category
-    if len(similar) < 6:
-        additional = await db.listings.find({
+        # Find similar listings
+        similar = await db.listings.find({
             "category": listing['category'],
-            "id": {"$nin": [listing_id] + [s['id'] for s in similar]},
+            "price": {"$gte": min_price, "$lte": max_price},
+            "id": {"$ne": listing_id},
             "seller_id": {"$ne": listing['seller_id']}
-        }).sort("created_at", -1).limit(6 - len(similar)).to_list(6 - len(similar))
-        similar.extend(additional)
+        }, LISTING_SUMMARY_PROJECTION).sort("created_at", -1).limit(6).to_list(6)
     
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in similar]
+        # If not enough, just get from same category
+        if len(similar) < 6:
+            additional = await db.listings.find({
+                "category": listing['category'],
+                "id": {"$nin": [listing_id] + [s['id'] for s in similar]},
+                "seller_id": {"$ne": listing['seller_id']}
+            }, LISTING_SUMMARY_PROJECTION).sort("created_at", -1).limit(6 - len(similar)).to_list(6 - len(similar))
+            similar.extend(additional)
+    
+        return [jsonable(to_summary(similar_listing)) for similar_listing in similar]
+
+    return respond(await response_cache.get_or_load(
+        "recommendations:similar", {"listing_id": listing_id}, load,
+        tags=lambda: [f"listing:{listing_id}", f"category:{category}"]
+    ))
 
 # ============= USERS =============
 @api_router.get("/users/{user_id}")
 async def get_user(user_id: str):
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
-    return {
-        "id": user['id'],
-        "name": user['name'],
-        "email": user['email'],
-        "rating": user.get('rating', 0.0),
-        "review_count": user.get('review_count', 0),
-    }
+    async def load():
+        user = await db.users.find_one({"id": user_id})
+        if not user:
+            raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
+        return {
+            "id": user['id'],
+            "name": user['name'],
+            "email": user['email'],
+            "rating": user.get('rating', 0.0),
+            "review_count": user.get('review_count', 0),
+            "rating_histogram": user.get('rating_histogram', {}),
+        }
+    return await response_cache.get_or_load("users:profile", {"user_id": user_id}, load, tags=[f"user:{user_id}"])
 
-@api_router.get("/listings/seller/{seller_id}")
-async def get_seller_listings(seller_id: str):
-    listings = await db.listings.find({"seller_id": seller_id}).to_list(1000)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+@api_router.get("/listings/seller/{seller_id}", response_model=List[ListingSummary])
+async def get_seller_listings(seller_id: str, response: Response, limit: int = 1000, cursor: Optional[str] = None):
+    listings = await fetch_page(response, db.listings, {"seller_id": seller_id}, LISTING_SUMMARY_PROJECTION,
+                                min(limit, 1000), cursor=cursor)
+    return respond([to_summary(listing) for listing in listings], response)
 
 @api_router.get("/reviews/user/{user_id}")
-async def get_user_reviews(user_id: str):
-    reviews = await db.reviews.find({"reviewed_user_id": user_id}).sort("created_at", -1).to_list(1000)
-    return [Review(**{k: v for k, v in review.items() if k != '_id'}) for review in reviews]
+async def get_user_reviews(user_id: str, response: Response, limit: int = 1000, cursor: Optional[str] = None):
+    reviews = await fetch_page(response, db.reviews, {"reviewed_user_id": user_id}, REVIEW_PROJECTION, min(limit, 1000), cursor=cursor)
+    return respond(from_docs(Review, reviews), response)
 
 # ============= REVIEWS =============
 @api_router.post("/reviews")
@@ -777,13 +1017,15 @@ async def create_review(review_data: ReviewCreate, current_user: dict = Depends(
     # Check if user is trying to review themselves
     if current_user['user_id'] == review_data.reviewed_user_id:
         raise HTTPException(status_code=400, detail="Sie können sich nicht selbst bewerten")
+    if not 1 <= review_data.rating <= 5:
+        raise HTTPException(status_code=400, detail="Bewertung muss zwischen 1 und 5 liegen")
     
     # Check if already reviewed
     existing = await db.reviews.find_one({"reviewer_id": current_user['user_id'], "reviewed_user_id": review_data.reviewed_user_id})
     if existing:
         raise HTTPException(status_code=400, detail="Sie haben diesen Benutzer bereits bewertet")
     
-    reviewer = await db.users.find_one({"id": current_user['user_id']})
+    reviewer = await get_user_profile(current_user['user_id'])
     review_id = str(uuid.uuid4())
     review_dict = {
         "id": review_id,
@@ -795,15 +1037,15 @@ async def create_review(review_data: ReviewCreate, current_user: dict = Depends(
         "created_at": datetime.utcnow()
     }
     await db.reviews.insert_one(review_dict)
-    all_reviews = await db.reviews.find({"reviewed_user_id": review_data.reviewed_user_id}).to_list(1000)
-    avg_rating = sum(r['rating'] for r in all_reviews) / len(all_reviews)
-    await db.users.update_one({"id": review_data.reviewed_user_id}, {"$set": {"rating": avg_rating, "review_count": len(all_reviews)}})
+    await ratings.add_review(db, review_data.reviewed_user_id, review_data.rating)
+    authenticator.invalidate(review_data.reviewed_user_id)
+    await response_cache.invalidate(f"user:{review_data.reviewed_user_id}")
     return Review(**{k: v for k, v in review_dict.items() if k != '_id'})
 
 @api_router.get("/reviews/{user_id}")
-async def get_user_reviews(user_id: str):
-    reviews = await db.reviews.find({"reviewed_user_id": user_id}).sort('created_at', -1).to_list(100)
-    return [Review(**{k: v for k, v in review.items() if k != '_id'}) for review in reviews]
+async def get_user_reviews(user_id: str, response: Response, limit: int = 100, cursor: Optional[str] = None):
+    reviews = await fetch_page(response, db.reviews, {"reviewed_user_id": user_id}, REVIEW_PROJECTION, min(limit, 100), cursor=cursor)
+    return respond(from_docs(Review, reviews), response)
 
 # ============= FAVORITES =============
 @api_router.post("/favorites/{listing_id}")
@@ -835,15 +1077,16 @@ async def remove_from_favorites(listing_id: str, current_user: dict = Depends(ge
         raise HTTPException(status_code=404, detail="Favorit nicht gefunden")
     return {"message": "Aus Favoriten entfernt"}
 
-@api_router.get("/favorites")
-async def get_favorites(current_user: dict = Depends(get_current_user)):
-    favorites = await db.favorites.find({"user_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
+@api_router.get("/favorites", response_model=List[ListingSummary])
+async def get_favorites(current_user: dict = Depends(get_current_user), loaders: Loaders = Depends(get_loaders)):
+    favorites = await db.favorites.find({"user_id": current_user['user_id']}, {"_id": 0, "listing_id": 1}).sort('created_at', -1).to_list(100)
+    listings = await loaders.listings.load_many(fav['listing_id'] for fav in favorites)
     result = []
     for fav in favorites:
-        listing = await db.listings.find_one({"id": fav['listing_id']})
+        listing = listings[fav['listing_id']]
         if listing:
-            result.append(Listing(**{k: v for k, v in listing.items() if k != '_id'}))
-    return result
+            result.append(to_summary(listing))
+    return respond(result)
 
 @api_router.get("/favorites/check/{listing_id}")
 async def check_favorite(listing_id: str, current_user: dict = Depends(get_current_user)):
@@ -853,7 +1096,7 @@ async def check_favorite(listing_id: str, current_user: dict = Depends(get_curre
 # ============= SUPPORT =============
 @api_router.post("/support")
 async def create_support_ticket(ticket_data: SupportTicketCreate, current_user: dict = Depends(get_current_user)):
-    user = await db.users.find_one({"id": current_user['user_id']})
+    user = await get_user_profile(current_user['user_id'])
     ticket_id = str(uuid.uuid4())
     ticket_dict = {
         "id": ticket_id,
@@ -867,12 +1110,13 @@ async def create_support_ticket(ticket_data: SupportTicketCreate, current_user:
         "created_at": datetime.utcnow()
     }
     await db.support_tickets.insert_one(ticket_dict)
+    await admin_stats.increment(db, "open_tickets")
     return SupportTicket(**{k: v for k, v in ticket_dict.items() if k != '_id'})
 
 @api_router.get("/support/my")
 async def get_my_tickets(current_user: dict = Depends(get_current_user)):
-    tickets = await db.support_tickets.find({"user_id": current_user['user_id']}).sort('created_at', -1).to_list(100)
-    return [SupportTicket(**{k: v for k, v in ticket.items() if k != '_id'}) for ticket in tickets]
+    tickets = await db.support_tickets.find({"user_id": current_user['user_id']}, TICKET_PROJECTION).sort('created_at', -1).to_list(100)
+    return respond(from_docs(SupportTicket, tickets))
 
 # ============= AI =============
 # AI endpoints temporarily disabled for deployment
@@ -889,9 +1133,9 @@ async def get_my_tickets(current_user: dict = Depends(get_current_user)):
 # ============= ADMIN =============
 # Get all users (Admin & Super Admin)
 @api_router.get("/admin/users")
-async def get_all_users(current_user: dict = Depends(require_admin)):
-    users = await db.users.find().sort('created_at', -1).to_list(1000)
-    return [User(**{k: v for k, v in user.items() if k != 'password' and k != '_id'}) for user in users]
+async def get_all_users(response: Response, limit: int = 1000, cursor: Optional[str] = None, current_user: dict = Depends(require_admin)):
+    users = await fetch_page(response, db.users, {}, USER_PROJECTION, min(limit, 1000), cursor=cursor)
+    return respond(from_docs(User, users), response)
 
 # Delete user (Super Admin can delete anyone, Regular Admin can delete only users)
 @api_router.delete("/admin/users/{user_id}")
@@ -910,12 +1154,16 @@ async def delete_user(user_id: str, current_user: dict = Depends(require_admin))
     if target_user['role'] == UserRole.SUPER_ADMIN:
         raise HTTPException(status_code=403, detail="Super Admin kann nicht gelöscht werden")
     
+    # The account is gone right away; its listings, messages, reviews etc. are removed by a job
     await db.users.delete_one({"id": user_id})
-    await db.listings.delete_many({"seller_id": user_id})
-    await db.messages.delete_many({"$or": [{"from_user_id": user_id}, {"to_user_id": user_id}]})
-    await db.offers.delete_many({"$or": [{"buyer_id": user_id}, {"seller_id": user_id}]})
-    await db.reviews.delete_many({"$or": [{"reviewer_id": user_id}, {"reviewed_user_id": user_id}]})
-    return {"message": "Benutzer gelöscht"}
+    authenticator.invalidate(user_id)
+    if target_user['role'] == UserRole.ADMIN:
+        await admin_stats.increment(db, "admins", -1)
+    if target_user.get('is_verified'):
+        await admin_stats.increment(db, "verified_sellers", -1)
+    await response_cache.invalidate(f"user:{user_id}")
+    job = await job_queue.enqueue("delete_user", {"user_id": user_id})
+    return {"message": "Benutzer gelöscht", "job_id": job['id']}
 
 # Promote user to admin (Super Admin only)
 @api_router.post("/admin/users/{user_id}/promote")
@@ -927,7 +1175,10 @@ async def promote_to_admin(user_id: str, current_user: dict = Depends(require_su
     if user['role'] == UserRole.SUPER_ADMIN:
         raise HTTPException(status_code=400, detail="Benutzer ist bereits Super Admin")
     
-    await db.users.update_one({"id": user_id}, {"$set": {"role": UserRole.ADMIN}})
+    result = await db.users.update_one({"id": user_id, "role": {"$ne": UserRole.ADMIN}}, {"$set": {"role": UserRole.ADMIN}})
+    if result.modified_count:
+        await admin_stats.increment(db, "admins")
+    authenticator.invalidate(user_id)
     return {"message": "Benutzer zum Admin befördert"}
 
 # Demote admin to user (Super Admin only)
@@ -940,7 +1191,11 @@ async def demote_to_user(user_id: str, current_user: dict = Depends(require_supe
     if user['role'] == UserRole.SUPER_ADMIN:
         raise HTTPException(status_code=400, detail="Super Admin kann nicht degradiert werden")
     
-    await db.users.update_one({"id": user_id}, {"$set": {"role": UserRole.USER}})
+    result = await db.users.update_one({"id": user_id, "role": UserRole.ADMIN}, {"$set": {"role": UserRole.USER}})
+    if result.modified_count:
+        await admin_stats.increment(db, "admins", -1)
+    # Tokens issued while they were admin must not outlive the demotion
+    await revoke_sessions(user_id, await authenticator.revoke(user_id))
     return {"message": "Admin zu Benutzer degradiert"}
 
 # Mark user as verified seller (Admin & Super Admin)
@@ -950,7 +1205,10 @@ async def verify_seller(user_id: str, current_user: dict = Depends(require_admin
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
     
-    await db.users.update_one({"id": user_id}, {"$set": {"is_verified": True}})
+    result = await db.users.update_one({"id": user_id, "is_verified": {"$ne": True}}, {"$set": {"is_verified": True}})
+    if result.modified_count:
+        await admin_stats.increment(db, "verified_sellers")
+    authenticator.invalidate(user_id)
     return {"message": "Benutzer als verifiziert markiert"}
 
 # Remove verified status (Admin & Super Admin)
@@ -960,27 +1218,25 @@ async def unverify_seller(user_id: str, current_user: dict = Depends(require_adm
     if not user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
     
-    await db.users.update_one({"id": user_id}, {"$set": {"is_verified": False}})
+    result = await db.users.update_one({"id": user_id, "is_verified": True}, {"$set": {"is_verified": False}})
+    if result.modified_count:
+        await admin_stats.increment(db, "verified_sellers", -1)
+    authenticator.invalidate(user_id)
     return {"message": "Verifizierungsstatus entfernt"}
 
-@api_router.get("/admin/listings")
-async def get_all_listings_admin(current_user: dict = Depends(require_admin)):
-    listings = await db.listings.find().sort('created_at', -1).to_list(1000)
-    return [Listing(**{k: v for k, v in listing.items() if k != '_id'}) for listing in listings]
+@api_router.get("/admin/listings", response_model=List[ListingSummary])
+async def get_all_listings_admin(response: Response, limit: int = 1000, cursor: Optional[str] = None, current_user: dict = Depends(require_admin)):
+    listings = await fetch_page(response, db.listings, {}, LISTING_SUMMARY_PROJECTION, min(limit, 1000), cursor=cursor)
+    return respond([to_summary(listing) for listing in listings], response)
 
 # Delete listing (Admin & Super Admin)
 @api_router.delete("/admin/listings/{listing_id}")
 async def delete_listing_admin(listing_id: str, current_user: dict = Depends(require_admin)):
-    result = await db.listings.delete_one({"id": listing_id})
-    if result.deleted_count == 0:
+    listing = await db.listings.find_one_and_delete({"id": listing_id}, {"_id": 0, "category": 1, "is_pinned": 1})
+    if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
-    
-    # Clean up related data
-    await db.messages.delete_many({"listing_id": listing_id})
-    await db.offers.delete_many({"listing_id": listing_id})
-    await db.favorites.delete_many({"listing_id": listing_id})
-    
-    return {"message": "Anzeige gelöscht"}
+    job = await remove_listing(listing_id, listing)
+    return {"message": "Anzeige gelöscht", "job_id": job['id']}
 
 # Pin listing to top (Admin & Super Admin)
 @api_router.post("/admin/listings/{listing_id}/pin")
@@ -989,7 +1245,10 @@ async def pin_listing(listing_id: str, current_user: dict = Depends(require_admi
     if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
     
-    await db.listings.update_one({"id": listing_id}, {"$set": {"is_pinned": True}})
+    result = await db.listings.update_one({"id": listing_id, "is_pinned": {"$ne": True}}, {"$set": {"is_pinned": True}})
+    if result.modified_count:
+        await admin_stats.increment(db, "pinned_listings")
+    await response_cache.invalidate("listings", f"listing:{listing_id}", f"category:{listing['category']}")
     return {"message": "Anzeige wurde angeheftet"}
 
 # Unpin listing (Admin & Super Admin)
@@ -999,19 +1258,22 @@ async def unpin_listing(listing_id: str, current_user: dict = Depends(require_ad
     if not listing:
         raise HTTPException(status_code=404, detail="Anzeige nicht gefunden")
     
-    await db.listings.update_one({"id": listing_id}, {"$set": {"is_pinned": False}})
+    result = await db.listings.update_one({"id": listing_id, "is_pinned": True}, {"$set": {"is_pinned": False}})
+    if result.modified_count:
+        await admin_stats.increment(db, "pinned_listings", -1)
+    await response_cache.invalidate("listings", f"listing:{listing_id}", f"category:{listing['category']}")
     return {"message": "Anzeige wurde entfernt"}
 
 # Get all messages (Admin & Super Admin) 
 @api_router.get("/admin/messages")
-async def get_all_messages_admin(current_user: dict = Depends(require_admin)):
-    messages = await db.messages.find().sort('created_at', -1).limit(500).to_list(500)
-    return [Message(**{k: v for k, v in message.items() if k != '_id'}) for message in messages]
+async def get_all_messages_admin(response: Response, limit: int = 500, cursor: Optional[str] = None, current_user: dict = Depends(require_admin)):
+    messages = await fetch_page(response, db.messages, {}, MESSAGE_PROJECTION, min(limit, 500), cursor=cursor)
+    return respond(from_docs(Message, messages), response)
 
 @api_router.get("/admin/support")
-async def get_all_tickets(current_user: dict = Depends(require_admin)):
-    tickets = await db.support_tickets.find().sort('created_at', -1).to_list(1000)
-    return [SupportTicket(**{k: v for k, v in ticket.items() if k != '_id'}) for ticket in tickets]
+async def get_all_tickets(response: Response, limit: int = 1000, cursor: Optional[str] = None, current_user: dict = Depends(require_admin)):
+    tickets = await fetch_page(response, db.support_tickets, {}, TICKET_PROJECTION, min(limit, 1000), cursor=cursor)
+    return respond(from_docs(SupportTicket, tickets), response)
 
 @api_router.post("/admin/support/{ticket_id}/reply")
 async def reply_to_ticket(ticket_id: str, reply_message: str, current_user: dict = Depends(require_admin)):
@@ -1019,68 +1281,96 @@ async def reply_to_ticket(ticket_id: str, reply_message: str, current_user: dict
     await db.support_tickets.update_one({"id": ticket_id}, {"$push": {"replies": reply}})
     return {"message": "Antwort gesendet"}
 
+@api_router.get("/admin/export/{name}")
+async def export_collection(name: str, request: Request, format: str = "ndjson", after: Optional[str] = None,
+                            since: Optional[datetime] = None, until: Optional[datetime] = None, limit: Optional[int] = None,
+                            current_user: dict = Depends(require_admin)):
+    """Stream users, listings, messages or support tickets as NDJSON or CSV, oldest first.
+    Filters are the export's own query parameters (e.g. ``?status=open``); an interrupted
+    download continues with ``after=<id of the last row received>``."""
+    spec = export.EXPORTS.get(name)
+    if spec is None:
+        raise HTTPException(status_code=404, detail="Export nicht gefunden")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="Ungültiges Format")
+    collection = db[spec.collection]
+    try:
+        query = export.build_query(spec, request.query_params, since, until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ungültiger Filter")
+    if after:
+        try:
+            resume = await export.resume_filter(collection, after)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Ungültiger Cursor")
+        query = {"$and": [query, resume]} if query else resume
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(export.stream_rows(collection, spec, query, format, limit=limit),
+                             media_type=export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: dict = Depends(require_admin)):
+    """Runtime metrics of this worker"""
+    return {"credentials": credential_service.stats(), "realtime": hub.stats(), "views": view_counter.stats(),
+            "response_cache": response_cache.stats(), "similarity": similarity_index.stats(),
+            "jobs": {**job_queue.stats(), "queue": await job_queue.counts()}, "auth": authenticator.stats(),
+            "stats_snapshots": stats_snapshotter.stats()}
+
+@api_router.get("/admin/jobs")
+async def get_jobs(response: Response, status: Optional[str] = None, type: Optional[str] = None, limit: int = 100,
+                   cursor: Optional[str] = None, current_user: dict = Depends(require_admin)):
+    """Background jobs, newest first, with their progress"""
+    query = {k: v for k, v in (("status", status), ("type", type)) if v}
+    return await fetch_page(response, db.jobs, query, {"_id": 0}, min(limit, 500), cursor=cursor)
+
+@api_router.get("/admin/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(require_admin)):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Auftrag nicht gefunden")
+    return job
+
+@api_router.post("/admin/jobs/{job_id}/retry")
+async def retry_job(job_id: str, current_user: dict = Depends(require_admin)):
+    if not await job_queue.retry(job_id):
+        raise HTTPException(status_code=400, detail="Nur fehlgeschlagene Aufträge können wiederholt werden")
+    return {"message": "Auftrag wird wiederholt"}
+
 @api_router.get("/admin/stats")
 async def get_admin_stats(current_user: dict = Depends(require_admin)):
-    users_count = await db.users.count_documents({})
-    listings_count = await db.listings.count_documents({})
-    messages_count = await db.messages.count_documents({})
-    offers_count = await db.offers.count_documents({})
-    support_open = await db.support_tickets.count_documents({"status": SupportStatus.OPEN})
-    
-    # Admin specific stats
-    admin_count = await db.users.count_documents({"role": UserRole.ADMIN})
-    verified_sellers = await db.users.count_documents({"is_verified": True})
-    pinned_listings = await db.listings.count_documents({"is_pinned": True})
-    
-    return {
-        "users": users_count,
-        "listings": listings_count,
-        "messages": messages_count,
-        "offers": offers_count,
-        "open_tickets": support_open,
-        "admins": admin_count,
-        "verified_sellers": verified_sellers,
-        "pinned_listings": pinned_listings
-    }
+    """Current figures from the maintained counters; no collection scans"""
+    return await admin_stats.current(db)
+
+@api_router.get("/admin/stats/history")
+async def get_admin_stats_history(days: int = 30, current_user: dict = Depends(require_admin)):
+    """Stored snapshots of the last ``days`` days, oldest first"""
+    since = datetime.utcnow() - timedelta(days=min(max(days, 1), 400))
+    return await admin_stats.history(db, since)
 
 app.include_router(api_router)
-app.add_middleware(CORSMiddleware, allow_credentials=True, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_credentials=True, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=[NEXT_CURSOR_HEADER])
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up...")
+    await hub.start()
+    view_counter.start()
+    similarity_index.start(db.listings)
+    job_queue.start()
+    stats_snapshotter.start()
     
-    # Create database indexes for better performance
+    # Create database indexes (declared in indexes.py)
     try:
-        # Listings indexes
-        await db.listings.create_index([("seller_id", 1)])
-        await db.listings.create_index([("category", 1)])
-        await db.listings.create_index([("created_at", -1)])
-        await db.listings.create_index([("price", 1)])
-        await db.listings.create_index([("views", -1)])
-        
-        # Users indexes
-        await db.users.create_index([("email", 1)], unique=True)
-        await db.users.create_index([("id", 1)], unique=True)
-        
-        # Messages indexes
-        await db.messages.create_index([("from_user_id", 1)])
-        await db.messages.create_index([("to_user_id", 1)])
-        await db.messages.create_index([("listing_id", 1)])
-        await db.messages.create_index([("created_at", -1)])
-        
-        # Reviews indexes
-        await db.reviews.create_index([("reviewed_user_id", 1)])
-        await db.reviews.create_index([("reviewer_id", 1)])
-        await db.reviews.create_index([("created_at", -1)])
-        
-        # Favorites indexes
-        await db.favorites.create_index([("user_id", 1)])
-        await db.favorites.create_index([("listing_id", 1)])
-        
-        logger.info("Database indexes created successfully")
+        result = await indexes.ensure_indexes(db)
+        if result["failed"]:
+            logger.warning(f"{len(result['failed'])} database indexes could not be created")
+        else:
+            logger.info("Database indexes created successfully")
     except Exception as e:
-        logger.warning(f"Error creating indexes (may already exist): {e}")
+        logger.warning(f"Error creating indexes: {e}")
+    
+    await admin_stats.ensure_counters(db)
     
     # Create Super Admin account
     super_admin_email = "chancenmarketa@gmail.com"
@@ -1091,7 +1381,7 @@ async def startup_event():
             "id": super_admin_id,
             "name": "Super Admin",
             "email": super_admin_email,
-            "password": hash_password("Kallestrasse11##"),
+            "password": await credential_service.hash("Kallestrasse11##"),
             "role": UserRole.SUPER_ADMIN,
             "rating": 5.0,
             "review_count": 0,
@@ -1102,6 +1392,7 @@ async def startup_event():
             "created_at": datetime.utcnow()
         }
         await db.users.insert_one(super_admin_dict)
+        await admin_stats.increment(db, "verified_sellers")
         logger.info(f"Super Admin user created: {super_admin_email}")
     
     # Keep old admin for backward compatibility
@@ -1113,7 +1404,7 @@ async def startup_event():
             "id": admin_id,
             "name": "Admin",
             "email": admin_email,
-            "password": hash_password("Admin@123"),
+            "password": await credential_service.hash("Admin@123"),
             "role": UserRole.ADMIN,
             "rating": 5.0,
             "review_count": 0,
@@ -1124,8 +1415,16 @@ async def startup_event():
             "created_at": datetime.utcnow()
         }
         await db.users.insert_one(admin_dict)
+        await admin_stats.increment(db, "admins")
         logger.info(f"Admin user created: {admin_email} / Admin@123")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await hub.stop()
+    await view_counter.stop()
+    await similarity_index.stop()
+    await job_queue.stop()
+    await stats_snapshotter.stop()
+    shutdown_image_pool()
+    credential_service.shutdown()
     client.close()
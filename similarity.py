@@ -0,0 +1,358 @@
+"""In-memory k-nearest-neighbour index of listings over ``category_fields``.
+
+Every category gets its own arrays built from the category schema: numeric
+fields (plus the price) are z-scored into a float32 matrix, select fields are
+stored as integer codes whose mismatches add a per-field cost (the distance a
+one-hot encoding would give, without its width). A query is one vectorized
+distance pass over the category's rows.
+
+Each worker holds its own copy. Its own writes are applied incrementally and
+the whole index is rebuilt every ``rebuild_interval`` seconds so writes made
+by other workers show up too; a build reads only the fields the schemas use and
+keeps compact per-category arrays, not the listing documents. The distance
+pass runs in a thread (``asyncio.to_thread``), so a large category does not
+stall the event loop. Until the first build finishes ``nearest`` returns None
+and callers fall back to a query.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from categories import registry as category_registry
+
+logger = logging.getLogger(__name__)
+
+# Matching these costs more than matching e.g. the colour
+FIELD_WEIGHTS = {"price": 2.0, "brand": 2.0, "model": 1.5, "property_type": 2.0, "listing_type": 2.0, "category": 2.0, "type": 1.5}
+# Skewed numeric fields are compared on a log scale
+LOG_FIELDS = {"price", "mileage", "area", "plot_area"}
+
+LISTING_FIELDS = {"_id": 0, "id": 1, "seller_id": 1, "category": 1, "price": 1}
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool) or value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class CategorySchema:
+    """Maps a listing of one category to its numeric vector and select codes"""
+
+    def __init__(self, category_id: str):
+        fields = category_registry.fields.get(category_id, {})
+        self.numeric = ["price"] + [name for name, field in fields.items() if field['type'] == 'number']
+        self.selects: Dict[str, Dict[str, int]] = {}
+        for name, field in fields.items():
+            if field['type'] == 'select':
+                options = field['options']
+            elif field['type'] == 'select_dynamic':
+                # Models only make sense together with their brand
+                options = [f"{brand}:{model}" for brand, models in field['options'].items() for model in models]
+            else:
+                continue
+            self.selects[name] = {option: code for code, option in enumerate(options)}
+        self.numeric_weights = np.array([FIELD_WEIGHTS.get(name, 1.0) for name in self.numeric], dtype=np.float32)
+        # Squared distance added when a select field differs (same as one-hot encoding scaled by the weight)
+        self.mismatch_costs = np.array([FIELD_WEIGHTS.get(name, 1.0) ** 2 for name in self.selects], dtype=np.float32)
+        self.mean = np.zeros(len(self.numeric), dtype=np.float32)
+        self.std = np.ones(len(self.numeric), dtype=np.float32)
+
+    def raw_numeric(self, listing: dict) -> np.ndarray:
+        values = listing.get('category_fields') or {}
+        row = np.full(len(self.numeric), np.nan, dtype=np.float32)
+        for i, name in enumerate(self.numeric):
+            number = _number(listing.get('price') if name == "price" else values.get(name))
+            if number is not None:
+                row[i] = math.log1p(max(number, 0)) if name in LOG_FIELDS else number
+        return row
+
+    def fit(self, raw: np.ndarray):
+        """Set the z-score parameters from the raw numeric rows of the category"""
+        if len(raw):
+            with warnings.catch_warnings():
+                # Fields nobody filled in yield all-NaN columns
+                warnings.simplefilter('ignore', RuntimeWarning)
+                mean = np.nanmean(raw, axis=0)
+                std = np.nanstd(raw, axis=0)
+            self.mean = np.nan_to_num(mean).astype(np.float32)
+            self.std = np.where(np.isfinite(std) & (std > 0), std, 1).astype(np.float32)
+
+    def vectors(self, raw: np.ndarray) -> np.ndarray:
+        """Weighted z-scores of one raw row or a matrix of them"""
+        # Missing numbers sit at the category mean
+        return np.nan_to_num((raw - self.mean) / self.std) * self.numeric_weights
+
+    def codes(self, listing: dict) -> np.ndarray:
+        values = listing.get('category_fields') or {}
+        codes = np.full(len(self.selects), -1, dtype=np.int16)
+        for i, (name, options) in enumerate(self.selects.items()):
+            value = values.get(name)
+            if name == "model":
+                value = f"{values.get('brand')}:{value}"
+            codes[i] = options.get(value, -1)
+        return codes
+
+    def encode(self, listing: dict, raw: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        raw = self.raw_numeric(listing) if raw is None else raw
+        return self.vectors(raw), self.codes(listing)
+
+
+def feature_projection() -> dict:
+    """``LISTING_FIELDS`` plus the category fields some schema compares"""
+    projection = dict(LISTING_FIELDS)
+    for fields in category_registry.fields.values():
+        for name, field in fields.items():
+            if field['type'] in ('number', 'select', 'select_dynamic'):
+                projection[f"category_fields.{name}"] = 1
+    return projection
+
+
+class _Rows:
+    """One category's rows as read by a build, before the z-score fit"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.sellers: List[str] = []
+        self.raw: List[np.ndarray] = []
+        self.codes: List[np.ndarray] = []
+
+
+class CategoryIndex:
+    def __init__(self, schema: CategorySchema, capacity: int = 1024):
+        self.schema = schema
+        self.vectors = np.zeros((capacity, len(schema.numeric)), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.codes = np.full((capacity, len(schema.selects)), -1, dtype=np.int16)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Sellers as integer codes so excluding the seller is a vectorized comparison
+        self.sellers = np.full(capacity, -1, dtype=np.int64)
+        self._seller_codes: Dict[str, int] = {}
+        self.ids: List[Optional[str]] = [None] * capacity
+        self.rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _grow(self):
+        size = len(self.ids)
+        self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+        self.norms = np.concatenate([self.norms, np.zeros_like(self.norms)])
+        self.codes = np.concatenate([self.codes, np.full_like(self.codes, -1)])
+        self.alive = np.concatenate([self.alive, np.zeros_like(self.alive)])
+        self.sellers = np.concatenate([self.sellers, np.full(size, -1, dtype=np.int64)])
+        self.ids.extend([None] * size)
+
+    def put(self, listing_id: str, seller_id: str, encoded: Tuple[np.ndarray, np.ndarray]):
+        row = self.rows.get(listing_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self._size == len(self.ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+            self.rows[listing_id] = row
+            self.ids[row] = listing_id
+        vector, codes = encoded
+        self.vectors[row] = vector
+        self.norms[row] = vector @ vector
+        self.codes[row] = codes
+        self.alive[row] = True
+        self.sellers[row] = self._seller_codes.setdefault(seller_id, len(self._seller_codes))
+
+    def load(self, rows: _Rows):
+        """Fill an empty index with a build's rows in one pass"""
+        n = len(rows.ids)
+        raw = np.stack(rows.raw) if n else np.zeros((0, len(self.schema.numeric)), dtype=np.float32)
+        self.schema.fit(raw)
+        self.vectors[:n] = self.schema.vectors(raw)
+        self.norms[:n] = np.einsum('ij,ij->i', self.vectors[:n], self.vectors[:n])
+        if n and len(self.schema.selects):
+            self.codes[:n] = np.stack(rows.codes)
+        self.alive[:n] = True
+        for row, (listing_id, seller_id) in enumerate(zip(rows.ids, rows.sellers)):
+            self.rows[listing_id] = row
+            self.ids[row] = listing_id
+            self.sellers[row] = self._seller_codes.setdefault(seller_id, len(self._seller_codes))
+        self._size = n
+
+    def remove(self, listing_id: str):
+        row = self.rows.pop(listing_id, None)
+        if row is not None:
+            self.alive[row] = False
+            self.ids[row] = None
+            self.sellers[row] = -1
+            self._free.append(row)
+
+    def arrays(self) -> tuple:
+        """The current arrays, so a query in another thread is not affected by a concurrent _grow"""
+        return self.vectors, self.norms, self.codes, self.alive, self.sellers, self._size
+
+    def rank(self, arrays: tuple, row: int, k: int) -> np.ndarray:
+        """Rows of the ``k`` nearest listings of other sellers; pure NumPy, safe to run in a thread"""
+        vectors, norms, codes, alive, sellers, n = arrays
+        # |a - b|^2 = |a|^2 - 2ab + |b|^2: one matrix-vector product over the category, plus select mismatches
+        distances = norms[:n] - 2 * (vectors[:n] @ vectors[row]) + norms[row]
+        for column, cost in enumerate(self.schema.mismatch_costs):
+            distances += (codes[:n, column] != codes[row, column]) * cost
+        distances[~alive[:n]] = np.inf
+        distances[sellers[:n] == sellers[row]] = np.inf
+        candidates = np.flatnonzero(np.isfinite(distances))
+        if not len(candidates):
+            return candidates
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+        return top[np.argsort(distances[top], kind='stable')]
+
+    def nearest(self, listing_id: str, k: int) -> List[str]:
+        row = self.rows.get(listing_id)
+        if row is None:
+            return []
+        return [self.ids[i] for i in self.rank(self.arrays(), row, k)]
+
+
+class SimilarityIndex:
+    def __init__(self, rebuild_interval: float = 3600, enabled: bool = True):
+        self.rebuild_interval = rebuild_interval
+        self.enabled = enabled
+        self.categories: Dict[str, CategoryIndex] = {}
+        self.ready = False
+        # Writes seen while a build is reading the collection, replayed after the swap
+        self._journal: Optional[List[tuple]] = None
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.queries = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def build(self, collection, batch_size: int = 5000):
+        """Load every listing and swap in fresh per-category matrices"""
+        started = time.monotonic()
+        self._journal = []
+        try:
+            schemas: Dict[str, CategorySchema] = {}
+            rows: Dict[str, _Rows] = {}
+            read = 0
+            async for listing in collection.find({}, feature_projection()).batch_size(batch_size):
+                category_id = listing['category']
+                schema = schemas.get(category_id)
+                if schema is None:
+                    schema = schemas[category_id] = CategorySchema(category_id)
+                    rows[category_id] = _Rows()
+                # Only the compact encoding is kept, not the document
+                category_rows = rows[category_id]
+                category_rows.ids.append(listing['id'])
+                category_rows.sellers.append(listing['seller_id'])
+                category_rows.raw.append(schema.raw_numeric(listing))
+                category_rows.codes.append(schema.codes(listing))
+                read += 1
+                if read % batch_size == 0:
+                    # Let requests run between chunks of a large build
+                    await asyncio.sleep(0)
+            categories = {}
+            for category_id, category_rows in rows.items():
+                n = len(category_rows.ids)
+                index = CategoryIndex(schemas[category_id], capacity=max(1024, n + n // 4))
+                index.load(category_rows)
+                categories[category_id] = index
+                await asyncio.sleep(0)
+            journal = self._journal
+        finally:
+            self._journal = None
+        self.categories = categories
+        self.ready = True
+        for op, value in journal:
+            if op == "upsert":
+                self.upsert(value)
+            else:
+                self.remove(value)
+        self.builds += 1
+        self.build_seconds = round(time.monotonic() - started, 2)
+        logger.info(f"Similarity index built: {sum(map(len, categories.values()))} listings in {self.build_seconds}s")
+
+    def upsert(self, listing: dict):
+        """Index a created or updated listing (needs id, seller_id, category, price, category_fields)"""
+        if self._journal is not None:
+            self._journal.append(("upsert", listing))
+        if not self.ready:
+            return
+        for category_id, index in self.categories.items():
+            if category_id != listing['category']:
+                # The category may have changed
+                index.remove(listing['id'])
+        index = self.categories.get(listing['category'])
+        if index is None:
+            index = self.categories[listing['category']] = CategoryIndex(CategorySchema(listing['category']))
+        index.put(listing['id'], listing['seller_id'], index.schema.encode(listing))
+
+    def remove(self, listing_id: str):
+        if self._journal is not None:
+            self._journal.append(("remove", listing_id))
+        for index in self.categories.values():
+            index.remove(listing_id)
+
+    def category(self, listing_id: str) -> Optional[str]:
+        for category_id, index in self.categories.items():
+            if listing_id in index.rows:
+                return category_id
+        return None
+
+    async def nearest(self, listing_id: str, k: int = 6) -> Optional[List[str]]:
+        """Ids of the ``k`` closest listings of other sellers, or None if the listing is not indexed"""
+        category_id = self.category(listing_id) if self.ready else None
+        if category_id is None:
+            return None
+        self.queries += 1
+        index = self.categories[category_id]
+        top = await asyncio.to_thread(index.rank, index.arrays(), index.rows[listing_id], k)
+        # A listing removed meanwhile has no id any more
+        return [index.ids[i] for i in top if index.ids[i] is not None]
+
+    async def _run(self, collection):
+        while True:
+            try:
+                await self.build(collection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Similarity index build failed: {e}")
+            await asyncio.sleep(self.rebuild_interval)
+
+    def start(self, collection):
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(collection))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "listings": {category_id: len(index) for category_id, index in self.categories.items()},
+            "builds": self.builds,
+            "build_seconds": self.build_seconds,
+            "queries": self.queries,
+        }
+
+
+def similarity_index_from_env() -> SimilarityIndex:
+    return SimilarityIndex(
+        rebuild_interval=float(os.getenv('SIMILARITY_REBUILD_SECONDS', '3600')),
+        enabled=os.getenv('SIMILARITY_INDEX', '1') != '0',
+    )
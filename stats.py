@@ -0,0 +1,141 @@
+"""Admin dashboard statistics without scanning collections.
+
+Filtered counts (open tickets, admins, verified sellers, pinned listings) are
+counters in one ``stats`` document that the write paths ``$inc``; collection
+totals come from ``estimated_document_count`` (collection metadata, no scan),
+all fetched concurrently. ``recount`` rebuilds the counters exactly
+(``python manage.py recount-stats``) and seeds them on first start, after
+backfilling the ``is_verified``/``is_pinned`` flags older documents lack.
+
+``StatsSnapshotter`` stores the figures every ``interval`` seconds in
+``stats_snapshots`` for the history charts. Snapshots are keyed by the start
+of their interval, so several workers write one snapshot between them.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from models import SupportStatus, UserRole
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_ID = "counters"
+# Counter -> (collection, filter) it mirrors
+COUNTERS = {
+    "open_tickets": ("support_tickets", {"status": SupportStatus.OPEN}),
+    "admins": ("users", {"role": UserRole.ADMIN}),
+    "verified_sellers": ("users", {"is_verified": True}),
+    "pinned_listings": ("listings", {"is_pinned": True}),
+}
+# Flags the counters read, with the value documents written before they existed get
+DEFAULTS = {"users": {"is_verified": False}, "listings": {"is_pinned": False}}
+# Figure -> collection whose size it is
+TOTALS = {"users": "users", "listings": "listings", "messages": "messages", "offers": "offers"}
+# Snapshots older than this are removed by the TTL index in indexes.py
+SNAPSHOT_TTL_SECONDS = 400 * 24 * 3600
+
+
+async def increment(db, counter: str, n: int = 1):
+    if n:
+        await db.stats.update_one({"_id": COUNTERS_ID}, {"$inc": {counter: n}}, upsert=True)
+
+
+async def backfill_defaults(db) -> dict:
+    """Set missing counter flags so toggles only ever match real transitions"""
+    backfilled = {}
+    for collection, fields in DEFAULTS.items():
+        for field, value in fields.items():
+            result = await db[collection].update_many({field: {"$exists": False}}, {"$set": {field: value}})
+            backfilled[f"{collection}.{field}"] = result.modified_count
+    return backfilled
+
+
+async def recount(db) -> dict:
+    """Exact counts for every counter, run concurrently and stored"""
+    await backfill_defaults(db)
+    names = list(COUNTERS)
+    counts = await asyncio.gather(*(db[collection].count_documents(query) for collection, query in COUNTERS.values()))
+    values = dict(zip(names, counts))
+    await db.stats.update_one({"_id": COUNTERS_ID}, {"$set": {**values, "recounted_at": datetime.utcnow()}}, upsert=True)
+    return values
+
+
+async def ensure_counters(db):
+    """Seed the counters once; afterwards the write paths keep them current"""
+    doc = await db.stats.find_one({"_id": COUNTERS_ID}, {"recounted_at": 1})
+    if doc is None or 'recounted_at' not in doc:
+        await recount(db)
+
+
+async def current(db) -> dict:
+    totals, counters = await asyncio.gather(
+        asyncio.gather(*(db[collection].estimated_document_count() for collection in TOTALS.values())),
+        db.stats.find_one({"_id": COUNTERS_ID}),
+    )
+    counters = counters or {}
+    return {**dict(zip(TOTALS, totals)), **{name: max(counters.get(name, 0), 0) for name in COUNTERS}}
+
+
+def _bucket(now: datetime, interval: float) -> datetime:
+    epoch = datetime(1970, 1, 1)
+    seconds = (now - epoch).total_seconds()
+    return epoch + timedelta(seconds=seconds - seconds % interval)
+
+
+async def take_snapshot(db, interval: float) -> dict:
+    figures = await current(db)
+    taken_at = _bucket(datetime.utcnow(), interval)
+    await db.stats_snapshots.update_one({"_id": taken_at}, {"$setOnInsert": {"taken_at": taken_at, **figures}}, upsert=True)
+    return {"taken_at": taken_at, **figures}
+
+
+async def history(db, since: datetime, until: Optional[datetime] = None) -> List[dict]:
+    query = {"_id": {"$gte": since, **({"$lte": until} if until else {})}}
+    return await db.stats_snapshots.find(query, {"_id": 0}).sort("_id", 1).to_list(None)
+
+
+class StatsSnapshotter:
+    def __init__(self, db, interval: float = 3600, enabled: bool = True):
+        self.db = db
+        self.interval = interval
+        self.enabled = enabled
+        self.snapshots = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            try:
+                await take_snapshot(self.db, self.interval)
+                self.snapshots += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Stats snapshot failed: {e}")
+            now = datetime.utcnow()
+            # Wake up just after the next interval starts
+            next_bucket = _bucket(now, self.interval) + timedelta(seconds=self.interval)
+            await asyncio.sleep((next_bucket - now).total_seconds() + 1)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "snapshots": self.snapshots, "failures": self.failures}
+
+
+def stats_snapshotter_from_env(db) -> StatsSnapshotter:
+    return StatsSnapshotter(
+        db,
+        interval=float(os.getenv('STATS_SNAPSHOT_SECONDS', '3600')),
+        enabled=os.getenv('STATS_SNAPSHOTS', '1') != '0',
+    )
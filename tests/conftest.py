@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class CountingCollection:
+    """Counts the operations sent to a collection; cursors count once, when created"""
+
+    def __init__(self, collection, counter: dict):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._counter[self._collection.name] = self._counter.get(self._collection.name, 0) + 1
+            return attr(*args, **kwargs)
+        return call
+
+
+class CountingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.operations = {}
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._db, name), self.operations)
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+    @property
+    def total(self) -> int:
+        return sum(self.operations.values())
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["test"]
+
+
+@pytest.fixture
+def counting_db(db):
+    return CountingDatabase(db)
+
+
+@pytest.fixture
+def client(db, monkeypatch, tmp_path):
+    import server
+    from auth import Authenticator
+    from media import LocalMediaBackend, MediaStore
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "media_store", MediaStore(db, LocalMediaBackend(tmp_path)))
+    monkeypatch.setattr(server, "authenticator", Authenticator(db.users, "test-secret"))
+    monkeypatch.setattr(server.job_queue, "collection", db.jobs)
+    monkeypatch.setattr(server.job_queue, "workers", 0)
+    monkeypatch.setattr(server.view_counter, "collection", db.listings)
+    monkeypatch.setattr(server.stats_snapshotter, "db", db)
+    with TestClient(server.app) as client:
+        yield client
+
+
+def register(client, name: str, email: str):
+    response = client.post("/api/auth/register", json={"name": name, "email": email, "password": "Passwort123"})
+    assert response.status_code == 200, response.text
+    return response.json()["user"]["id"], response.json()["token"]
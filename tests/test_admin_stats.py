@@ -0,0 +1,29 @@
+import server
+import stats
+
+
+async def test_toggles_only_count_real_transitions(db, monkeypatch):
+    monkeypatch.setattr(server, "db", db)
+    # Documents from before the flags were written on insert
+    await db.users.insert_many([{"id": "old", "name": "Alt"}, {"id": "seller", "name": "Verkäufer", "is_verified": True}])
+    await db.listings.insert_many([{"id": "old", "category": "autos"}, {"id": "pinned", "category": "autos", "is_pinned": True}])
+    await stats.recount(db)
+
+    await server.unverify_seller("old", current_user={"user_id": "admin"})
+    await server.unpin_listing("old", current_user={"user_id": "admin"})
+    figures = await db.stats.find_one({"_id": stats.COUNTERS_ID})
+    assert figures["verified_sellers"] == 1 and figures["pinned_listings"] == 1
+
+    await server.unverify_seller("seller", current_user={"user_id": "admin"})
+    await server.unpin_listing("pinned", current_user={"user_id": "admin"})
+    await server.unpin_listing("pinned", current_user={"user_id": "admin"})
+    figures = await db.stats.find_one({"_id": stats.COUNTERS_ID})
+    assert figures["verified_sellers"] == 0 and figures["pinned_listings"] == 0
+
+
+async def test_recount_backfills_flags(db):
+    await db.users.insert_one({"id": "old", "name": "Alt"})
+    await db.listings.insert_one({"id": "old", "category": "autos"})
+    await stats.recount(db)
+    assert (await db.users.find_one({"id": "old"}))["is_verified"] is False
+    assert (await db.listings.find_one({"id": "old"}))["is_pinned"] is False
@@ -0,0 +1,14 @@
+import server
+from conftest import register
+
+
+def test_profile_cache_keeps_only_auth_fields(client, db):
+    user_id, token = register(client, "Anna", "anna@example.com")
+    image = "data:image/png;base64," + "A" * 10_000
+    response = client.put("/api/users/profile", json={"profile_image": image}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/auth/profile", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200 and response.json()["profile_image"] == image
+    cached = server.authenticator._profiles[user_id]
+    assert cached["name"] == "Anna" and "profile_image" not in cached and "password" not in cached
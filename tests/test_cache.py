@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from cache import MemoryBackend, ResponseCache
+
+
+async def test_waiters_take_over_a_cancelled_load():
+    cache = ResponseCache(MemoryBackend())
+    started = asyncio.Event()
+    calls = []
+
+    async def slow():
+        calls.append("slow")
+        started.set()
+        await asyncio.sleep(10)
+
+    async def fast():
+        calls.append("fast")
+        return {"ok": True}
+
+    owner = asyncio.create_task(cache.get_or_load("users:profile", {"id": "u1"}, slow))
+    await started.wait()
+    waiters = [asyncio.create_task(cache.get_or_load("users:profile", {"id": "u1"}, fast)) for _ in range(3)]
+    await asyncio.sleep(0)
+    owner.cancel()
+
+    assert await asyncio.gather(*waiters) == [{"ok": True}] * 3
+    # One waiter reloaded, the others shared its load
+    assert calls == ["slow", "fast"]
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+
+
+async def test_cancelled_waiter_leaves_the_load_running():
+    cache = ResponseCache(MemoryBackend())
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        return 1
+
+    owner = asyncio.create_task(cache.get_or_load("users:profile", None, load))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get_or_load("users:profile", None, load))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    release.set()
+    assert await owner == 1
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
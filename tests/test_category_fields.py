@@ -0,0 +1,35 @@
+from categories import registry
+from conftest import register
+from search import reindex_listings
+
+
+def test_number_fields_are_stored_as_numbers():
+    values = {"brand": "BMW", "year": "2015", "mileage": " 120000 ", "power": "150.5", "seats": ""}
+    assert registry.validate("cars", values) == []
+    assert registry.normalize("cars", values) == {"brand": "BMW", "year": 2015, "mileage": 120000, "power": 150.5, "seats": ""}
+    assert registry.validate("cars", {"year": "nan"}) == ["Baujahr muss eine Zahl sein"]
+
+
+def test_range_filter_matches_number_posted_as_string(client):
+    _, token = register(client, "Anna", "anna@example.com")
+    response = client.post("/api/listings", headers={"Authorization": f"Bearer {token}"}, json={
+        "title": "BMW 320d Touring", "description": "Scheckheftgepflegt", "price": 12000, "category": "cars",
+        "images": [], "category_fields": {"brand": "BMW", "year": "2015"},
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()["category_fields"]["year"] == 2015
+
+    found = client.get("/api/listings", params={"category": "cars", "cf.year.min": "2010"}).json()
+    assert [listing["title"] for listing in found] == ["BMW 320d Touring"]
+    assert client.get("/api/listings", params={"category": "cars", "cf.year.max": "2014"}).json() == []
+
+
+async def test_reindex_converts_stored_number_strings(db):
+    await db.listings.insert_many([
+        {"id": "l1", "title": "Golf", "description": "", "category": "cars", "category_fields": {"year": "2012", "brand": "Volkswagen"}},
+        {"id": "l2", "title": "Polo", "description": "", "category": "cars", "category_fields": {"year": 2018}},
+    ])
+    stats = await reindex_listings(db)
+    assert stats == {"indexed": 2, "normalized": 1}
+    assert (await db.listings.find_one({"id": "l1"}))["category_fields"] == {"year": 2012, "brand": "Volkswagen"}
+    assert await db.listings.count_documents({"category_fields.year": {"$gte": 2010}}) == 2
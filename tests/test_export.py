@@ -0,0 +1,9 @@
+import export
+import indexes
+
+
+def test_resume_lookups_are_indexed():
+    # resume_filter looks the last row up by id in every exported collection
+    unique_ids = {index.collection for index in indexes.INDEXES
+                  if index.model.document['key'] == {"id": 1} and index.model.document.get('unique')}
+    assert {spec.collection for spec in export.EXPORTS.values()} <= unique_ids
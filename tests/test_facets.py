@@ -0,0 +1,15 @@
+import facets
+
+
+async def test_price_histogram_skips_invalid_prices(db):
+    await db.listings.insert_many([
+        {"id": "a", "category": "cars", "price": 30},
+        {"id": "b", "category": "cars", "price": 750_000},
+        {"id": "c", "category": "cars", "price": -5},
+        {"id": "d", "category": "cars", "price": None},
+        {"id": "e", "category": "cars", "price": "VB"},
+        {"id": "f", "category": "cars"},
+    ])
+    counts = await facets.facet_counts(db.listings, {}, {}, None)
+    assert counts["total"] == 6
+    assert counts["price"] == [{"min": 0, "max": 50, "count": 1}, {"min": 500000, "max": None, "count": 1}]
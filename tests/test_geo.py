@@ -0,0 +1,47 @@
+import pytest
+
+import geo
+import server
+
+# (postcode, place, real centre) of places at the edges of their postcode zones
+EDGE_PLACES = [
+    ("25992", "List", (55.0192, 8.4313)),
+    ("17424", "Heringsdorf", (53.95, 14.1667)),
+    ("83471", "Berchtesgaden", (47.6324, 13.0019)),
+    ("26465", "Langeoog", (53.7455, 7.4817)),
+    ("52156", "Monschau", (50.5546, 6.24)),
+]
+
+
+@pytest.mark.parametrize("postcode,place,centre", EDGE_PLACES)
+def test_places_resolve_to_their_centre(postcode, place, centre):
+    assert geo.geocode(f"{postcode} {place}") == centre
+
+
+def test_postcode_picks_among_places_of_one_name():
+    # The larger Heringsdorf is in Schleswig-Holstein; 17424 is the one on Usedom
+    assert geo.haversine_km(geo.geocode("Heringsdorf"), geo.geocode("17424 Heringsdorf")) > 100
+    assert geo.geocode("15230 Frankfurt") == geo.geocode("Frankfurt (Oder)")
+    assert geo.geocode("Frankfurt") == geo.geocode("Frankfurt am Main")
+    assert geo.geocode("33790 Halle") != geo.geocode("Halle") == geo.geocode("Halle (Saale)")
+
+
+def test_bare_postcodes_are_only_zone_accurate():
+    errors = [geo.haversine_km(geo.geocode(postcode), centre) for postcode, _, centre in EDGE_PLACES]
+    assert max(errors) < geo.POSTCODE_ZONE_ERROR_KM
+    # A bare postcode can land outside a small radius around the real place
+    assert max(errors) > 25
+
+
+@pytest.mark.parametrize("location", ["Kleinstadt ohne Eintrag", "ruhige Lage", "Wohnung nahe Uni", "Abholung"])
+def test_ordinary_words_are_no_places(location):
+    assert geo.geocode(location) is None
+
+
+def test_radius_search_keeps_unlocated_listings():
+    center, query = server.place_filter("Berlin", None, None, 25, None)
+    assert query == {"$or": [geo.radius_filter(center, 25), geo.UNLOCATED]}
+    assert server.place_filter("Berlin", None, None, 25, None, located_only=True)[1] == geo.radius_filter(center, 25)
+    # A map viewport can only show listings with coordinates
+    bbox = "13.0,52.0,14.0,53.0"
+    assert server.place_filter("Berlin", None, None, 25, bbox)[1] == {"$and": [geo.bbox_filter(bbox), geo.radius_filter(center, 25)]}
@@ -0,0 +1,77 @@
+import asyncio
+
+from pymongo.errors import DuplicateKeyError
+
+from jobs import DONE, JobQueue
+
+
+async def test_unencodable_result_is_stored_as_repr(db):
+    queue = JobQueue(db, workers=0)
+
+    @queue.handler("report")
+    async def report(ctx):
+        return {"rows": {1, 2, 3}}
+
+    job = await queue.enqueue("report")
+    assert await queue.run_pending() == 1
+    stored = await db.jobs.find_one({"id": job["id"]})
+    assert stored["status"] == DONE
+    assert stored["result"] == repr({"rows": {1, 2, 3}})
+
+
+async def test_worker_survives_a_failing_job_write(db, caplog):
+    queue = JobQueue(db, workers=1, poll_interval=0.01)
+    ran = []
+
+    @queue.handler("count")
+    async def count(ctx):
+        ran.append(ctx.params["n"])
+        if ctx.params["n"] == 1:
+            # Lets _fail's status write blow up, outside the handler's own error handling
+            ctx.job["attempts"] = None
+            raise ValueError("boom")
+
+    await queue.enqueue("count", {"n": 1})
+    queue.start()
+    try:
+        await queue.enqueue("count", {"n": 2})
+        for _ in range(100):
+            if 2 in ran:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await queue.stop()
+    assert ran[:2] == [1, 2]
+    assert "could not be completed" in caplog.text
+
+
+async def test_heartbeat_keeps_a_long_job_leased(db):
+    queue = JobQueue(db, workers=0, lease_seconds=0.3)
+    other = JobQueue(db, workers=0, lease_seconds=0.3)
+    claimed_by_other = []
+
+    @queue.handler("slow")
+    async def slow(ctx):
+        # Longer than the lease, without a save() in between
+        for _ in range(5):
+            await asyncio.sleep(0.15)
+            claimed_by_other.append(await other.claim())
+
+    job = await queue.enqueue("slow")
+    assert await queue.run_pending() == 1
+    assert claimed_by_other == [None] * 5
+    assert (await db.jobs.find_one({"id": job["id"]}))["status"] == DONE
+
+
+async def test_unique_enqueue_survives_a_concurrent_insert(db, monkeypatch):
+    queue = JobQueue(db, workers=0)
+    queue.handler("media_gc")(lambda ctx: None)
+    first = await queue.enqueue("media_gc", unique=True)
+
+    # The partial unique index rejects the upsert of an enqueue that lost the race
+    async def racing(*args, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error")
+    monkeypatch.setattr(queue.collection, "find_one_and_update", racing)
+    second = await queue.enqueue("media_gc", unique=True)
+    assert second["id"] == first["id"]
+    assert await db.jobs.count_documents({"type": "media_gc"}) == 1
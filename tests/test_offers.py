@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from loaders import Loaders
+
+
+async def seed_offers(db, n: int):
+    now = datetime.utcnow()
+    for i in range(n):
+        await db.users.insert_one({"id": f"buyer{i}", "name": f"Käufer {i}", "profile_image": None})
+        await db.listings.insert_one({"id": f"listing{i}", "seller_id": "seller", "seller_name": "Verkäuferin",
+                                      "title": f"Anzeige {i}", "price": 100 + i, "category": "other",
+                                      "images": [f"/api/media/{i:064x}"], "thumbnails": [], "created_at": now})
+        await db.offers.insert_one({"id": f"offer{i}", "listing_id": f"listing{i}", "buyer_id": f"buyer{i}",
+                                    "seller_id": "seller", "offered_price": 90 + i, "status": "pending",
+                                    "created_at": now - timedelta(minutes=i)})
+
+
+@pytest.mark.parametrize("endpoint", [server.get_received_offers, server.get_my_offers])
+async def test_offers_use_constant_queries(endpoint, db, counting_db, monkeypatch):
+    monkeypatch.setattr(server, "db", counting_db)
+    operations = {}
+    for n in (1, 25):
+        await db.offers.delete_many({})
+        await seed_offers(db, n)
+        counting_db.operations.clear()
+        offers = await endpoint(current_user={"user_id": "seller"}, loaders=Loaders(counting_db))
+        assert len(offers) == n
+        assert offers[0]["buyer_name"] == "Käufer 0" and offers[0]["listing_title"] == "Anzeige 0"
+        operations[n] = dict(counting_db.operations)
+    # One query for the offers, one per related collection, however many offers there are
+    assert operations[1] == operations[25] == {"offers": 1, "users": 1, "listings": 1}
+
+
+async def test_sent_offers_resolve_sellers(db, counting_db, monkeypatch):
+    monkeypatch.setattr(server, "db", counting_db)
+    await db.users.insert_one({"id": "seller", "name": "Verkäuferin"})
+    await seed_offers(db, 3)
+    offers = await server.get_sent_offers(current_user={"user_id": "buyer1"}, loaders=Loaders(counting_db))
+    assert [offer["seller_name"] for offer in offers] == ["Verkäuferin"]
+    assert offers[0]["original_price"] == 101
+    assert counting_db.total == 3
+
+
+async def test_favorites_use_constant_queries(db, counting_db, monkeypatch):
+    monkeypatch.setattr(server, "db", counting_db)
+    operations = {}
+    for n in (1, 25):
+        await db.favorites.delete_many({})
+        await seed_offers(db, n)
+        for i in range(n):
+            await db.favorites.insert_one({"id": f"fav{i}", "user_id": "buyer", "listing_id": f"listing{i}",
+                                           "created_at": datetime.utcnow() - timedelta(minutes=i)})
+        counting_db.operations.clear()
+        response = await server.get_favorites(current_user={"user_id": "buyer"}, loaders=Loaders(counting_db))
+        favorites = json.loads(response.body)
+        assert [favorite["id"] for favorite in favorites] == [f"listing{i}" for i in range(n)]
+        operations[n] = dict(counting_db.operations)
+    # The favorites, then all their listings in one query
+    assert operations[1] == operations[25] == {"favorites": 1, "listings": 1}
@@ -0,0 +1,119 @@
+"""Explain every query declared in indexes.py against a real, seeded MongoDB.
+
+Set TEST_MONGO_URL (e.g. mongodb://localhost:27017) to run; a throwaway
+database is seeded once per module and dropped. mongomock cannot explain
+queries. The seed spreads listings over categories, cities, prices, ages and
+videos so the planner has real alternatives to choose between.
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+import geo
+import indexes
+import search as listing_search
+
+MONGO_URL = os.getenv("TEST_MONGO_URL")
+LISTINGS = 20_000
+USERS = 500
+MESSAGES = 20_000
+
+requires_mongo = pytest.mark.skipif(not MONGO_URL, reason="TEST_MONGO_URL not set")
+
+CATEGORIES = ["cars", "electronics", "furniture", "real_estate", "fashion", "sports", "garden", "other"]
+PLACES = ["Berlin", "Hamburg", "München", "Köln", "Leipzig", "10115", "80331", "Kleinstadt ohne Eintrag"]
+TITLES = ["VW Golf Kombi", "BMW 320d", "iPhone 13", "Sofa grau", "Esstisch Eiche", "Fahrrad 28 Zoll", "Gartenbank"]
+
+
+def seed(db, rng: random.Random):
+    now = datetime.utcnow()
+    users = [f"u{i}" for i in range(USERS)]
+    db.users.insert_many([{"id": user, "name": f"Nutzer {i}", "email": f"{user}@example.com", "role": "user",
+                           "is_verified": False, "created_at": now - timedelta(days=i)} for i, user in enumerate(users)])
+    listings = []
+    for i in range(LISTINGS):
+        title = rng.choice(TITLES)
+        location = rng.choice(PLACES)
+        fields = {"brand": rng.choice(["VW", "BMW", "Audi"]), "year": rng.randint(1995, 2024)} if i % 8 == 0 else {}
+        listings.append({
+            "id": f"l{i}", "seller_id": rng.choice(users), "title": title, "price": rng.choice([0, 50, 500, 5000, 50000]),
+            "category": CATEGORIES[i % len(CATEGORIES)], "category_fields": fields, "location": location,
+            "videos": [f"/api/media/{i:064x}"] if i % 50 == 0 else [], "views": rng.randint(0, 5000),
+            "is_pinned": False, "created_at": now - timedelta(minutes=i),
+            **geo.geo_fields(location), **listing_search.search_fields(title, "Gepflegt, Abholung", fields),
+        })
+    db.listings.insert_many(listings)
+    db.messages.insert_many([{
+        "id": str(uuid.uuid4()), "listing_id": f"l{i % 2000}", "from_user_id": rng.choice(users),
+        "to_user_id": rng.choice(users), "content": "Hallo", "read": rng.random() < 0.9,
+        "created_at": now - timedelta(minutes=i),
+    } for i in range(MESSAGES)])
+    db.offers.insert_many([{"id": f"o{i}", "listing_id": f"l{i}", "buyer_id": rng.choice(users), "seller_id": rng.choice(users),
+                            "offered_price": 10, "status": "pending", "created_at": now - timedelta(hours=i)} for i in range(2000)])
+    db.favorites.insert_many([{"id": f"f{i}", "user_id": users[i % USERS], "listing_id": f"l{i}",
+                               "created_at": now - timedelta(hours=i)} for i in range(2000)])
+    db.jobs.insert_many([{"id": f"j{i}", "type": "delete_user", "params": {"user_id": f"u{i}"}, "status": "done",
+                          "run_at": now, "created_at": now - timedelta(minutes=i)} for i in range(1000)])
+
+
+@pytest.fixture(scope="module")
+def mongo_db_name():
+    with MongoClient(MONGO_URL, serverSelectionTimeoutMS=3000) as client:
+        try:
+            client.admin.command("ping")
+        except ServerSelectionTimeoutError:
+            pytest.skip(f"no MongoDB at {MONGO_URL}")
+        name = f"test_plans_{uuid.uuid4().hex[:8]}"
+        seed(client[name], random.Random(1))
+
+        async def apply():
+            motor = AsyncIOMotorClient(MONGO_URL)
+            try:
+                return await indexes.ensure_indexes(motor[name])
+            finally:
+                motor.close()
+        result = asyncio.run(apply())
+        try:
+            assert not result["failed"], result["failed"]
+            yield name
+        finally:
+            client.drop_database(name)
+
+
+@pytest.fixture
+async def mongo_db(mongo_db_name):
+    client = AsyncIOMotorClient(MONGO_URL)
+    yield client[mongo_db_name]
+    client.close()
+
+
+@requires_mongo
+@pytest.mark.parametrize("collection,query", indexes.declared_queries(),
+                         ids=[f"{collection}:{query.route}" for collection, query in indexes.declared_queries()])
+async def test_query_uses_an_index(mongo_db, collection, query):
+    assert await indexes.plan_problems(mongo_db, collection, query) == []
+
+
+def test_seed_is_valid():
+    db = mongomock.MongoClient()["plans"]
+    seed(db, random.Random(1))
+    assert db.listings.count_documents(listing_search.HAS_VIDEOS) == LISTINGS // 50
+    assert db.listings.count_documents({"geo": None}) > 0
+
+
+def test_unbounded_scans_are_found():
+    def fetch(bounds, **scan):
+        return {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "filter": {"price": {"$gte": 100}}, "inputStage": {
+            "stage": "IXSCAN", "indexName": "created_at_-1_id_-1", "indexBounds": bounds, **scan}}}
+    full = {"created_at": ["[MaxKey, MinKey]"], "id": ["[MaxKey, MinKey]"]}
+    assert list(indexes._unbounded_fetches(fetch(full))) == ["created_at_-1_id_-1"]
+    assert list(indexes._unbounded_fetches(fetch(full, isPartial=True))) == []
+    assert list(indexes._unbounded_fetches(fetch({**full, "category": ['["cars", "cars"]']}))) == []
@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+
+from similarity import CategoryIndex, CategorySchema, SimilarityIndex, feature_projection
+
+
+def car(i: int, rng: random.Random) -> dict:
+    return {
+        "id": f"c{i}", "seller_id": f"s{i % 7}", "category": "cars", "price": rng.choice([1500, 8000, 20000]),
+        "title": "Auto", "description": "lang " * 50,
+        "category_fields": {"brand": rng.choice(["BMW", "Audi"]), "year": rng.randint(2000, 2024),
+                            "mileage": rng.randint(0, 200_000), "color": rng.choice(["Schwarz", "Weiß"])},
+    }
+
+
+def test_projection_reads_only_compared_fields():
+    projection = feature_projection()
+    assert "category_fields.year" in projection and "category_fields.brand" in projection
+    # Text fields are never compared
+    assert "category_fields.storage" not in projection
+    assert "title" not in projection and "category_fields" not in projection
+
+
+async def test_build_matches_incremental_index(db):
+    rng = random.Random(3)
+    cars = [car(i, rng) for i in range(60)]
+    await db.listings.insert_many([dict(listing) for listing in cars])
+    index = SimilarityIndex(enabled=False)
+    await index.build(db.listings, batch_size=16)
+
+    # The same rows put one by one with the same fit
+    schema = CategorySchema("cars")
+    schema.fit(np.stack([schema.raw_numeric(listing) for listing in cars]))
+    reference = CategoryIndex(schema)
+    for listing in cars:
+        reference.put(listing["id"], listing["seller_id"], schema.encode(listing))
+
+    for listing in cars[:10]:
+        assert await index.nearest(listing["id"], 5) == reference.nearest(listing["id"], 5)
+    assert await index.nearest("unknown", 5) is None
+
+
+async def test_nearest_skips_removed_listings_and_the_seller(db):
+    rng = random.Random(4)
+    await db.listings.insert_many([car(i, rng) for i in range(20)])
+    index = SimilarityIndex(enabled=False)
+    await index.build(db.listings)
+    index.remove("c1")
+    ids = await index.nearest("c0", 19)
+    assert ids and "c1" not in ids
+    # Never the listing's own seller (s0)
+    assert not {listing_id for listing_id in ids if int(listing_id[1:]) % 7 == 0}
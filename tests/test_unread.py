@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import unread
+
+
+async def add_messages(db, *pairs, read=False):
+    for i, (sender, recipient) in enumerate(pairs):
+        await db.messages.insert_one({"id": f"m{sender}{recipient}{i}", "from_user_id": sender, "to_user_id": recipient,
+                                      "listing_id": "l1", "read": read, "created_at": datetime.utcnow()})
+
+
+async def test_decrement_seeds_missing_counter(db):
+    await db.users.insert_one({"id": "u1"})
+    await add_messages(db, ("u2", "u1"), ("u2", "u1"), ("u1", "u1"))
+    # One of the two was just marked read; the counter did not exist yet
+    await db.messages.update_one({"id": "mu2u10"}, {"$set": {"read": True}})
+    assert await unread.decrement(db, "u1", 1) == 1
+    assert (await db.users.find_one({"id": "u1"}))[unread.FIELD] == 1
+    assert await unread.decrement(db, "u1", 5) == 0
+
+
+async def test_discard_and_reconcile_ignore_messages_to_oneself(db):
+    await db.users.insert_many([{"id": "u1", unread.FIELD: 2}, {"id": "u2", unread.FIELD: 0}])
+    await db.conversations.insert_one({"id": "l1:u1:u2", "participants": ["u1", "u2"], "unread": {"u1": 2, "u2": 0}})
+    await add_messages(db, ("u2", "u1"), ("u2", "u1"), ("u1", "u1"))
+    assert await unread.reconcile(db) == {"users_fixed": 0, "conversations_fixed": 0}
+
+    await unread.discard_messages(db, {"listing_id": "l1"})
+    assert (await db.users.find_one({"id": "u1"}))[unread.FIELD] == 0
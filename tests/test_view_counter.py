@@ -0,0 +1,27 @@
+from view_counter import ViewCounter
+
+
+class FailingCollection:
+    async def bulk_write(self, ops, ordered=True):
+        raise ConnectionError("database unreachable")
+
+
+async def test_buffer_is_capped_while_flushes_fail(db):
+    counter = ViewCounter(FailingCollection(), max_pending=10, user_views=FailingCollection())
+    for i in range(8):
+        counter.record(f"listing{i % 3}", user_id="u1")
+    await counter.flush()
+    for i in range(20):
+        counter.record(f"listing{i % 3}", user_id="u1")
+    await counter.flush()
+    stats = counter.stats()
+    assert stats["pending"] == 10
+    assert stats["dropped"] == 18
+    assert stats["failures"] == 4
+
+    counter.collection, counter.user_views = db.listings, db.user_views
+    for i in range(3):
+        await db.listings.insert_one({"id": f"listing{i}", "views": 0})
+    await counter.flush()
+    assert counter.record("listing0")
+    assert sum([doc["views"] async for doc in db.listings.find()]) == 10
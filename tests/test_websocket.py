@@ -0,0 +1,35 @@
+import logging
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from conftest import register
+
+
+def test_revoked_token_closes_socket(client):
+    user_id, token = register(client, "Anna", "anna@example.com")
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        client.portal.call(server.revoke_sessions, user_id, client.portal.call(server.authenticator.revoke, user_id))
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 4401
+
+
+def test_newer_token_survives_revocation_event(client):
+    user_id, token = register(client, "Anna", "anna@example.com")
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        client.portal.call(server.revoke_sessions, user_id, 0)
+        client.portal.call(server.publish_unread, user_id, 3)
+        assert ws.receive_json() == {"type": "unread", "count": 3}
+
+
+def test_failed_push_is_logged_and_closes_socket(client, caplog):
+    user_id, token = register(client, "Anna", "anna@example.com")
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        with caplog.at_level(logging.ERROR, logger=server.logger.name):
+            client.portal.call(server.hub.publish, user_id, {"type": "broken", "value": object()})
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+    assert closed.value.code == 1011
+    assert "WebSocket push" in caplog.text
@@ -0,0 +1,109 @@
+"""Per-user unread message counters maintained on write.
+
+``users.unread_messages`` is incremented when a message is delivered and
+decremented by the number of messages actually marked read, so the unread
+badge is a single-document read. ``reconcile`` repairs drift offline.
+"""
+import logging
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FIELD = "unread_messages"
+# Messages to oneself are never unread, as in conversations.record_message
+UNREAD = {"read": False, "$expr": {"$ne": ["$from_user_id", "$to_user_id"]}}
+
+
+def unread_query(user_id: str) -> dict:
+    return {"to_user_id": user_id, **UNREAD}
+
+
+async def increment(db, user_id: str, n: int = 1) -> int:
+    """Count ``n`` newly delivered messages; call after they are inserted"""
+    user = await db.users.find_one_and_update(
+        {"id": user_id, FIELD: {"$exists": True}}, {"$inc": {FIELD: n}},
+        projection={"_id": 0, FIELD: 1}, return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        # No counter yet: seeding it from the messages already includes the new ones
+        return await get(db, user_id)
+    return user[FIELD]
+
+
+async def decrement(db, user_id: str, n: int) -> int:
+    """Subtract ``n`` messages that were marked read or deleted; call after the change"""
+    # Pipeline update so concurrent drift can never push the counter below zero
+    user = await db.users.find_one_and_update(
+        {"id": user_id, FIELD: {"$exists": True}},
+        [{"$set": {FIELD: {"$max": [0, {"$subtract": [f"${FIELD}", n]}]}}}],
+        projection={"_id": 0, FIELD: 1}, return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        # No counter yet: seeding it from the messages already leaves those out
+        return await get(db, user_id)
+    return user[FIELD]
+
+
+async def get(db, user_id: str) -> int:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, FIELD: 1})
+    if user is None:
+        return 0
+    if FIELD not in user:
+        # Users created before the counter existed: initialize once from the messages
+        count = await db.messages.count_documents(unread_query(user_id))
+        await db.users.update_one({"id": user_id, FIELD: {"$exists": False}}, {"$set": {FIELD: count}})
+        return count
+    return user[FIELD]
+
+
+async def discard_messages(db, query: dict):
+    """Decrement recipients' counters for unread messages that are about to be deleted"""
+    pipeline = [
+        {"$match": {"$and": [query, UNREAD]}},
+        {"$group": {"_id": "$to_user_id", "n": {"$sum": 1}}},
+    ]
+    async for row in db.messages.aggregate(pipeline):
+        await decrement(db, row['_id'], row['n'])
+
+
+async def reconcile(db, batch_size: int = 500) -> dict:
+    """Recompute per-user and per-conversation unread counters from the messages collection"""
+    per_user = {}
+    per_conversation = {}
+    pipeline = [
+        {"$match": UNREAD},
+        {"$group": {"_id": {"listing_id": "$listing_id", "from": "$from_user_id", "to": "$to_user_id"}, "n": {"$sum": 1}}},
+    ]
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        key = row['_id']
+        per_user[key['to']] = per_user.get(key['to'], 0) + row['n']
+        first, second = sorted((key['from'], key['to']))
+        per_conversation[(f"{key['listing_id']}:{first}:{second}", key['to'])] = row['n']
+
+    stats = {"users_fixed": 0, "conversations_fixed": 0}
+    ops = []
+    async for user in db.users.find({}, {"_id": 0, "id": 1, FIELD: 1}).batch_size(batch_size):
+        expected = per_user.get(user['id'], 0)
+        if user.get(FIELD) != expected:
+            ops.append(UpdateOne({"id": user['id']}, {"$set": {FIELD: expected}}))
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        stats["users_fixed"] = len(ops)
+
+    ops = []
+    async for conv in db.conversations.find({}, {"_id": 0, "id": 1, "participants": 1, "unread": 1}).batch_size(batch_size):
+        stored = conv.get('unread') or {}
+        expected = {uid: per_conversation.get((conv['id'], uid), 0) for uid in conv['participants']}
+        if any(stored.get(uid, 0) != n for uid, n in expected.items()):
+            ops.append(UpdateOne({"id": conv['id']}, {"$set": {"unread": expected}}))
+        if len(ops) >= batch_size:
+            await db.conversations.bulk_write(ops, ordered=False)
+            stats["conversations_fixed"] += len(ops)
+            ops = []
+    if ops:
+        await db.conversations.bulk_write(ops, ordered=False)
+        stats["conversations_fixed"] += len(ops)
+    if stats["users_fixed"] or stats["conversations_fixed"]:
+        logger.info(f"Unread counters reconciled: {stats}")
+    return stats
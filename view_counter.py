@@ -0,0 +1,156 @@
+"""Write-coalescing listing view counter.
+
+Views are buffered per worker and flushed with one unordered ``bulk_write``
+every ``flush_interval`` seconds, whenever ``max_pending`` views are buffered,
+and on shutdown. A crash loses at most ``max_pending`` views or one interval
+worth of views, whichever comes first. While flushes fail, failed batches are
+kept for the next attempt but the buffer does not grow past ``max_pending``
+views: further views are dropped and counted in ``dropped``.
+
+Views of logged-in users are also accumulated per (user, listing) into
+``user_views`` when that collection is given; recommendations read it.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from cachetools import TTLCache
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    def __init__(self, collection, flush_interval: float = 5.0, max_pending: int = 1000,
+                 dedupe_window: float = 0, dedupe_size: int = 100_000, user_views=None):
+        self.collection = collection
+        self.user_views = user_views
+        self._user_pending: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._pending_total = 0
+        # (listing_id, viewer) pairs seen recently; None disables deduplication
+        self._seen = TTLCache(maxsize=dedupe_size, ttl=dedupe_window) if dedupe_window > 0 else None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_scheduled = False
+        # Set while the last flush failed; record() then stops buffering at max_pending
+        self._failing = False
+        self._user_failing = False
+        self.recorded = 0
+        self.dropped = 0
+        self.dropped_user_views = 0
+        self.deduplicated = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def record(self, listing_id: str, viewer: Optional[str] = None, user_id: Optional[str] = None) -> bool:
+        """Count a view; returns False if it was a repeat view inside the dedupe window
+        or was dropped because the database is failing and the buffer is full.
+        ``user_id`` (logged-in viewers only) also logs the view for that user."""
+        if self._failing and self._pending_total >= self.max_pending:
+            self.dropped += 1
+            return False
+        if self._seen is not None and viewer:
+            key = (listing_id, viewer)
+            if key in self._seen:
+                self.deduplicated += 1
+                return False
+            self._seen[key] = True
+        self._pending[listing_id] += 1
+        self._pending_total += 1
+        if user_id and self.user_views is not None:
+            if self._user_failing and len(self._user_pending) >= self.max_pending:
+                self.dropped_user_views += 1
+            else:
+                self._user_pending[(user_id, listing_id)] += 1
+        self.recorded += 1
+        if self._pending_total >= self.max_pending and not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().create_task(self.flush())
+        return True
+
+    def pending(self, listing_id: str) -> int:
+        return self._pending.get(listing_id, 0)
+
+    async def flush(self):
+        async with self._lock:
+            self._flush_scheduled = False
+            await self._flush_user_views()
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, defaultdict(int)
+            self._pending_total = 0
+            ops = [UpdateOne({"id": listing_id}, {"$inc": {"views": n}}) for listing_id, n in batch.items()]
+            try:
+                await self.collection.bulk_write(ops, ordered=False)
+                self.flushes += 1
+                self._failing = False
+            except Exception as e:
+                # Keep the counts for the next attempt; record() stops adding at max_pending
+                self.failures += 1
+                self._failing = True
+                for listing_id, n in batch.items():
+                    self._pending[listing_id] += n
+                    self._pending_total += n
+                logger.warning(f"Failed to flush {len(ops)} view counters: {e}")
+
+    async def _flush_user_views(self):
+        if not self._user_pending:
+            return
+        batch, self._user_pending = self._user_pending, defaultdict(int)
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne({"user_id": user_id, "listing_id": listing_id},
+                      {"$inc": {"count": n}, "$set": {"last_viewed_at": now}}, upsert=True)
+            for (user_id, listing_id), n in batch.items()
+        ]
+        try:
+            await self.user_views.bulk_write(ops, ordered=False)
+            self._user_failing = False
+        except Exception as e:
+            self.failures += 1
+            self._user_failing = True
+            for key, n in batch.items():
+                self._user_pending[key] += n
+            logger.warning(f"Failed to flush {len(ops)} user views: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending_total,
+            "recorded": self.recorded,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "dropped_user_views": self.dropped_user_views,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+
+def view_counter_from_env(db) -> ViewCounter:
+    return ViewCounter(
+        db.listings,
+        flush_interval=float(os.getenv('VIEW_FLUSH_SECONDS', '5')),
+        max_pending=int(os.getenv('VIEW_MAX_PENDING', '1000')),
+        dedupe_window=float(os.getenv('VIEW_DEDUPE_SECONDS', '0')),
+        user_views=db.user_views,
+    )